@@ -1,13 +1,35 @@
+import threading
+from collections import deque
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
 import requests
-from config import API_KEY, BASE_URL
+
+import metrics
+from http_client import http_get
+from json_codec import response_json
+from geocoding import geocode_candidates, get_geocode_cache, normalize_address
+from rate_limit import get_limiter
+from config import (API_KEY, BASE_URL, GEOCODE_CACHE_ENABLED, GEOCODE_NOMINATIM_DOMAIN, GEOCODE_RATE_LIMIT_PER_SECOND,
+                    AIC_GEOCODER_ORDER, AIC_HEDGE_AFTER_SECONDS, AIC_MAX_CONCURRENCY)
+
+# Provider name -> its own thread pool, so a slow provider cannot hold up lookups with a fast one
+_executors = {}
+# Provider name -> lookups submitted and not yet finished
+_in_flight = {}
+_executor_lock = threading.Lock()
 
 def fetch_address(search_text):
-    url = f"{BASE_URL}?input={search_text}&api_key={API_KEY}"
-    response = requests.get(url)
-    if response.status_code == 200:
-        return response.json()
-    else:
-        return None
+    # Ola Maps autocomplete; params are URL-encoded by requests. None when the call fails.
+    # While Ola is paused after repeated failures this fails at once, so hedging moves on to the next provider.
+    try:
+        response = http_get(BASE_URL, params={"input": search_text, "api_key": API_KEY}, circuit_wait=0)
+        if response.status_code == 200:
+            return response_json(response)
+        metrics.increment("lookup_errors_total", source="ola", error=f"HTTP {response.status_code}")
+    except (requests.exceptions.RequestException, ValueError) as e:
+        metrics.increment("lookup_errors_total", source="ola", error=type(e).__name__)
+    return None
 
 def process_data(data):
     if data and data['status'] == 'ok' and data['predictions']:
@@ -18,4 +40,150 @@ def process_data(data):
         lng = location['lng']
         return description, lat, lng
     else:
-        return None, None, None
\ No newline at end of file
+        return None, None, None
+
+def ola_candidates(search_text, max_results=5):
+    # Up to max_results Ola predictions as candidate dicts; None when Ola could not be asked (failures are not cached)
+    normalized = normalize_address(search_text)
+    if not normalized:
+        return []
+    cache_key = f"ola:{max_results}:{normalized}"
+    if GEOCODE_CACHE_ENABLED:
+        cached = get_geocode_cache().get(cache_key)
+        if cached is not None:
+            return cached
+
+    data = fetch_address(search_text)
+    if not data or data.get('status') != 'ok':
+        if data:
+            metrics.increment("lookup_errors_total", source="ola", error=f"status {data.get('status')}")
+        return None
+    results = []
+    for prediction in (data.get('predictions') or [])[:max_results]:
+        location = prediction.get('geometry', {}).get('location', {})
+        if 'lat' in location and 'lng' in location:
+            results.append({'latitude': location['lat'], 'longitude': location['lng'],
+                            'address': prediction.get('description', '')})
+    metrics.increment("lookups_total", source="ola", result="found" if results else "not_found")
+    if GEOCODE_CACHE_ENABLED:
+        get_geocode_cache().set(cache_key, results)
+    return results
+
+# Provider name -> candidate lookup; each keeps its own cache entries
+AIC_GEOCODERS = {
+    "ola": ola_candidates,
+    "nominatim": lambda search_text, max_results=5: geocode_candidates(search_text, max_results=max_results),
+}
+# Provider name -> (host, rate) of the rate limiter its requests go through
+AIC_GEOCODER_LIMITS = {
+    "ola": (urlsplit(BASE_URL).netloc, None),
+    "nominatim": (GEOCODE_NOMINATIM_DOMAIN, GEOCODE_RATE_LIMIT_PER_SECOND),
+}
+
+def _finished(name):
+    with _executor_lock:
+        _in_flight[name] -= 1
+
+def _submit(name, search_text, max_results, hedge):
+    # Start a lookup with one provider. A hedge only starts while that provider has an idle thread and a free
+    # request slot, so hedges use spare capacity only and never hold up the fallbacks that need the provider;
+    # None when it was not started.
+    with _executor_lock:
+        executor = _executors.get(name)
+        if executor is None:
+            executor = _executors[name] = ThreadPoolExecutor(max_workers=AIC_MAX_CONCURRENCY)
+        if hedge and _in_flight.get(name, 0) >= AIC_MAX_CONCURRENCY:
+            return None
+        if hedge and name in AIC_GEOCODER_LIMITS and not get_limiter(*AIC_GEOCODER_LIMITS[name]).ready():
+            return None
+        _in_flight[name] = _in_flight.get(name, 0) + 1
+    future = executor.submit(AIC_GEOCODERS[name], search_text, max_results)
+    future.add_done_callback(lambda _: _finished(name))
+    return future
+
+def hedged_candidates(search_text, max_results=5, order=AIC_GEOCODER_ORDER, hedge_after=AIC_HEDGE_AFTER_SECONDS):
+    # Ask the providers in order and return the first non-empty answer. The next provider is started as soon as
+    # the current one fails or comes back empty, or once hedge_after seconds pass without an answer
+    # (None waits for each provider in turn; 0 races them all). Candidates carry the provider under 'source'.
+    # Once one provider answers, lookups that have not started yet are cancelled.
+    remaining = list(order)
+    pending = {}
+
+    def start_next():
+        # False when a hedge was skipped because the next provider is busy
+        hedge = bool(pending)
+        future = _submit(remaining[0], search_text, max_results, hedge)
+        if future is None:
+            metrics.increment("aic_hedges_skipped_total", provider=remaining[0])
+            return False
+        if hedge:
+            metrics.increment("aic_hedges_total", provider=remaining[0])
+        pending[future] = remaining.pop(0)
+        return True
+
+    start_next()
+    while pending:
+        if remaining and hedge_after == 0:
+            if not start_next():
+                # The next provider only starts when the current one fails or comes back empty
+                hedge_after = None
+            continue
+        done, _ = wait(pending, timeout=hedge_after if remaining else None, return_when=FIRST_COMPLETED)
+        if not done:
+            if not start_next():
+                hedge_after = None
+            continue
+        for future in done:
+            name = pending.pop(future)
+            try:
+                results = future.result()
+            except Exception as e:
+                metrics.increment("lookup_errors_total", source=name, error=type(e).__name__)
+                results = None
+            if results:
+                # Slower providers already running finish in the background and fill their cache
+                for loser in pending:
+                    loser.cancel()
+                metrics.increment("aic_answers_total", provider=name)
+                return [dict(result, source=name) for result in results]
+        if remaining and not pending:
+            start_next()
+    metrics.increment("aic_answers_total", provider="none")
+    return []
+
+def iter_hedged_candidates(search_texts, max_results=5, max_concurrency=AIC_MAX_CONCURRENCY):
+    # hedged_candidates for many search texts at once, yielding results in input order
+    max_concurrency = max(1, int(max_concurrency))
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        pending = deque()
+        for search_text in search_texts:
+            pending.append((search_text, executor.submit(hedged_candidates, search_text, max_results)))
+            # Bound the number of queued lookups so memory stays flat on huge inputs
+            if len(pending) >= max_concurrency * 4:
+                search_text, future = pending.popleft()
+                yield search_text, future.result()
+        while pending:
+            search_text, future = pending.popleft()
+            yield search_text, future.result()
+
+def iter_aic_results(search_texts):
+    # One list of result rows per search text
+    for search_text, locations in iter_hedged_candidates(search_texts):
+        if locations:
+            yield [{
+                "AIC Name and Location/ZIP": search_text,
+                "Address": location['address'],
+                "Latitude": location['latitude'],
+                "Longitude": location['longitude'],
+                "Geocoder": location['source'],
+                "Status": "Found"
+            } for location in locations]
+        else:
+            yield [{
+                "AIC Name and Location/ZIP": search_text,
+                "Address": "",
+                "Latitude": "",
+                "Longitude": "",
+                "Geocoder": "",
+                "Status": "Not Found"
+            }]
@@ -0,0 +1,208 @@
+import argparse
+import json
+import os
+import socket
+import sys
+import time
+
+import metrics
+from npi_functions import iter_checked_npi_details, add_full_address
+from provider_model import ProviderTables
+from geocoding import locate_npi_rows
+from readers import iter_first_column
+from validation import CHECK_VALID, normalize_npi_ids
+from config import NPI_MAX_CONCURRENCY, BATCH_CHUNK_SIZE, METRICS_JSON_LOG_PATH, METRICS_PROMETHEUS_PATH
+
+# Streamed output needs a fixed layout; entries beyond these counts are left out of batch output
+BATCH_ADDRESSES = 2
+BATCH_PRACTICE_LOCATIONS = 1
+BATCH_TAXONOMIES = 3
+BATCH_IDENTIFIERS = 3
+
+BASE_COLUMNS = ["NPI ID", "First Name", "Last Name", "Middle Name", "Credential", "Sole Proprietor", "Gender",
+                "Enumeration Date", "Last Updated", "Certification Date", "Status", "Enumeration Type"]
+ADDRESS_FIELDS = ["Purpose", "Type", "Address1", "Address2", "City", "State", "Postal Code", "Telephone", "Fax"]
+PRACTICE_LOCATION_FIELDS = ["Address1", "City", "State", "Postal Code", "Telephone", "Fax"]
+TAXONOMY_FIELDS = ["Code", "Description", "State", "License", "Primary"]
+IDENTIFIER_FIELDS = ["Code", "Description", "Identifier", "State"]
+
+
+def output_columns(geocode):
+    columns = ["Input", "NPI Check"] + list(BASE_COLUMNS)
+    for prefix, count, fields in (("Address", BATCH_ADDRESSES, ADDRESS_FIELDS),
+                                  ("PracticeLocation", BATCH_PRACTICE_LOCATIONS, PRACTICE_LOCATION_FIELDS),
+                                  ("Taxonomy", BATCH_TAXONOMIES, TAXONOMY_FIELDS),
+                                  ("Identifier", BATCH_IDENTIFIERS, IDENTIFIER_FIELDS)):
+        columns += [f"{prefix}_{i}_{field}" for i in range(1, count + 1) for field in fields]
+    columns.append("Full Address")
+    if geocode:
+        columns += ["Latitude", "Longitude", "Geocode Source"]
+    return columns
+
+
+def process_chunk(npi_ids, columns, geocode, max_concurrency, refine=False, seen=None):
+    # seen carries the IDs of earlier chunks, so their repeats are labelled duplicates as in the app
+    checked = list(iter_checked_npi_details([npi_ids], max_concurrency=max_concurrency, seen=seen))
+    result_data = add_full_address(ProviderTables.from_details(npi_details for npi_details, _ in checked).wide())
+    result_data.insert(0, "Input", npi_ids)
+    result_data.insert(1, "NPI Check", [check for _, check in checked])
+    if geocode:
+        result_data = locate_npi_rows(result_data, refine=refine)
+    return result_data.reindex(columns=columns)
+
+
+class CsvSink:
+    def __init__(self, path, resume_offset):
+        self.path = path
+        if resume_offset is not None and os.path.exists(path):
+            # Drop anything written after the last checkpoint
+            with open(path, "r+b") as f:
+                f.truncate(resume_offset)
+            self.file = open(path, "a", newline="", encoding="utf-8")
+            self.header = False
+        else:
+            self.file = open(path, "w", newline="", encoding="utf-8")
+            self.header = True
+
+    def write(self, frame, chunk_index):
+        frame.to_csv(self.file, index=False, header=self.header)
+        self.header = False
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetSink:
+    # One part file per chunk inside the output directory, so a resumed run simply adds parts
+    def __init__(self, path, resume_offset):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def write(self, frame, chunk_index):
+        part = os.path.join(self.path, f"part-{chunk_index:06d}.parquet")
+        frame.astype({column: "string" for column in frame.columns if column not in ("Latitude", "Longitude")}) \
+            .to_parquet(part + ".tmp", index=False)
+        os.replace(part + ".tmp", part)
+        return None
+
+    def close(self):
+        pass
+
+
+class SeenLog:
+    # NPI IDs met so far in a run, one per line next to the checkpoint, so a resumed run still labels repeats
+    # of IDs from before the interruption as duplicates
+    def __init__(self, path, resume_offset):
+        self.path = path
+        self.ids = set()
+        if resume_offset is not None and os.path.exists(path):
+            # Drop anything written after the last checkpoint
+            with open(path, "r+b") as f:
+                f.truncate(resume_offset)
+            with open(path, encoding="utf-8") as f:
+                self.ids.update(line.rstrip("\n") for line in f)
+            self.file = open(path, "a", encoding="utf-8")
+        else:
+            self.file = open(path, "w", encoding="utf-8")
+
+    def write(self, npi_ids):
+        self.file.writelines(f"{npi_id}\n" for npi_id in npi_ids)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+
+def load_checkpoint(path, input_path, output_path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        checkpoint = json.load(f)
+    if checkpoint.get("input") != os.path.abspath(input_path) or checkpoint.get("output") != os.path.abspath(output_path):
+        raise SystemExit(f"Checkpoint {path} belongs to a different job; remove it or pass --checkpoint")
+    return checkpoint
+
+
+def save_checkpoint(path, checkpoint):
+    with open(path + ".tmp", "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(path + ".tmp", path)
+
+
+def run_batch(input_path, output_path, chunk_size=BATCH_CHUNK_SIZE, geocode=False,
+              max_concurrency=NPI_MAX_CONCURRENCY, checkpoint_path=None, log=print, refine=False,
+              metrics_json=METRICS_JSON_LOG_PATH, metrics_prometheus=METRICS_PROMETHEUS_PATH, on_chunk=None):
+    # on_chunk(rows_done) is called after every saved chunk; an exception from it stops the run at that checkpoint
+    checkpoint_path = checkpoint_path or output_path + ".checkpoint.json"
+    checkpoint = load_checkpoint(checkpoint_path, input_path, output_path)
+    if checkpoint is None:
+        checkpoint = {"input": os.path.abspath(input_path), "output": os.path.abspath(output_path),
+                      "rows_done": 0, "chunks_done": 0, "output_offset": None, "seen_offset": None}
+    else:
+        log(f"Resuming after {checkpoint['rows_done']} rows")
+
+    columns = output_columns(geocode)
+    sink_class = ParquetSink if output_path.lower().endswith(".parquet") else CsvSink
+    sink = sink_class(output_path, checkpoint["output_offset"] if checkpoint["rows_done"] else None)
+    seen = SeenLog(checkpoint_path + ".seen", checkpoint.get("seen_offset") if checkpoint["rows_done"] else None)
+    started = time.monotonic()
+    rows_this_run = 0
+    try:
+        for npi_ids in iter_first_column(input_path, chunk_size=chunk_size, skip_rows=checkpoint["rows_done"]):
+            with metrics.stage("batch_chunk"):
+                frame = process_chunk(npi_ids, columns, geocode, max_concurrency, refine, seen.ids)
+            with metrics.stage("batch_write"):
+                checkpoint["output_offset"] = sink.write(frame, checkpoint["chunks_done"])
+                # The first row of each ID in the run is the one labelled valid
+                first_seen = (frame["NPI Check"] == CHECK_VALID).to_numpy()
+                checkpoint["seen_offset"] = seen.write(normalize_npi_ids(npi_ids)[first_seen])
+            checkpoint["rows_done"] += len(npi_ids)
+            checkpoint["chunks_done"] += 1
+            save_checkpoint(checkpoint_path, checkpoint)
+
+            rows_this_run += len(npi_ids)
+            rate = rows_this_run / max(time.monotonic() - started, 1e-9)
+            log(f"{checkpoint['rows_done']} rows done ({rate:.1f} rows/s)")
+            metrics.export(metrics_json, metrics_prometheus)
+            if on_chunk is not None:
+                on_chunk(checkpoint["rows_done"])
+    finally:
+        sink.close()
+        seen.close()
+
+    os.remove(checkpoint_path)
+    os.remove(seen.path)
+    return checkpoint["rows_done"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Enrich a CSV/XLSX list of NPIs without the Streamlit app")
+    parser.add_argument("input", help="CSV or XLSX file with NPI IDs in the first column")
+    parser.add_argument("output", help="output .csv file or .parquet directory")
+    parser.add_argument("--chunk-size", type=int, default=BATCH_CHUNK_SIZE)
+    parser.add_argument("--concurrency", type=int, default=NPI_MAX_CONCURRENCY)
+    parser.add_argument("--geocode", action="store_true", help="add offline ZIP/city centroid Latitude/Longitude")
+    parser.add_argument("--refine", action="store_true", help="with --geocode, refine positions with Nominatim")
+    parser.add_argument("--checkpoint", help="checkpoint file (default: <output>.checkpoint.json)")
+    parser.add_argument("--metrics-json", default=METRICS_JSON_LOG_PATH, help="append a metrics snapshot per chunk")
+    parser.add_argument("--metrics-prometheus", default=METRICS_PROMETHEUS_PATH,
+                        help="keep a Prometheus text file of the run's metrics up to date")
+    args = parser.parse_args()
+
+    # Imported here because jobs imports this module; the run takes its share of the per-host rate limits
+    # alongside the app and any job workers
+    from jobs import share_rate_limits
+    share_rate_limits(f"batch:{socket.gethostname()}:{os.getpid()}")
+    total = run_batch(args.input, args.output, args.chunk_size, args.geocode, args.concurrency, args.checkpoint,
+                      log=lambda message: print(message, file=sys.stderr, flush=True), refine=args.refine,
+                      metrics_json=args.metrics_json, metrics_prometheus=args.metrics_prometheus)
+    print(f"Done: {total} rows written to {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
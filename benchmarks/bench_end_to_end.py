@@ -0,0 +1,207 @@
+import argparse
+import csv
+import gc
+import json
+import multiprocessing
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_services import DEFAULT_PROFILES, start_services, service_environment
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+
+
+def _configure(environment, rate_limits):
+    # Runs in the scenario process before any app module is imported: point the endpoints at the stand-ins
+    # and keep every cache and the local NPPES store out of the way, so each run does the same network work
+    os.environ.update(environment)
+    import config
+    config.NPI_CACHE_ENABLED = False
+    config.GEOCODE_CACHE_ENABLED = False
+    config.NPPES_STORE_PATH = os.path.join(tempfile.mkdtemp(), "absent.sqlite3")
+    # The app's shared limiters use the stand-ins' limits as their ceilings
+    config.GEOCODE_RATE_LIMIT_PER_SECOND = rate_limits["nominatim"]
+    config.HTTP_RATE_LIMITS = {urlsplit(environment["NPI_API_URL"]).netloc: rate_limits["registry"],
+                               urlsplit(environment["OLA_BASE_URL"]).netloc: rate_limits["ola"]}
+
+
+def _timed(module, name, samples):
+    # Replace module.name with a wrapper that records each call's duration
+    function = getattr(module, name)
+
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            samples.append(time.perf_counter() - start)
+    setattr(module, name, wrapper)
+
+
+def upload_scenario(size, registry_npis):
+    # A CSV upload of NPIs enriched end to end: read, validate, look up, flatten, write
+    import npi_functions
+    from batch import run_batch
+
+    samples = []
+    _timed(npi_functions, "get_npi_details", samples)
+    directory = tempfile.mkdtemp()
+    input_path = os.path.join(directory, "npis.csv")
+    with open(input_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["NPI"])
+        writer.writerows([npi_id] for npi_id in registry_npis[:size])
+
+    def run():
+        return run_batch(input_path, os.path.join(directory, "out.csv"), log=lambda message: None)
+    return run, samples
+
+
+def search_scenario(size, registry_npis):
+    # A broad advanced search that runs past the registry's skip ceiling and is split by state
+    import npi_functions
+    from provider_model import ProviderTables
+
+    samples = []
+    _timed(npi_functions, "_search_registry", samples)
+
+    def run():
+        pages = list(npi_functions.iter_npi_by_details(taxonomy_description="Internal Medicine"))
+        tables = ProviderTables.from_details(npi_details for page in pages for npi_details in page)
+        return len(tables)
+    return run, samples
+
+
+def aic_scenario(size, registry_npis):
+    # A batch of AIC search texts through the hedged Ola/Nominatim lookup
+    import aic_functions
+
+    samples = []
+    _timed(aic_functions, "hedged_candidates", samples)
+    search_texts = [f"Clinic {i} {10000 + i * 37 % 89999:05d}" for i in range(size)]
+
+    def run():
+        return sum(1 for _ in aic_functions.iter_hedged_candidates(search_texts))
+    return run, samples
+
+
+SCENARIOS = {"upload": upload_scenario, "search": search_scenario, "aic": aic_scenario}
+
+
+def run_scenario(name, size, registry_npis, environment, rate_limits):
+    # Runs in a fresh process so imports, connection pools and peak RSS belong to this scenario alone
+    _configure(environment, rate_limits)
+    run, samples = SCENARIOS[name](size, registry_npis)
+    gc.collect()
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    records = run()
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in kilobytes on Linux
+    peak = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline_rss) * 1024
+
+    quantiles = statistics.quantiles(samples, n=20) if len(samples) > 1 else [samples[0] if samples else 0.0] * 19
+    return {
+        "records": records,
+        "seconds": round(elapsed, 3),
+        "records_per_sec": round(records / elapsed, 1),
+        "calls": len(samples),
+        "p50_ms": round(statistics.median(samples) * 1000, 1) if samples else 0.0,
+        "p95_ms": round(quantiles[18] * 1000, 1),
+        "peak_mb": round(peak / 1e6, 1),
+    }
+
+
+def compare(result, baseline, tolerance):
+    # Regressions beyond the tolerance: lower throughput, higher p95 latency or higher peak memory
+    regressions = []
+    if result["records_per_sec"] < baseline["records_per_sec"] * (1 - tolerance):
+        regressions.append("records/sec")
+    if result["p95_ms"] > baseline["p95_ms"] * (1 + tolerance):
+        regressions.append("p95")
+    # Peak memory below a few MB is mostly noise
+    if result["peak_mb"] > max(baseline["peak_mb"] * (1 + tolerance), baseline["peak_mb"] + 5):
+        regressions.append("peak memory")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end throughput, latency and memory against local stand-ins "
+                                                 "for the NPPES registry, Nominatim and Ola Maps")
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--upload-size", type=int, default=10000)
+    parser.add_argument("--aic-size", type=int, default=1000)
+    parser.add_argument("--registry-size", type=int, default=20000)
+    parser.add_argument("--latency-ms", type=float, help="median latency for every service (default: per service)")
+    parser.add_argument("--error-rate", type=float, help="share of requests answered with 503 (default: per service)")
+    parser.add_argument("--rate-limit", type=float, help="requests per second before 429s (default: per service)")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative change before a regression")
+    args = parser.parse_args()
+
+    profiles = {name: dict(profile) for name, profile in DEFAULT_PROFILES.items()}
+    for key in ("latency_ms", "error_rate", "rate_limit"):
+        if getattr(args, key) is not None:
+            for profile in profiles.values():
+                profile[key] = getattr(args, key)
+    sizes = {"upload": args.upload_size, "search": args.registry_size, "aic": args.aic_size}
+
+    registry_size = max(args.registry_size, args.upload_size)
+    services = start_services(profiles, registry_size)
+    registry_npis = services["registry"].answer.npi_ids(args.upload_size)
+    environment = service_environment(services)
+    # Services without a limit get a ceiling well above anything the scenarios reach
+    rate_limits = {name: profile["rate_limit"] or 1000.0 for name, profile in profiles.items()}
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+
+    context = multiprocessing.get_context("spawn")
+    print(f"{'scenario':>10} {'records':>8} {'seconds':>8} {'rec/s':>9} {'calls':>7} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'peak MB':>8}  vs baseline")
+    failed = False
+    try:
+        for name in args.scenarios:
+            with context.Pool(1) as pool:
+                result = pool.apply(run_scenario, (name, sizes[name], registry_npis, environment, rate_limits))
+            result["settings"] = {"size": sizes[name], "registry_size": registry_size, "profiles": profiles}
+
+            baseline = baselines.get(name)
+            if baseline is None:
+                verdict = "no baseline"
+            elif baseline["settings"] != result["settings"]:
+                verdict = "baseline used other settings"
+            else:
+                regressions = compare(result, baseline, args.tolerance)
+                failed = failed or bool(regressions)
+                verdict = ("REGRESSION: " + ", ".join(regressions)) if regressions else \
+                    f"ok ({result['records_per_sec'] / baseline['records_per_sec'] - 1:+.0%} rec/s)"
+            print(f"{name:>10} {result['records']:>8} {result['seconds']:>8.1f} {result['records_per_sec']:>9.1f} "
+                  f"{result['calls']:>7} {result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f} {result['peak_mb']:>8.1f}  "
+                  f"{verdict}")
+            baselines[name] = result if args.save_baseline else baselines.get(name)
+    finally:
+        for service in services.values():
+            service.stop()
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({name: result for name, result in baselines.items() if result is not None}, f, indent=2)
+            f.write("\n")
+        print(f"Baseline saved to {args.baseline}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pandas as pd
+
+from bench_result_builder import synthetic_npi_details
+from json_codec import loads, orjson
+from npi_functions import parse_npi_record
+from provider_model import ProviderTables
+
+
+def legacy_parse_npi_record(npi_data):
+    # The original per-record flattener, kept here as the baseline
+    parsed_data = {
+        "NPI ID": npi_data.get("number", ""),
+        "First Name": npi_data.get("basic", {}).get("first_name", ""),
+        "Last Name": npi_data.get("basic", {}).get("last_name", ""),
+        "Middle Name": npi_data.get("basic", {}).get("middle_name", ""),
+        "Credential": npi_data.get("basic", {}).get("credential", ""),
+        "Sole Proprietor": npi_data.get("basic", {}).get("sole_proprietor", ""),
+        "Gender": npi_data.get("basic", {}).get("gender", ""),
+        "Enumeration Date": npi_data.get("basic", {}).get("enumeration_date", ""),
+        "Last Updated": npi_data.get("basic", {}).get("last_updated", ""),
+        "Certification Date": npi_data.get("basic", {}).get("certification_date", ""),
+        "Status": npi_data.get("basic", {}).get("status", ""),
+        "Enumeration Type": npi_data.get("enumeration_type", ""),
+    }
+
+    # Process addresses
+    addresses = npi_data.get("addresses", [])
+    for i, address in enumerate(addresses):
+        prefix = f"Address_{i+1}_"
+        parsed_data.update({
+            f"{prefix}Purpose": address.get("address_purpose", ""),
+            f"{prefix}Type": address.get("address_type", ""),
+            f"{prefix}Address1": address.get("address_1", ""),
+            f"{prefix}Address2": address.get("address_2", ""),
+            f"{prefix}City": address.get("city", ""),
+            f"{prefix}State": address.get("state", ""),
+            f"{prefix}Postal Code": address.get("postal_code", ""),
+            f"{prefix}Telephone": address.get("telephone_number", ""),
+            f"{prefix}Fax": address.get("fax_number", ""),
+        })
+
+    # Process practice locations
+    practice_locations = npi_data.get("practiceLocations", [])
+    for i, location in enumerate(practice_locations):
+        prefix = f"PracticeLocation_{i+1}_"
+        parsed_data.update({
+            f"{prefix}Address1": location.get("address_1", ""),
+            f"{prefix}City": location.get("city", ""),
+            f"{prefix}State": location.get("state", ""),
+            f"{prefix}Postal Code": location.get("postal_code", ""),
+            f"{prefix}Telephone": location.get("telephone_number", ""),
+            f"{prefix}Fax": location.get("fax_number", ""),
+        })
+
+    # Process taxonomies
+    taxonomies = npi_data.get("taxonomies", [])
+    for i, taxonomy in enumerate(taxonomies):
+        prefix = f"Taxonomy_{i+1}_"
+        parsed_data.update({
+            f"{prefix}Code": taxonomy.get("code", ""),
+            f"{prefix}Description": taxonomy.get("desc", ""),
+            f"{prefix}State": taxonomy.get("state", ""),
+            f"{prefix}License": taxonomy.get("license", ""),
+            f"{prefix}Primary": str(taxonomy.get("primary", "")),
+        })
+
+    # Process identifiers
+    identifiers = npi_data.get("identifiers", [])
+    for i, identifier in enumerate(identifiers):
+        prefix = f"Identifier_{i+1}_"
+        parsed_data.update({
+            f"{prefix}Code": identifier.get("code", ""),
+            f"{prefix}Description": identifier.get("desc", ""),
+            f"{prefix}Identifier": identifier.get("identifier", ""),
+            f"{prefix}State": identifier.get("state", ""),
+        })
+
+    parsed_data["Status"] = "Found" if parsed_data["NPI ID"] else "Not Found"
+
+    return parsed_data
+
+
+
+def per_record_us(function, items, repeat):
+    best = float("inf")
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function(items)
+            best = min(best, time.perf_counter() - start)
+    finally:
+        gc.enable()
+    return best / len(items) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-record cost of decoding and flattening registry records")
+    parser.add_argument("--records", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    npi_details_list = [npi_details for npi_details in synthetic_npi_details(args.records) if "created_epoch" in npi_details]
+    # Registry search pages of 200 results, as the API returns them
+    bodies = [json.dumps({"result_count": len(page), "results": page}).encode("utf-8")
+              for page in (npi_details_list[i:i + 200] for i in range(0, len(npi_details_list), 200))]
+
+    stages = [
+        ("decode: json.loads", lambda items: [json.loads(body) for body in bodies], bodies),
+        (f"decode: json_codec ({'orjson' if orjson else 'json'})", lambda items: [loads(body) for body in bodies], bodies),
+        ("flatten: legacy one-row frames", lambda items: [pd.DataFrame([legacy_parse_npi_record(x)]) for x in items],
+         npi_details_list[:1000]),
+        ("flatten: legacy dicts", lambda items: [legacy_parse_npi_record(x) for x in items], npi_details_list),
+        ("flatten: field tables", lambda items: [parse_npi_record(x) for x in items], npi_details_list),
+        ("flatten: normalized tables", ProviderTables.from_details, npi_details_list),
+    ]
+    print(f"{'stage':>34} {'us/record':>10}")
+    for name, function, items in stages:
+        # Decode timings are per page; report them per record
+        scale = len(npi_details_list) / len(items)
+        print(f"{name:>34} {per_record_us(function, items, args.repeat) / scale:10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import argparse
+import gc
+import multiprocessing
+import os
+import resource
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_result_builder import synthetic_npi_details
+from npi_functions import npi_record, build_result_frame, add_full_address
+from provider_model import ProviderTables
+
+
+def build_wide(npi_details_list):
+    result_data = add_full_address(build_result_frame(npi_record(npi_details) for npi_details in npi_details_list))
+    return int(result_data.memory_usage(deep=True).sum())
+
+
+def build_normalized(npi_details_list):
+    return ProviderTables.from_details(npi_details_list).memory_usage()
+
+
+def build_normalized_view(npi_details_list):
+    # Normalized tables plus the wide view the page renders from them
+    tables = ProviderTables.from_details(npi_details_list)
+    wide = tables.wide()
+    return tables.memory_usage() + int(wide.memory_usage(deep=True).sum())
+
+
+BUILDERS = {"wide": build_wide, "normalized": build_normalized, "normalized+view": build_normalized_view}
+
+
+def measure(mode, size):
+    # Runs in a fresh process so each builder's peak RSS is its own
+    npi_details_list = synthetic_npi_details(size)
+    gc.collect()
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    held = BUILDERS[mode](npi_details_list)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux
+    return (peak - baseline) * 1024, held
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peak memory of the wide result table vs. the normalized provider tables")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    print(f"{'records':>10} {'layout':>16} {'peak MB':>10} {'held MB':>10}")
+    for size in args.sizes:
+        for mode in BUILDERS:
+            with context.Pool(1) as pool:
+                peak, held = pool.apply(measure, (mode, size))
+            print(f"{size:>10} {mode:>16} {peak / 1e6:10.1f} {held / 1e6:10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import argparse
+import os
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from npi_functions import npi_record, parse_npi_data, blank_npi_data, build_result_frame, add_full_address
+
+
+def synthetic_npi_details(count):
+    # Registry-shaped records with a sprinkling of not-found placeholders
+    records = []
+    for i in range(count):
+        if i % 20 == 0:
+            records.append({"NPI ID": str(1000000000 + i), "Status": "Not Found"})
+            continue
+        records.append({
+            "created_epoch": 1100000000000,
+            "enumeration_type": "NPI-1",
+            "number": str(1000000000 + i),
+            "basic": {
+                "first_name": "JANE", "last_name": f"DOE{i}", "middle_name": "Q", "credential": "MD",
+                "sole_proprietor": "NO", "gender": "F", "enumeration_date": "2006-05-01",
+                "last_updated": "2021-07-01", "certification_date": "2021-07-01", "status": "A",
+            },
+            "addresses": [
+                {"address_purpose": purpose, "address_type": "DOM", "address_1": f"{i} MAIN ST", "address_2": "",
+                 "city": "BOSTON", "state": "MA", "postal_code": "021181234",
+                 "telephone_number": "617-555-0100", "fax_number": ""}
+                for purpose in ("LOCATION", "MAILING")
+            ],
+            "practiceLocations": [],
+            "taxonomies": [{"code": "207R00000X", "desc": "Internal Medicine", "state": "MA",
+                            "license": f"L{i}", "primary": True}],
+            "identifiers": [],
+        })
+    return records
+
+
+def legacy_build(npi_details_list):
+    # The original per-row pd.concat loop and DataFrame.apply address builder
+    result_data = pd.DataFrame()
+    for npi_details in npi_details_list:
+        if 'created_epoch' in npi_details.keys():
+            parsed_data = parse_npi_data(npi_details)
+        else:
+            parsed_data = blank_npi_data(npi_details)
+        result_data = pd.concat([result_data, parsed_data], ignore_index=True)
+    result_data['Full Address'] = result_data.apply(
+        lambda row: f"{row['Address_1_Address1']}, {row['Address_1_City']}, {row['Address_1_State']} {row['Address_1_Postal Code']}",
+        axis=1
+    )
+    return result_data
+
+
+def columnar_build(npi_details_list):
+    return add_full_address(build_result_frame(npi_record(npi_details) for npi_details in npi_details_list))
+
+
+def time_build(build, npi_details_list):
+    start = time.perf_counter()
+    build(npi_details_list)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-record cost of building the NPI result table")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000, 100000])
+    parser.add_argument("--legacy-max", type=int, default=1000,
+                        help="largest batch to run through the quadratic legacy builder")
+    args = parser.parse_args()
+
+    print(f"{'records':>10} {'columnar us/rec':>16} {'legacy us/rec':>14}")
+    for size in args.sizes:
+        npi_details_list = synthetic_npi_details(size)
+        columnar = time_build(columnar_build, npi_details_list) / size * 1e6
+        if size <= args.legacy_max:
+            legacy = f"{time_build(legacy_build, npi_details_list) / size * 1e6:14.1f}"
+        else:
+            legacy = f"{'skipped':>14}"
+        print(f"{size:>10} {columnar:16.1f} {legacy}")
+
+
+if __name__ == "__main__":
+    main()
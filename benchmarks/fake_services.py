@@ -0,0 +1,256 @@
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# Local stand-ins for the NPPES registry API (v2.1), Nominatim and Ola Maps autocomplete, with configurable
+# latency, error rate and rate limit. Payloads follow the real services closely enough for the app's parsers.
+
+STATES = ["AL", "AZ", "CA", "CO", "FL", "GA", "IL", "MA", "MI", "MN", "NC", "NJ", "NY", "OH", "PA", "TX", "VA", "WA"]
+CITIES = ["SPRINGFIELD", "FRANKLIN", "GREENVILLE", "CLINTON", "MADISON", "GEORGETOWN", "SALEM", "FAIRVIEW"]
+TAXONOMIES = [("207R00000X", "Internal Medicine"), ("207Q00000X", "Family Medicine"), ("208D00000X", "General Practice"),
+              ("363L00000X", "Nurse Practitioner"), ("261QP2300X", "Primary Care")]
+FIRST_NAMES = ["JANE", "JOHN", "MARIA", "DAVID", "PRIYA", "WEI", "AISHA", "CARLOS"]
+
+# Per-service defaults: median latency, share of requests answered with a 503, requests per second before 429s
+DEFAULT_PROFILES = {
+    "registry": {"latency_ms": 25.0, "error_rate": 0.005, "rate_limit": None},
+    "nominatim": {"latency_ms": 120.0, "error_rate": 0.01, "rate_limit": 20.0},
+    "ola": {"latency_ms": 60.0, "error_rate": 0.02, "rate_limit": 50.0},
+}
+
+
+def npi_with_check_digit(base):
+    # Ten-digit NPI for a nine-digit base, with the Luhn check digit over the "80840" prefix
+    digits = [int(d) for d in f"{base:09d}"]
+    total = 24
+    for i, digit in enumerate(digits):
+        if i % 2 == 0:
+            digit *= 2
+            if digit > 9:
+                digit -= 9
+        total += digit
+    return f"{base:09d}{(10 - total % 10) % 10}"
+
+
+def registry_record(index):
+    state = STATES[index % len(STATES)]
+    city = CITIES[index // len(STATES) % len(CITIES)]
+    postal_code = f"{10000 + index * 7919 % 89999:05d}{index % 10000:04d}"
+    code, description = TAXONOMIES[index % len(TAXONOMIES)]
+    address = {"country_code": "US", "country_name": "United States", "address_type": "DOM",
+               "address_1": f"{100 + index % 9900} MAIN ST", "address_2": "", "city": city, "state": state,
+               "postal_code": postal_code, "telephone_number": "555-010-%04d" % (index % 10000), "fax_number": ""}
+    return {
+        "created_epoch": "1136073600000",
+        "enumeration_type": "NPI-1",
+        "last_updated_epoch": "1625097600000",
+        "number": npi_with_check_digit(100000000 + index),
+        "addresses": [dict(address, address_purpose="LOCATION"), dict(address, address_purpose="MAILING")],
+        "practiceLocations": [],
+        "basic": {"first_name": FIRST_NAMES[index % len(FIRST_NAMES)], "last_name": f"PROVIDER{index}",
+                  "middle_name": "", "credential": "MD", "sole_proprietor": "NO", "gender": "F" if index % 2 else "M",
+                  "enumeration_date": "2006-01-01", "last_updated": "2021-07-01", "certification_date": "2021-07-01",
+                  "status": "A"},
+        "taxonomies": [{"code": code, "taxonomy_group": "", "desc": description, "state": state,
+                        "license": f"L{index}", "primary": True}],
+        "identifiers": [],
+        "endpoints": [],
+        "other_names": [],
+    }
+
+
+class ServiceProfile:
+    def __init__(self, latency_ms=0.0, error_rate=0.0, rate_limit=None, seed=0):
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._tokens = rate_limit or 0.0
+        self._refilled = time.monotonic()
+
+    def _allow(self):
+        # Token bucket holding one second's worth of requests
+        if not self.rate_limit:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.rate_limit, self._tokens + (now - self._refilled) * self.rate_limit)
+            self._refilled = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def outcome(self):
+        # (delay in seconds, status override or None) for one request
+        with self._lock:
+            # Log-normal latency around the median gives the long tail real services show
+            delay = self.latency_ms / 1000 * self._random.lognormvariate(0, 0.5)
+            failed = self._random.random() < self.error_rate
+        if not self._allow():
+            return 0.0, 429
+        return delay, 503 if failed else None
+
+
+class FakeService(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, answer, profile):
+        # answer(path, params) -> JSON-serializable body
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.answer = answer
+        self.profile = profile
+        self.requests = 0
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def address(self):
+        return f"127.0.0.1:{self.server_address[1]}"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; without this, delayed ACKs add about 40 ms to every response
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.server.requests += 1
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        delay, status = self.server.profile.outcome()
+        time.sleep(delay)
+        if status == 429:
+            self._send(429, {"error": "Too Many Requests"}, {"Retry-After": "1"})
+        elif status is not None:
+            self._send(status, {"error": "Service Unavailable"})
+        else:
+            self._send(200, self.server.answer(url.path, params))
+
+    def _send(self, status, body, headers=None):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeRegistry:
+    # NPPES API v2.1: lookups by number and searches with limit/skip, registry-style matching
+    # (case-insensitive exact values, trailing * for prefixes) and the 1000 skip ceiling
+    SEARCH_FIELDS = {
+        "first_name": lambda r: r["basic"]["first_name"],
+        "last_name": lambda r: r["basic"]["last_name"],
+        "enumeration_type": lambda r: r["enumeration_type"],
+        "taxonomy_description": lambda r: r["taxonomies"][0]["desc"],
+        "city": lambda r: r["addresses"][0]["city"],
+        "state": lambda r: r["addresses"][0]["state"],
+        "postal_code": lambda r: r["addresses"][0]["postal_code"],
+    }
+
+    def __init__(self, size):
+        self.records = [registry_record(index) for index in range(size)]
+        self.by_number = {record["number"]: record for record in self.records}
+        # Matches per filter set, so paging through one search does not rescan the registry for every page
+        self._matches_cache = {}
+        self._lock = threading.Lock()
+
+    def npi_ids(self, count):
+        return [record["number"] for record in self.records[:count]]
+
+    @staticmethod
+    def _matches(value, wanted):
+        value, wanted = value.upper(), wanted.strip().upper()
+        if wanted.endswith("*"):
+            return value.startswith(wanted[:-1])
+        return value == wanted
+
+    def __call__(self, path, params):
+        if "number" in params:
+            record = self.by_number.get(params["number"])
+            return {"result_count": 1 if record else 0, "results": [record] if record else []}
+
+        skip = int(params.get("skip", 0))
+        limit = min(int(params.get("limit", 10)), 200)
+        if skip > 1000:
+            return {"Errors": [{"description": "skip must be less than or equal to 1000", "field": "skip"}]}
+        filters = tuple(sorted((key, value) for key, value in params.items() if key in self.SEARCH_FIELDS))
+        if not filters:
+            return {"Errors": [{"description": "No valid search criteria provided"}]}
+        with self._lock:
+            results = self._matches_cache.get(filters)
+        if results is None:
+            results = [record for record in self.records
+                       if all(self._matches(self.SEARCH_FIELDS[key](record), value) for key, value in filters)]
+            with self._lock:
+                self._matches_cache[filters] = results
+        page = results[skip:skip + limit]
+        return {"result_count": len(page), "results": page}
+
+
+def _place(query, rank):
+    # Stable coordinates for a query inside the continental US
+    seed = sum(ord(c) * (i + 1) for i, c in enumerate(query)) + rank * 7919
+    return 25 + seed % 2400 / 100, -124 + seed * 31 % 5700 / 100
+
+
+def fake_nominatim(path, params):
+    query = params.get("q", "")
+    places = []
+    for rank in range(min(int(params.get("limit", 1)), 3)):
+        latitude, longitude = _place(query, rank)
+        places.append({"place_id": 100000 + rank, "licence": "Data © OpenStreetMap contributors, ODbL 1.0.",
+                       "osm_type": "way", "osm_id": 200000 + rank, "lat": f"{latitude:.7f}", "lon": f"{longitude:.7f}",
+                       "class": "amenity", "type": "clinic", "place_rank": 30, "importance": 0.3 - rank * 0.05,
+                       "addresstype": "amenity", "name": query.title(),
+                       "display_name": f"{query.title()}, Springfield County, United States",
+                       "boundingbox": [f"{latitude - 0.001:.7f}", f"{latitude + 0.001:.7f}",
+                                       f"{longitude - 0.001:.7f}", f"{longitude + 0.001:.7f}"]})
+    return places
+
+
+def fake_ola(path, params):
+    query = params.get("input", "")
+    predictions = []
+    for rank in range(3):
+        latitude, longitude = _place(query, rank)
+        predictions.append({"description": f"{query.title()} #{rank + 1}, Springfield, United States",
+                            "place_id": f"ola-platform:{rank}", "reference": f"ref{rank}", "types": ["establishment"],
+                            "matched_substrings": [], "terms": [],
+                            "structured_formatting": {"main_text": query.title(), "secondary_text": "Springfield"},
+                            "geometry": {"location": {"lat": latitude, "lng": longitude}}, "distance_meters": 0})
+    return {"predictions": predictions, "info_messages": [], "error_message": "", "status": "ok"}
+
+
+def start_services(profiles, registry_size, seed=0):
+    # name -> started FakeService; profiles maps service name -> ServiceProfile keyword arguments
+    answers = {"registry": FakeRegistry(registry_size), "nominatim": fake_nominatim, "ola": fake_ola}
+    return {name: FakeService(answer, ServiceProfile(seed=seed + i, **profiles[name])).start()
+            for i, (name, answer) in enumerate(answers.items())}
+
+
+def service_environment(services):
+    # Environment variables that point config.py at the stand-ins
+    return {
+        "NPI_API_URL": f"http://{services['registry'].address}/api/",
+        "OLA_BASE_URL": f"http://{services['ola'].address}/places/v1/autocomplete",
+        "NOMINATIM_DOMAIN": services["nominatim"].address,
+        "NOMINATIM_SCHEME": "http",
+    }
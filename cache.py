@@ -0,0 +1,132 @@
+import os
+import sqlite3
+import threading
+import time
+
+import metrics
+from json_codec import loads, dumps
+
+# Hits only note their access time in memory; the notes are written out in one statement every this many hits
+# (and before any eviction), instead of an UPDATE and commit per hit
+ACCESS_FLUSH_EVERY = 256
+# Share of max_entries dropped at once when the cache outgrows it, so eviction runs once per batch of inserts
+EVICTION_BATCH_SHARE = 0.05
+
+
+class ResponseCache:
+    # SQLite-backed key/value store for API responses with TTL and LRU eviction
+
+    def __init__(self, path, ttl_seconds=None, max_entries=None, name=None, max_age_seconds=None):
+        self.path = path
+        # Label for the cache_lookups_total metric; defaults to the file name without extension
+        self.name = name or os.path.splitext(os.path.basename(path))[0]
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        # Hard limit on the age of an entry, even one is_current() would still accept
+        self.max_age_seconds = max_age_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "stored_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at)")
+        self._conn.commit()
+        # Running row count, so inserts need no COUNT(*); recounted at each eviction, since other processes
+        # (background job workers) may share the file
+        self._entries = self._count()
+        self._accessed = {}
+
+    def _count(self):
+        return self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def _flush_access_times(self):
+        if self._accessed:
+            self._conn.executemany("UPDATE cache SET accessed_at = ? WHERE key = ?",
+                                   [(accessed_at, key) for key, accessed_at in self._accessed.items()])
+            self._accessed.clear()
+
+    def get(self, key, is_current=None):
+        # Return the cached value, or None on a miss.
+        # Expired entries are still served when is_current(value) says they are up to date, up to max_age_seconds.
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, stored_at FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                metrics.increment("cache_lookups_total", cache=self.name, result="miss")
+                return None
+
+            value = loads(row[0])
+            age = now - row[1]
+            expired = self.ttl_seconds is not None and age > self.ttl_seconds
+            too_old = self.max_age_seconds is not None and age > self.max_age_seconds
+            if expired and (too_old or not (is_current and is_current(value))):
+                self.misses += 1
+                metrics.increment("cache_lookups_total", cache=self.name, result="expired")
+                return None
+
+            self._accessed[key] = now
+            if len(self._accessed) >= ACCESS_FLUSH_EVERY:
+                self._flush_access_times()
+                self._conn.commit()
+            self.hits += 1
+            metrics.increment("cache_lookups_total", cache=self.name, result="hit")
+            return value
+
+    def set(self, key, value):
+        now = time.time()
+        with self._lock:
+            payload = dumps(value)
+            updated = self._conn.execute("UPDATE cache SET value = ?, stored_at = ?, accessed_at = ? WHERE key = ?",
+                                         (payload, now, now, key)).rowcount
+            if not updated:
+                self._conn.execute("INSERT OR REPLACE INTO cache (key, value, stored_at, accessed_at) "
+                                   "VALUES (?, ?, ?, ?)", (key, payload, now, now))
+                self._entries += 1
+            self._accessed.pop(key, None)
+            if self.max_entries is not None and self._entries > self.max_entries:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        # Drop the least recently used entries down to a batch below the size limit
+        self._flush_access_times()
+        self._entries = self._count()
+        excess = self._entries - self.max_entries
+        if excess > 0:
+            excess += int(self.max_entries * EVICTION_BATCH_SHARE)
+            self._conn.execute("DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed_at LIMIT ?)",
+                               (excess,))
+            self._entries = max(0, self._entries - excess)
+
+    def delete(self, keys):
+        # Drop entries that are known to be stale
+        with self._lock:
+            self._conn.executemany("DELETE FROM cache WHERE key = ?", [(key,) for key in keys])
+            self._conn.commit()
+            self._entries = self._count()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM cache")
+            self._conn.commit()
+            self._entries = 0
+            self._accessed.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            entries = self._count()
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -1,6 +1,142 @@
+import os
+
+# Service endpoints can be pointed elsewhere (a proxy, a mirror, the benchmark stand-ins) through the
+# OLA_BASE_URL, NPI_API_URL, NOMINATIM_DOMAIN and NOMINATIM_SCHEME environment variables
+
 # Constants for AIC Address Finder
 API_KEY = "5s3rJfYDFXwPQ7BLJ3bbZCA46MfpT1iQos1MOYe3"
-BASE_URL = "https://api.olamaps.io/places/v1/autocomplete"
+BASE_URL = os.environ.get("OLA_BASE_URL", "https://api.olamaps.io/places/v1/autocomplete")
 
 # API URL for NPI Details Fetcher
-API_URL = 'https://npiregistry.cms.hhs.gov/api/number=&enumeration_type=&taxonomy_description=&name_purpose=&first_name=&use_first_name_alias=&last_name=&organization_name=&address_purpose=&city=&state=&postal_code=&country_code=&limit=&skip=&pretty=&version=2.1'
\ No newline at end of file
+API_URL = os.environ.get("NPI_API_URL", 'https://npiregistry.cms.hhs.gov/api/')
+API_VERSION = '2.1'
+
+# Number of NPI lookups allowed in flight at once for bulk searches
+NPI_MAX_CONCURRENCY = 8
+# Times a paginated search query is run again after one of its page requests failed
+NPI_SEARCH_QUERY_RETRIES = 1
+
+# Local cache of registry responses
+NPI_CACHE_ENABLED = True
+NPI_CACHE_PATH = "npi_cache.sqlite3"
+NPI_CACHE_TTL_SECONDS = 7 * 24 * 60 * 60
+NPI_CACHE_MAX_ENTRIES = 500000
+# Expired records last updated at least this many days ago are served without refetching (None to disable),
+# but never once they are older than NPI_CACHE_MAX_AGE_SECONDS, so a provider who moves is picked up eventually
+NPI_CACHE_TRUST_LAST_UPDATED_DAYS = 365
+NPI_CACHE_MAX_AGE_SECONDS = 4 * NPI_CACHE_TTL_SECONDS
+
+# Geocoding
+GEOCODE_USER_AGENT = "aic_npi_locator"
+GEOCODE_NOMINATIM_DOMAIN = os.environ.get("NOMINATIM_DOMAIN", "nominatim.openstreetmap.org")
+GEOCODE_NOMINATIM_SCHEME = os.environ.get("NOMINATIM_SCHEME", "https")
+GEOCODE_CACHE_ENABLED = True
+GEOCODE_CACHE_PATH = "geocode_cache.sqlite3"
+GEOCODE_CACHE_MAX_ENTRIES = 1000000
+# Lookups also kept in memory by each process, in front of the SQLite cache
+GEOCODE_MEMORY_CACHE_MAX_ENTRIES = 50000
+# Public Nominatim allows about one request per second
+GEOCODE_RATE_LIMIT_PER_SECOND = 1.0
+GEOCODE_TIMEOUT = 10
+# Attempts per address after a timeout or service error in the background geocoding queue
+GEOCODE_MAX_RETRIES = 3
+# Seconds between map redraws while background geocoding results arrive
+GEOCODE_REDRAW_SECONDS = 5
+# Refine offline ZIP/city centroid positions with Nominatim by default
+GEOCODE_REFINE_DEFAULT = False
+
+# AIC address lookups: providers asked in this order (see aic_functions.AIC_GEOCODERS)
+AIC_GEOCODER_ORDER = ["ola", "nominatim"]
+# Seconds to wait on a provider before also asking the next one; None waits for each in turn, 0 asks all at once
+# (a hedge only goes out while the next provider has an idle thread and a free request slot)
+AIC_HEDGE_AFTER_SECONDS = 1.5
+# Number of AIC search texts looked up at once
+AIC_MAX_CONCURRENCY = 4
+
+# Local store built from the CMS NPPES dissemination file (see nppes_store.py)
+NPPES_STORE_PATH = "nppes_store.sqlite3"
+NPPES_INGEST_CHUNKSIZE = 50000
+# NPIs per "IN (...)" query when weekly updates compare incoming rows with the stored ones
+NPPES_LOOKUP_BATCH = 500
+# Ask the registry API about NPIs that are missing from the local store
+NPPES_STORE_API_FALLBACK = True
+# Maximum number of providers returned by a local advanced search
+LOCAL_SEARCH_LIMIT = 10000
+
+# Shared HTTP client (see http_client.py)
+HTTP_USER_AGENT = "aic_npi_locator"
+# Seconds to wait for a connection and for each read
+HTTP_TIMEOUT = (5, 30)
+# Keep-alive connections per host; keep at least as large as the concurrency slider allows
+HTTP_POOL_MAXSIZE = 32
+HTTP_MAX_RETRIES = 4
+HTTP_BACKOFF_BASE = 0.5
+HTTP_BACKOFF_MAX = 30
+# Longest Retry-After we are willing to sleep for before retrying
+HTTP_RETRY_AFTER_MAX = 60
+
+# Requests per second per host, split between the processes sending requests (see rate_limit.py and jobs.py).
+# Nominatim uses GEOCODE_RATE_LIMIT_PER_SECOND; other hosts not listed here use HTTP_DEFAULT_RATE_LIMIT.
+HTTP_RATE_LIMITS = {"npiregistry.cms.hhs.gov": 20.0, "api.olamaps.io": 10.0}
+HTTP_DEFAULT_RATE_LIMIT = 20.0
+# On a 429 the rate is multiplied by HTTP_RATE_DECREASE (never below HTTP_RATE_MIN); each success adds back
+# HTTP_RATE_INCREASE of the configured rate
+HTTP_RATE_DECREASE = 0.5
+HTTP_RATE_INCREASE = 0.01
+HTTP_RATE_MIN = 0.2
+# After this many failures in a row (connection errors, timeouts, 5xx) a host is paused for HTTP_CIRCUIT_OPEN_SECONDS,
+# then a single trial request decides whether traffic resumes
+HTTP_CIRCUIT_FAILURE_THRESHOLD = 5
+HTTP_CIRCUIT_OPEN_SECONDS = 30
+# Longest a request waits for a paused host before failing
+HTTP_CIRCUIT_WAIT_MAX = 60
+
+# Instrumentation (see metrics.py): counters and latency histograms per endpoint and per pipeline stage
+METRICS_ENABLED = True
+# Upper bounds in seconds of the latency histogram buckets
+METRICS_LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+# Append a JSON snapshot per app run or batch chunk to this file, and keep a Prometheus text file up to date
+# (e.g. in node_exporter's textfile directory); None disables either
+METRICS_JSON_LOG_PATH = os.environ.get("METRICS_JSON_LOG")
+METRICS_PROMETHEUS_PATH = os.environ.get("METRICS_PROMETHEUS_FILE")
+
+# Maps: up to MAP_CLUSTER_THRESHOLD points are drawn one by one; beyond that they are aggregated into a grid of at most
+# MAP_GRID_CELLS cells across the data extent, coarsened until there are no more than MAP_CLUSTER_THRESHOLD clusters,
+# and drawn as sized clusters up to MAP_DENSITY_THRESHOLD points and as a density layer above
+MAP_CLUSTER_THRESHOLD = 2000
+MAP_DENSITY_THRESHOLD = 50000
+MAP_GRID_CELLS = 150
+MAP_DENSITY_RADIUS = 12
+
+# Finished searches kept per page in each browser session, so reruns and downloads redraw them instantly
+SESSION_RESULTS_MAX_ENTRIES = 5
+
+# Seconds between progress/preview refreshes while results stream in, and rows shown in the preview
+STREAM_REFRESH_SECONDS = 1
+STREAM_PREVIEW_ROWS = 1000
+
+# Downloads are written this many rows at a time; files larger than EXPORT_SPOOL_BYTES are spooled to disk
+EXPORT_CHUNK_ROWS = 10000
+EXPORT_SPOOL_BYTES = 32 * 1024 * 1024
+
+# Rows parsed at a time when streaming uploaded files
+READER_CHUNK_SIZE = 5000
+
+# Rows per chunk for the headless batch runner (batch.py)
+BATCH_CHUNK_SIZE = 1000
+
+# Background jobs (see jobs.py): queue database and the folder holding each job's input, output and checkpoint
+JOBS_DB_PATH = "jobs.sqlite3"
+JOBS_DIR = "jobs"
+# Worker processes in a pool started with `python jobs.py worker` or by the app
+JOBS_WORKER_PROCESSES = max(1, min(4, os.cpu_count() or 1))
+# Start a worker pool from the app when a job is submitted and none is running
+JOBS_AUTOSTART_WORKERS = True
+JOBS_POLL_SECONDS = 2
+JOBS_HEARTBEAT_SECONDS = 5
+# A running job whose worker has not reported for this long is handed to another worker
+JOBS_STALE_SECONDS = 60
+# Search texts per saved chunk of an AIC job
+JOBS_CHUNK_ROWS = 500
+# Seconds between refreshes of the Background Jobs page
+JOBS_REFRESH_SECONDS = 3
\ No newline at end of file
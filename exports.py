@@ -0,0 +1,119 @@
+import gzip
+import io
+import tempfile
+
+import pandas as pd
+from openpyxl import Workbook
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+try:
+    import xlsxwriter
+except ImportError:
+    xlsxwriter = None
+
+import metrics
+from config import EXPORT_CHUNK_ROWS, EXPORT_SPOOL_BYTES
+
+# Data rows per worksheet (Excel's limit less the header row); longer exports continue on a new sheet
+EXCEL_MAX_ROWS = 1048575
+
+
+def _chunks(frame):
+    for start in range(0, len(frame), EXPORT_CHUNK_ROWS):
+        yield frame.iloc[start:start + EXPORT_CHUNK_ROWS]
+
+
+def _write_csv(frame, target, compress):
+    raw = gzip.GzipFile(fileobj=target, mode="wb", compresslevel=6) if compress else target
+    text = io.TextIOWrapper(raw, encoding="utf-8", newline="")
+    header = True
+    for chunk in _chunks(frame):
+        chunk.to_csv(text, index=False, header=header)
+        header = False
+    if header:
+        frame.to_csv(text, index=False)
+    text.flush()
+    # Detach so closing the wrapper does not close the target file
+    text.detach()
+    if compress:
+        raw.close()
+
+
+def _write_parquet(frame, target):
+    # Text columns are written as strings so every chunk shares the first chunk's schema
+    text_columns = {column: "string" for column in frame.columns if not pd.api.types.is_numeric_dtype(frame[column])}
+    schema = pa.Schema.from_pandas(frame.head(0).astype(text_columns), preserve_index=False)
+    with pq.ParquetWriter(target, schema, compression="zstd") as writer:
+        for chunk in _chunks(frame):
+            writer.write_table(pa.Table.from_pandas(chunk.astype(text_columns), schema=schema, preserve_index=False))
+
+
+def _xlsx_rows(frame):
+    # Rows with missing values as None
+    for chunk in _chunks(frame):
+        chunk = chunk.astype(object).where(chunk.notna(), None)
+        yield from chunk.itertuples(index=False, name=None)
+
+
+def _write_xlsx(frame, target):
+    header = [str(column) for column in frame.columns]
+    if xlsxwriter is not None:
+        # constant_memory flushes each row to the file as soon as the next one starts
+        workbook = xlsxwriter.Workbook(target, {"constant_memory": True, "strings_to_numbers": False,
+                                                "strings_to_formulas": False, "strings_to_urls": False})
+        sheet = None
+        for index, row in enumerate(_xlsx_rows(frame)):
+            if index % EXCEL_MAX_ROWS == 0:
+                sheet = workbook.add_worksheet(f"Results {index // EXCEL_MAX_ROWS + 1}")
+                sheet.write_row(0, 0, header)
+            sheet.write_row(index % EXCEL_MAX_ROWS + 1, 0, row)
+        if sheet is None:
+            workbook.add_worksheet("Results 1").write_row(0, 0, header)
+        workbook.close()
+        return
+
+    # Write-only workbooks stream rows to the file instead of keeping every cell object in memory
+    workbook = Workbook(write_only=True)
+    sheet = None
+    for index, row in enumerate(_xlsx_rows(frame)):
+        if index % EXCEL_MAX_ROWS == 0:
+            sheet = workbook.create_sheet(f"Results {index // EXCEL_MAX_ROWS + 1}")
+            sheet.append(header)
+        sheet.append(row)
+    if sheet is None:
+        workbook.create_sheet("Results 1").append(header)
+    workbook.save(target)
+
+
+# Label -> (file extension, MIME type, writer)
+EXPORT_FORMATS = {
+    "CSV": ("csv", "text/csv", lambda frame, target: _write_csv(frame, target, compress=False)),
+    "CSV (gzip)": ("csv.gz", "application/gzip", lambda frame, target: _write_csv(frame, target, compress=True)),
+    "Excel": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", _write_xlsx),
+}
+if pa is not None:
+    EXPORT_FORMATS["Parquet"] = ("parquet", "application/vnd.apache.parquet", _write_parquet)
+
+
+@metrics.timed("export")
+def export_file(frame, export_format):
+    # The export's bytes. The file is written chunk by chunk to a temporary file that stays in memory while small
+    # and moves to disk once it grows past EXPORT_SPOOL_BYTES, so the writers never hold a second copy of the rows
+    _, _, writer = EXPORT_FORMATS[export_format]
+    with tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_BYTES) as target:
+        writer(frame, target)
+        target.seek(0)
+        return target.read()
+
+
+def export_file_name(base_name, export_format):
+    return f"{base_name}.{EXPORT_FORMATS[export_format][0]}"
+
+
+def export_mime(export_format):
+    return EXPORT_FORMATS[export_format][1]
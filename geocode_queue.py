@@ -0,0 +1,94 @@
+import queue
+import threading
+import time
+
+from geopy.exc import GeocoderServiceError, GeocoderQueryError
+
+from geocoding import geocode, cached_geocode, normalize_address
+from config import GEOCODE_MAX_RETRIES
+
+
+class GeocodeQueue:
+    # Geocodes a batch of addresses on a background thread, one distinct address at a time.
+    # Requests go through geocoding's process-wide throttle; results are collected with drain().
+
+    def __init__(self, addresses, max_retries=GEOCODE_MAX_RETRIES):
+        # addresses: pandas Series of full addresses; results are reported against its index
+        self.max_retries = max_retries
+        self._results = queue.Queue()
+        self._stop = threading.Event()
+        self._pending = {}
+        for index, address in addresses.items():
+            normalized = normalize_address(address)
+            if normalized:
+                self._pending.setdefault(normalized, []).append(index)
+
+        self.total = len(self._pending)
+        # completed and failed are read by the page while the background thread updates them
+        self._lock = threading.Lock()
+        self.completed = 0
+        self.failed = 0
+        self._started = time.monotonic()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _geocode(self, address):
+        for attempt in range(self.max_retries + 1):
+            if self._stop.is_set():
+                break
+            try:
+                return geocode(address, raise_errors=True)
+            except GeocoderQueryError:
+                # Nominatim rejected the query itself; asking again gives the same answer
+                break
+            except GeocoderServiceError:
+                if attempt < self.max_retries:
+                    self._stop.wait(min(2 ** attempt, 30))
+        with self._lock:
+            self.failed += 1
+        return None, None, None
+
+    def _run(self):
+        # Addresses already in the cache are reported straight away, before any network call
+        remaining = []
+        for address, indexes in self._pending.items():
+            cached = cached_geocode(address)
+            if cached is None:
+                remaining.append((address, indexes))
+            else:
+                self._report(indexes, cached)
+
+        for address, indexes in remaining:
+            if self._stop.is_set():
+                break
+            self._report(indexes, self._geocode(address))
+
+    def _report(self, indexes, coordinates):
+        latitude, longitude, _ = coordinates
+        for index in indexes:
+            self._results.put((index, latitude, longitude))
+        with self._lock:
+            self.completed += 1
+
+    def drain(self):
+        # (index, latitude, longitude) for every row resolved since the last call
+        results = []
+        while True:
+            try:
+                results.append(self._results.get_nowait())
+            except queue.Empty:
+                return results
+
+    def done(self):
+        return not self._thread.is_alive()
+
+    def eta_seconds(self):
+        with self._lock:
+            completed = self.completed
+        if not completed:
+            return None
+        elapsed = time.monotonic() - self._started
+        return elapsed / completed * (self.total - completed)
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,230 @@
+import re
+import threading
+from collections import OrderedDict
+import pandas as pd
+from geopy.geocoders import Nominatim
+from geopy.exc import GeocoderTimedOut, GeocoderServiceError, GeocoderRateLimited, GeocoderQueryError, GeocoderUnavailable
+
+import metrics
+from cache import ResponseCache
+from rate_limit import get_limiter, get_breaker, CircuitOpenError
+from zip_centroids import locate_centroids
+from config import (GEOCODE_USER_AGENT, GEOCODE_NOMINATIM_DOMAIN, GEOCODE_NOMINATIM_SCHEME, GEOCODE_CACHE_ENABLED,
+                    GEOCODE_CACHE_PATH, GEOCODE_CACHE_MAX_ENTRIES, GEOCODE_MEMORY_CACHE_MAX_ENTRIES, GEOCODE_TIMEOUT,
+                    GEOCODE_RATE_LIMIT_PER_SECOND)
+
+_geolocator = None
+_persistent_cache = None
+# Most recently used lookups, in front of the SQLite cache; the oldest are dropped beyond GEOCODE_MEMORY_CACHE_MAX_ENTRIES
+_memory_cache = OrderedDict()
+_lock = threading.Lock()
+
+_EMPTY_PARTS = {"", "NAN", "NONE", "NULL"}
+
+# Metrics label for Nominatim calls, which go through geopy rather than http_client
+NOMINATIM_ENDPOINT = GEOCODE_NOMINATIM_DOMAIN + "/search"
+
+
+def get_geolocator():
+    # One Nominatim client is shared by every page and every call
+    global _geolocator
+    with _lock:
+        if _geolocator is None:
+            _geolocator = Nominatim(user_agent=GEOCODE_USER_AGENT, timeout=GEOCODE_TIMEOUT,
+                                    domain=GEOCODE_NOMINATIM_DOMAIN, scheme=GEOCODE_NOMINATIM_SCHEME)
+    return _geolocator
+
+
+def get_geocode_cache():
+    global _persistent_cache
+    with _lock:
+        if _persistent_cache is None:
+            _persistent_cache = ResponseCache(GEOCODE_CACHE_PATH, max_entries=GEOCODE_CACHE_MAX_ENTRIES)
+    return _persistent_cache
+
+
+def normalize_address(address):
+    # Uppercase, drop empty/placeholder parts and collapse punctuation and whitespace
+    if address is None:
+        return ""
+    parts = []
+    for part in str(address).split(","):
+        part = re.sub(r"[^\w\s#-]", " ", part.upper())
+        part = re.sub(r"\s+", " ", part).strip()
+        # Drop leftovers of missing values such as "nan" or "NY nan"
+        part = " ".join(token for token in part.split(" ") if token not in _EMPTY_PARTS)
+        if part:
+            parts.append(part)
+    return ", ".join(parts)
+
+
+def _memory_get(key):
+    # Call with _lock held; returns None on a miss
+    value = _memory_cache.get(key)
+    if value is not None:
+        _memory_cache.move_to_end(key)
+    return value
+
+
+def _memory_set(key, value):
+    # Call with _lock held
+    _memory_cache[key] = value
+    _memory_cache.move_to_end(key)
+    while len(_memory_cache) > GEOCODE_MEMORY_CACHE_MAX_ENTRIES:
+        _memory_cache.popitem(last=False)
+
+
+def cached_geocode(address):
+    # Cached (latitude, longitude, full address) for an address, or None when it has not been resolved yet
+    normalized = normalize_address(address)
+    key = f"one:{normalized}"
+    with _lock:
+        cached = _memory_get(key)
+    if cached is not None:
+        return tuple(cached)
+    if GEOCODE_CACHE_ENABLED:
+        cached = get_geocode_cache().get(key)
+        if cached is not None:
+            return tuple(cached)
+    return None
+
+
+def _cached_lookup(key, fetch, raise_errors=False):
+    with _lock:
+        if key in _memory_cache:
+            _memory_cache.move_to_end(key)
+            return _memory_cache[key]
+
+    if GEOCODE_CACHE_ENABLED:
+        cached = get_geocode_cache().get(key)
+        if cached is not None:
+            with _lock:
+                _memory_set(key, cached)
+            return cached
+
+    try:
+        value = fetch()
+    except (GeocoderTimedOut, GeocoderServiceError) as e:
+        # Transient failures are not cached so the address is retried next time
+        metrics.increment("lookup_errors_total", source="nominatim", error=type(e).__name__)
+        if raise_errors:
+            raise
+        return None
+
+    with _lock:
+        _memory_set(key, value)
+    if GEOCODE_CACHE_ENABLED:
+        get_geocode_cache().set(key, value)
+    return value
+
+
+def _nominatim_search(address, **options):
+    # Nominatim goes through geopy rather than http_client, but shares the same per-host limiter and breaker.
+    # The limiter's ceiling is the provider's rate limit, across all sessions and threads in the process.
+    breaker = get_breaker(GEOCODE_NOMINATIM_DOMAIN)
+    limiter = get_limiter(GEOCODE_NOMINATIM_DOMAIN, GEOCODE_RATE_LIMIT_PER_SECOND)
+    try:
+        breaker.before_request()
+    except CircuitOpenError as e:
+        # A geopy error, so callers treat it like any other transient failure (not cached)
+        raise GeocoderUnavailable(str(e))
+    limiter.acquire()
+    status = "200"
+    try:
+        with metrics.timer("http_request_seconds", endpoint=NOMINATIM_ENDPOINT):
+            result = get_geolocator().geocode(address, country_codes="us", **options)
+    except GeocoderRateLimited as e:
+        status = type(e).__name__
+        breaker.record_success()
+        limiter.throttled(e.retry_after)
+        raise
+    except GeocoderQueryError as e:
+        # A rejected query; the service itself is fine
+        status = type(e).__name__
+        breaker.record_success()
+        raise
+    except (GeocoderTimedOut, GeocoderServiceError) as e:
+        status = type(e).__name__
+        breaker.record_failure()
+        raise
+    finally:
+        metrics.increment("http_requests_total", endpoint=NOMINATIM_ENDPOINT, status=status)
+    breaker.record_success()
+    limiter.succeeded()
+    return result
+
+
+def _fetch_one(address):
+    location = _nominatim_search(address)
+    if location:
+        full_address = location.raw['display_name']
+        # Verify if the result is in the USA
+        if "United States" in full_address:
+            metrics.increment("lookups_total", source="nominatim", result="found")
+            return [location.latitude, location.longitude, full_address]
+    metrics.increment("lookups_total", source="nominatim", result="not_found")
+    return [None, None, None]
+
+
+def _fetch_many(address, max_results):
+    locations = _nominatim_search(address, exactly_one=False, limit=max_results)
+    results = []
+    for location in locations or []:
+        full_address = location.raw['display_name']
+        # Verify if the result is in the USA
+        if "United States" in full_address:
+            results.append({
+                'latitude': location.latitude,
+                'longitude': location.longitude,
+                'address': full_address
+            })
+    metrics.increment("lookups_total", source="nominatim", result="found" if results else "not_found")
+    return results
+
+
+def geocode(address, raise_errors=False):
+    normalized = normalize_address(address)
+    if not normalized:
+        return None, None, None
+    value = _cached_lookup(f"one:{normalized}", lambda: _fetch_one(normalized), raise_errors)
+    if value is None:
+        return None, None, None
+    return tuple(value)
+
+
+def geocode_many(addresses):
+    # Resolve each distinct normalized address once and fan the results back out in input order
+    keys = [normalize_address(address) for address in addresses]
+    resolved = {}
+    for key in keys:
+        if key not in resolved:
+            resolved[key] = geocode(key)
+    return [resolved[key] for key in keys]
+
+
+def geocode_candidates(address, max_results=5):
+    normalized = normalize_address(address)
+    if not normalized:
+        return []
+    value = _cached_lookup(f"many:{max_results}:{normalized}", lambda: _fetch_many(normalized, max_results))
+    return value or []
+
+
+@metrics.timed("locate_rows")
+def locate_npi_rows(result_data, refine=False):
+    # Offline ZIP/city centroid positions for every row, optionally refined to street level with Nominatim
+    def column(name):
+        return result_data[name] if name in result_data else pd.Series("", index=result_data.index)
+
+    located = locate_centroids(column('Address_1_Postal Code'), column('Address_1_City'), column('Address_1_State'))
+    if refine and 'Full Address' in result_data:
+        found = column('Status') == 'Found'
+        addresses = result_data.loc[found, 'Full Address']
+        for index, (latitude, longitude, _) in zip(addresses.index, geocode_many(addresses)):
+            if latitude is not None:
+                located.loc[index, ['Latitude', 'Longitude', 'Geocode Source']] = [latitude, longitude, 'Nominatim']
+
+    result_data['Latitude'] = located['Latitude']
+    result_data['Longitude'] = located['Longitude']
+    result_data['Geocode Source'] = located['Geocode Source']
+    return result_data
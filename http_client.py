@@ -0,0 +1,110 @@
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+from rate_limit import get_limiter, get_breaker
+from config import (HTTP_TIMEOUT, HTTP_POOL_MAXSIZE, HTTP_MAX_RETRIES, HTTP_BACKOFF_BASE, HTTP_BACKOFF_MAX,
+                    HTTP_RETRY_AFTER_MAX, HTTP_USER_AGENT, HTTP_CIRCUIT_WAIT_MAX)
+
+# Responses worth retrying: throttling and transient server errors
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    # One pooled keep-alive session shared by every outbound call
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=HTTP_POOL_MAXSIZE, pool_maxsize=HTTP_POOL_MAXSIZE, max_retries=0)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers["User-Agent"] = HTTP_USER_AGENT
+            _session = session
+    return _session
+
+
+def backoff_delay(attempt):
+    # Exponential backoff with full jitter
+    return random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * 2 ** attempt))
+
+
+def retry_after_seconds(response):
+    # Retry-After is either a number of seconds or an HTTP date
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def endpoint_name(url):
+    # Metrics label for a URL: host and path, without the query
+    parts = urlsplit(url)
+    return parts.netloc + parts.path
+
+
+def http_get(url, params=None, timeout=HTTP_TIMEOUT, max_retries=HTTP_MAX_RETRIES,
+             circuit_wait=HTTP_CIRCUIT_WAIT_MAX):
+    # GET through the shared session, retrying connection errors, timeouts, 429 and 5xx responses.
+    # The last response is returned as-is, so callers still decide what to do with error statuses.
+    # Every request first passes its host's shared rate limiter and circuit breaker (see rate_limit.py);
+    # circuit_wait is how long to wait for a paused host before giving up.
+    endpoint = endpoint_name(url)
+    host = urlsplit(url).netloc
+    limiter = get_limiter(host)
+    breaker = get_breaker(host)
+    for attempt in range(max_retries + 1):
+        if attempt:
+            metrics.increment("http_retries_total", endpoint=endpoint)
+        # Waits while the host is paused; raises CircuitOpenError if it stays paused for too long
+        breaker.before_request(circuit_wait)
+        limiter.acquire()
+        started = time.perf_counter()
+        try:
+            response = get_session().get(url, params=params, timeout=timeout)
+        except requests.exceptions.RequestException as e:
+            metrics.observe("http_request_seconds", time.perf_counter() - started, endpoint=endpoint)
+            metrics.increment("http_requests_total", endpoint=endpoint, status=type(e).__name__)
+            breaker.record_failure()
+            retryable = isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+            if attempt == max_retries or not retryable:
+                raise
+            delay = backoff_delay(attempt)
+        else:
+            metrics.observe("http_request_seconds", time.perf_counter() - started, endpoint=endpoint)
+            metrics.increment("http_requests_total", endpoint=endpoint, status=response.status_code)
+            retry_after = retry_after_seconds(response) if response.status_code in RETRY_STATUSES else None
+            if response.status_code == 429:
+                # Throttled, but the host is up: slow every caller down rather than pausing traffic
+                breaker.record_success()
+                limiter.throttled(min(retry_after, HTTP_RETRY_AFTER_MAX) if retry_after is not None else None)
+            elif response.status_code >= 500:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+                limiter.succeeded()
+            if response.status_code not in RETRY_STATUSES or attempt == max_retries:
+                return response
+            delay = retry_after if retry_after is not None else backoff_delay(attempt)
+            response.close()
+        time.sleep(min(delay, HTTP_RETRY_AFTER_MAX))
@@ -0,0 +1,424 @@
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+
+import pandas as pd
+
+import rate_limit
+from batch import run_batch, output_columns, CsvSink
+from aic_functions import iter_aic_results
+from npi_functions import iter_npi_by_details, add_full_address, IncompleteSearchError
+from provider_model import ProviderTables
+from geocoding import locate_npi_rows
+from readers import iter_first_column, count_rows
+from config import (JOBS_DB_PATH, JOBS_DIR, JOBS_WORKER_PROCESSES, JOBS_POLL_SECONDS, JOBS_HEARTBEAT_SECONDS,
+                    JOBS_STALE_SECONDS, JOBS_CHUNK_ROWS, NPI_MAX_CONCURRENCY)
+
+# Jobs live in a SQLite table shared by the app and any number of worker processes. A worker claims the oldest
+# queued job, runs it, and saves partial output plus a checkpoint after every chunk; the app polls the table.
+# A running job whose worker stops reporting is queued again and resumes from its last checkpoint.
+
+JOB_KINDS = {"npi_upload": "NPI upload", "npi_search": "Advanced search", "aic_batch": "AIC batch"}
+FINISHED_STATUSES = ("done", "failed", "cancelled")
+
+_schema_ready = False
+_sharing = None
+_sharing_lock = threading.Lock()
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def _connect():
+    global _schema_ready
+    conn = sqlite3.connect(JOBS_DB_PATH, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    if not _schema_ready:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, label TEXT NOT NULL, params TEXT NOT NULL, "
+            "status TEXT NOT NULL DEFAULT 'queued', done INTEGER NOT NULL DEFAULT 0, total INTEGER, "
+            "checkpoint TEXT, error TEXT, worker TEXT, cancel_requested INTEGER NOT NULL DEFAULT 0, "
+            "created_at REAL NOT NULL, started_at REAL, finished_at REAL, heartbeat_at REAL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)")
+        conn.execute("CREATE TABLE IF NOT EXISTS workers (name TEXT PRIMARY KEY, pid INTEGER, heartbeat_at REAL)")
+        # Every process sending registry/geocoder requests (the app and each worker), for sizing rate shares
+        conn.execute("CREATE TABLE IF NOT EXISTS rate_sharers (name TEXT PRIMARY KEY, pid INTEGER, heartbeat_at REAL)")
+        # When the app last started a pool, so a pool that has not reported yet is not started twice
+        conn.execute("CREATE TABLE IF NOT EXISTS worker_pool (id INTEGER PRIMARY KEY CHECK (id = 1), pid INTEGER, "
+                     "started_at REAL)")
+        _schema_ready = True
+    return conn
+
+
+def job_dir(job_id):
+    return os.path.join(JOBS_DIR, str(job_id))
+
+
+def output_path(job_id):
+    return os.path.join(job_dir(job_id), "output.csv")
+
+
+def read_output(job_id):
+    with open(output_path(job_id), "rb") as f:
+        return f.read()
+
+
+def submit_job(kind, params, label, input_name=None, input_bytes=None):
+    # Queue a job; an uploaded file is copied next to the job's output so the job does not depend on the session
+    if kind not in JOB_KINDS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    conn = _connect()
+    try:
+        job_id = conn.execute("INSERT INTO jobs (kind, label, params, status, created_at) VALUES (?, ?, ?, ?, ?)",
+                              (kind, label, json.dumps(params), "submitting", time.time())).lastrowid
+        os.makedirs(job_dir(job_id), exist_ok=True)
+        if input_bytes is not None:
+            extension = os.path.splitext(input_name or "")[1].lower() or ".csv"
+            params = dict(params, input=os.path.join(job_dir(job_id), "input" + extension))
+            with open(params["input"], "wb") as f:
+                f.write(input_bytes)
+        conn.execute("UPDATE jobs SET params = ?, status = 'queued' WHERE id = ?", (json.dumps(params), job_id))
+    finally:
+        conn.close()
+    return job_id
+
+
+def _job_dict(row):
+    job = dict(row)
+    job["params"] = json.loads(job["params"])
+    job["checkpoint"] = json.loads(job["checkpoint"]) if job["checkpoint"] else None
+    return job
+
+
+def get_job(job_id):
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    finally:
+        conn.close()
+    return _job_dict(row) if row else None
+
+
+def list_jobs(limit=50):
+    conn = _connect()
+    try:
+        rows = conn.execute("SELECT * FROM jobs WHERE status != 'submitting' ORDER BY id DESC LIMIT ?",
+                            (limit,)).fetchall()
+    finally:
+        conn.close()
+    return [_job_dict(row) for row in rows]
+
+
+def cancel_job(job_id):
+    # Queued jobs are cancelled straight away; running ones stop at their next checkpoint
+    conn = _connect()
+    try:
+        conn.execute("UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ? AND status = 'queued'",
+                     (time.time(), job_id))
+        conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = 'running'", (job_id,))
+    finally:
+        conn.close()
+
+
+def delete_job(job_id):
+    conn = _connect()
+    try:
+        conn.execute("DELETE FROM jobs WHERE id = ? AND status IN ('done', 'failed', 'cancelled')", (job_id,))
+    finally:
+        conn.close()
+    shutil.rmtree(job_dir(job_id), ignore_errors=True)
+
+
+def workers_alive():
+    conn = _connect()
+    try:
+        return conn.execute("SELECT COUNT(*) FROM workers WHERE heartbeat_at > ?",
+                            (time.time() - JOBS_STALE_SECONDS,)).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def start_workers(processes=JOBS_WORKER_PROCESSES):
+    # Detached worker pool that outlives the app process (and its restarts)
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__), "worker", "--processes", str(processes)],
+                            cwd=os.getcwd(), start_new_session=True,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def ensure_workers():
+    # Start a worker pool unless one is reporting or was started moments ago; returns True when one was started.
+    # Checking and starting happen under the database's write lock, so sessions submitting at the same time
+    # start one pool between them.
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        now = time.time()
+        alive = conn.execute("SELECT COUNT(*) FROM workers WHERE heartbeat_at > ?",
+                             (now - JOBS_STALE_SECONDS,)).fetchone()[0]
+        started = conn.execute("SELECT started_at FROM worker_pool WHERE id = 1").fetchone()
+        starting = started is not None and started["started_at"] > now - JOBS_STALE_SECONDS
+        if not alive and not starting:
+            pool = start_workers()
+            conn.execute("INSERT OR REPLACE INTO worker_pool (id, pid, started_at) VALUES (1, ?, ?)", (pool.pid, now))
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    return not alive and not starting
+
+
+def _share_rate_limits(name, active):
+    # Report whether this process is sending requests and take an equal share of each host's limit among the
+    # processes that are (counting this one, so an idle process is ready for its next request).
+    # A sender that stops reporting for three heartbeats (e.g. one that was killed) no longer counts.
+    conn = _connect()
+    try:
+        now = time.time()
+        if active:
+            conn.execute("INSERT OR REPLACE INTO rate_sharers (name, pid, heartbeat_at) VALUES (?, ?, ?)",
+                         (name, os.getpid(), now))
+        else:
+            conn.execute("DELETE FROM rate_sharers WHERE name = ?", (name,))
+        conn.execute("DELETE FROM rate_sharers WHERE heartbeat_at < ?", (now - 3 * JOBS_HEARTBEAT_SECONDS,))
+        others = conn.execute("SELECT COUNT(*) FROM rate_sharers WHERE name != ?", (name,)).fetchone()[0]
+    finally:
+        conn.close()
+    rate_limit.set_rate_share(1.0 / (others + 1))
+
+
+def share_rate_limits(name):
+    # Keep this process's share of the per-host limits current as other processes start and stop sending requests.
+    # The first call in a process starts a thread that registers the process as soon as it sends a request,
+    # re-reports every JOBS_HEARTBEAT_SECONDS while it keeps sending and deregisters it after a heartbeat without
+    # any; while idle it still follows the others' count. Later calls do nothing.
+    global _sharing
+    with _sharing_lock:
+        if _sharing is not None:
+            return
+
+        def report():
+            active = False
+            while True:
+                if active:
+                    time.sleep(JOBS_HEARTBEAT_SECONDS)
+                active = rate_limit.wait_for_requests(0 if active else JOBS_HEARTBEAT_SECONDS)
+                try:
+                    _share_rate_limits(name, active)
+                except sqlite3.Error:
+                    pass
+
+        _share_rate_limits(name, False)
+        _sharing = threading.Thread(target=report, daemon=True)
+        _sharing.start()
+
+
+def claim_job(worker):
+    # Hand the oldest queued job to this worker, first re-queueing running jobs whose worker went quiet
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        now = time.time()
+        conn.execute("UPDATE jobs SET status = 'queued', worker = NULL WHERE status = 'running' AND heartbeat_at < ?",
+                     (now - JOBS_STALE_SECONDS,))
+        row = conn.execute("SELECT * FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1").fetchone()
+        if row is not None:
+            conn.execute("UPDATE jobs SET status = 'running', worker = ?, started_at = COALESCE(started_at, ?), "
+                         "heartbeat_at = ? WHERE id = ?", (worker, now, now, row["id"]))
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    return _job_dict(row) if row else None
+
+
+def _update_job(job_id, **fields):
+    conn = _connect()
+    try:
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", list(fields.values()) + [job_id])
+    finally:
+        conn.close()
+
+
+class _JobContext:
+    # Progress reporting and cancellation for the job a worker is running
+
+    def __init__(self, job):
+        self.job = job
+        self.cancelled = threading.Event()
+
+    def progress(self, done, total=None, checkpoint=None):
+        fields = {"done": done, "heartbeat_at": time.time()}
+        if total is not None:
+            fields["total"] = total
+        if checkpoint is not None:
+            fields["checkpoint"] = json.dumps(checkpoint)
+        _update_job(self.job["id"], **fields)
+        if self.cancelled.is_set():
+            raise JobCancelled()
+
+
+def _run_npi_upload(context):
+    # batch.run_batch keeps its own checkpoint file next to the output, so a re-queued job resumes where it stopped
+    job = context.job
+    params = job["params"]
+    context.progress(job["done"], count_rows(params["input"]))
+    run_batch(params["input"], output_path(job["id"]), geocode=True, refine=params.get("refine", False),
+              max_concurrency=params.get("concurrency", NPI_MAX_CONCURRENCY),
+              checkpoint_path=os.path.join(job_dir(job["id"]), "checkpoint.json"), log=lambda message: None,
+              on_chunk=context.progress)
+
+
+def _run_npi_search(context):
+    # Registry pages can only be walked from the start, so a re-queued search starts over
+    job = context.job
+    columns = [column for column in output_columns(geocode=True) if column not in ("Input", "NPI Check")]
+    sink = CsvSink(output_path(job["id"]), None)
+    done = 0
+    failed_queries = []
+    truncated_queries = []
+    try:
+        for page in iter_npi_by_details(**job["params"], failed_queries=failed_queries,
+                                        truncated_queries=truncated_queries):
+            frame = locate_npi_rows(add_full_address(ProviderTables.from_details(page).wide()))
+            sink.write(frame.reindex(columns=columns), None)
+            done += len(page)
+            context.progress(done)
+    finally:
+        sink.close()
+    if failed_queries or truncated_queries:
+        # The job ends as failed, with the matches that were found still available for download
+        raise IncompleteSearchError(failed_queries, truncated_queries)
+
+
+def _run_aic_batch(context):
+    # Search texts are looked up JOBS_CHUNK_ROWS at a time; the checkpoint records how many are done and
+    # where the output ended, so a re-queued job truncates any half-written chunk and carries on
+    job = context.job
+    params = job["params"]
+    checkpoint = job["checkpoint"] or {"texts_done": 0, "output_offset": None}
+    context.progress(checkpoint["texts_done"], count_rows(params["input"]))
+    sink = CsvSink(output_path(job["id"]), checkpoint["output_offset"] if checkpoint["texts_done"] else None)
+    try:
+        for search_texts in iter_first_column(params["input"], chunk_size=JOBS_CHUNK_ROWS,
+                                              skip_rows=checkpoint["texts_done"]):
+            rows = [row for text_rows in iter_aic_results(search_texts) for row in text_rows]
+            checkpoint["output_offset"] = sink.write(pd.DataFrame(rows), None)
+            checkpoint["texts_done"] += len(search_texts)
+            context.progress(checkpoint["texts_done"], checkpoint=checkpoint)
+    finally:
+        sink.close()
+
+
+RUNNERS = {"npi_upload": _run_npi_upload, "npi_search": _run_npi_search, "aic_batch": _run_aic_batch}
+
+
+def run_job(job, worker):
+    context = _JobContext(job)
+    stop = threading.Event()
+
+    def heartbeat():
+        # Keeps the job claimed while a slow chunk runs and picks up cancel requests from the app
+        while not stop.wait(JOBS_HEARTBEAT_SECONDS):
+            _update_job(job["id"], heartbeat_at=time.time())
+            _beat(worker)
+            current = get_job(job["id"])
+            if current is None or current["cancel_requested"]:
+                context.cancelled.set()
+
+    thread = threading.Thread(target=heartbeat, daemon=True)
+    thread.start()
+    try:
+        RUNNERS[job["kind"]](context)
+    except JobCancelled:
+        _update_job(job["id"], status="cancelled", finished_at=time.time())
+    except Exception as e:
+        _update_job(job["id"], status="failed", error=f"{type(e).__name__}: {e}", finished_at=time.time())
+    else:
+        _update_job(job["id"], status="done", finished_at=time.time())
+    finally:
+        stop.set()
+        thread.join()
+
+
+def _beat(worker):
+    conn = _connect()
+    try:
+        conn.execute("INSERT OR REPLACE INTO workers (name, pid, heartbeat_at) VALUES (?, ?, ?)",
+                     (worker, os.getpid(), time.time()))
+    finally:
+        conn.close()
+
+
+def worker_loop(worker, once=False):
+    # Claim and run jobs until interrupted (or until the queue is empty with once=True)
+    share_rate_limits(worker)
+    while True:
+        _beat(worker)
+        job = claim_job(worker)
+        if job is not None:
+            run_job(job, worker)
+        elif once:
+            return
+        else:
+            time.sleep(JOBS_POLL_SECONDS)
+
+
+def run_workers(processes):
+    # One worker per process, so jobs run in parallel across cores; each takes an equal share of the
+    # per-host rate limits with the app and any other pool, so together they stay within them
+    context = multiprocessing.get_context("spawn")
+    host = socket.gethostname()
+    workers = [context.Process(target=worker_loop, args=(f"{host}:{os.getpid()}:{i}",), daemon=True)
+               for i in range(processes)]
+    for worker in workers:
+        worker.start()
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    try:
+        for worker in workers:
+            worker.join()
+    finally:
+        for worker in workers:
+            worker.terminate()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Background job queue for large NPI and AIC searches")
+    commands = parser.add_subparsers(dest="command", required=True)
+    worker = commands.add_parser("worker", help="run a pool of worker processes")
+    worker.add_argument("--processes", type=int, default=JOBS_WORKER_PROCESSES)
+    commands.add_parser("list", help="show recent jobs")
+    cancel = commands.add_parser("cancel", help="cancel a queued or running job")
+    cancel.add_argument("job_id", type=int)
+    args = parser.parse_args()
+
+    if args.command == "worker":
+        run_workers(max(1, args.processes))
+    elif args.command == "list":
+        for job in list_jobs():
+            total = f"/{job['total']}" if job["total"] is not None else ""
+            print(f"#{job['id']:<5} {job['status']:<10} {JOB_KINDS[job['kind']]:<16} {job['done']}{total}  "
+                  f"{job['label']}" + (f"  ({job['error']})" if job["error"] else ""))
+    elif args.command == "cancel":
+        cancel_job(args.job_id)
+
+
+if __name__ == "__main__":
+    main()
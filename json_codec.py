@@ -0,0 +1,25 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def loads(data):
+    # data: str or bytes; orjson's decode error subclasses json.JSONDecodeError, so callers catch either the same way
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(value):
+    # Compact JSON text
+    if orjson is not None:
+        return orjson.dumps(value).decode("utf-8")
+    return json.dumps(value, separators=(",", ":"))
+
+
+def response_json(response):
+    # Decodes the raw body instead of going through response.json()
+    return loads(response.content)
@@ -1,15 +1,377 @@
+import os
+import socket
+import time
+from datetime import datetime
+
 import streamlit as st
 import pandas as pd
-import plotly.express as px
 from streamlit_option_menu import option_menu
 
-from npi_functions import get_npi_details, parse_npi_data, blank_npi_data, get_npi_by_details
-from aic_functions import fetch_address, process_data
-from utils import get_coordinates, set_page_config, apply_custom_css, get_coordinates_multiple
+import metrics
+from npi_functions import (iter_checked_npi_details, get_npi_by_details, iter_npi_by_details, npi_cache_stats,
+                           add_full_address)
+from provider_model import ProviderTables
+from aic_functions import iter_aic_results
+from utils import set_page_config, apply_custom_css, input_signature, remember_results, recall_results
+from geocoding import locate_npi_rows
+from geocode_queue import GeocodeQueue
+from rate_limit import endpoint_status
+from jobs import (JOB_KINDS, FINISHED_STATUSES, submit_job, list_jobs, cancel_job, delete_job, workers_alive,
+                  ensure_workers, share_rate_limits, output_path, read_output)
+from maps import location_map
+from exports import EXPORT_FORMATS, export_file, export_file_name, export_mime
+from nppes_store import store_available
+from readers import iter_first_column, iter_first_column_values, count_rows, InputFileError
+from validation import CHECK_VALID, CHECK_DUPLICATE
+from config import (NPI_MAX_CONCURRENCY, HTTP_POOL_MAXSIZE, GEOCODE_REFINE_DEFAULT, GEOCODE_REDRAW_SECONDS,
+                    STREAM_REFRESH_SECONDS, STREAM_PREVIEW_ROWS, JOBS_AUTOSTART_WORKERS, JOBS_REFRESH_SECONDS)
 
 # Set page configuration
 set_page_config()
 apply_custom_css()
+# While the app sends registry and geocoder requests it shares the per-host limits with busy job workers
+share_rate_limits(f"app:{socket.gethostname()}:{os.getpid()}")
+
+
+def npi_map_figure(result_data):
+    return location_map(result_data, "NPI ID",
+                        ["Address_1_Address1", "Address_1_City", "Address_1_State", "Address_1_Postal Code"])
+
+
+def draw_npi_map(placeholder, result_data, key):
+    fig = npi_map_figure(result_data)
+    if fig is None:
+        placeholder.warning("Could not generate map due to missing location data.")
+    else:
+        with metrics.stage("map_render"):
+            placeholder.plotly_chart(fig, key=key)
+    return fig
+
+
+def refine_npi_locations(result_data, found, table, map_placeholder, saved):
+    # Street-level positions arrive from a background queue; the table, map and saved results are updated as
+    # they land, so a rerun part way through keeps the search and whatever was refined by then
+    geocoder = GeocodeQueue(result_data.loc[found, 'Full Address'])
+    progress = st.progress(0.0, text="Refining map positions...")
+    last_redraw = time.monotonic()
+    redraws = 0
+    changed = False
+    try:
+        while True:
+            finished = geocoder.done()
+            updates = [update for update in geocoder.drain() if update[1] is not None]
+            if updates:
+                indexes, latitudes, longitudes = zip(*updates)
+                result_data.loc[list(indexes), 'Latitude'] = latitudes
+                result_data.loc[list(indexes), 'Longitude'] = longitudes
+                result_data.loc[list(indexes), 'Geocode Source'] = 'Nominatim'
+                changed = True
+
+            text = f"Refined {geocoder.completed} of {geocoder.total} addresses"
+            eta = geocoder.eta_seconds()
+            if eta is not None and not finished:
+                text += f", about {int(eta)}s left"
+            progress.progress(geocoder.completed / geocoder.total if geocoder.total else 1.0, text=text)
+
+            if changed and (finished or time.monotonic() - last_redraw >= GEOCODE_REDRAW_SECONDS):
+                redraws += 1
+                table.dataframe(result_data)
+                saved["figure"] = draw_npi_map(map_placeholder, result_data[found], f"npi_map_{redraws}")
+                saved["tables"].set_columns(result_data, ["Latitude", "Longitude", "Geocode Source"])
+                last_redraw = time.monotonic()
+                changed = False
+            if finished:
+                break
+            time.sleep(0.5)
+    finally:
+        geocoder.stop()
+
+    if geocoder.failed:
+        st.warning(f"Could not refine {geocoder.failed} address(es); their centroid positions are kept.")
+
+
+def show_npi_results(tables, refine, notes, signature):
+    # Table and centroid map are shown straight away; Nominatim refinement then updates them in place.
+    # The results are remembered before refinement starts, so later reruns redraw them without searching again.
+    for note in notes:
+        st.info(note)
+    summary = f"Found {len(tables)} NPI details."
+    st.success(summary)
+    result_data = locate_npi_rows(add_full_address(tables.wide()))
+
+    # Display results in an interactive table
+    st.write("NPI Details:")
+    table = st.empty()
+    with metrics.stage("table_render"):
+        table.dataframe(result_data)
+
+    # Create a map with all locations
+    st.subheader("NPI Locations")
+    found = result_data['Status'] != 'Not Found'
+    map_placeholder = st.empty()
+    figure = draw_npi_map(map_placeholder, result_data[found], "npi_map_0")
+
+    # Only the compact tables are kept in the session; the wide view is rebuilt when the results are redrawn
+    tables.set_columns(result_data, ["Full Address", "Latitude", "Longitude", "Geocode Source"])
+    saved = {"notes": notes, "summary": summary, "tables": tables, "figure": figure}
+    remember_results("npi_results", signature, saved)
+    if refine and found.any():
+        refine_npi_locations(result_data, found, table, map_placeholder, saved)
+    show_npi_download(saved)
+
+
+def show_saved_npi_results(saved):
+    for note in saved["notes"]:
+        st.info(note)
+    st.success(saved["summary"])
+    st.write("NPI Details:")
+    st.dataframe(saved["tables"].wide())
+    st.subheader("NPI Locations")
+    if saved["figure"] is None:
+        st.warning("Could not generate map due to missing location data.")
+    else:
+        with metrics.stage("map_render"):
+            st.plotly_chart(saved["figure"])
+    show_npi_download(saved)
+
+
+def show_download(label, export_frame, base_name, key):
+    # The file is only written when the button is clicked; export_frame builds the rows to export
+    export_format = st.selectbox("Download format", list(EXPORT_FORMATS), key=f"{key}_format")
+    st.download_button(
+        label=f"{label} as {export_format}",
+        data=lambda: export_file(export_frame(), export_format),
+        file_name=export_file_name(base_name, export_format),
+        mime=export_mime(export_format),
+        key=f"{key}_download",
+        on_click="ignore"
+    )
+
+
+def npi_export_frame(tables):
+    result_data = tables.wide()
+    # Filter out rows with status not found
+    return result_data[result_data['Status'] != 'Not Found']
+
+
+def show_npi_download(saved):
+    # Download the results
+    show_download("📥 Download data", lambda: npi_export_frame(saved["tables"]), "npi_details", "npi")
+
+
+def aic_results(results_df, notes):
+    # Filter out rows with status not found
+    map_df = results_df[results_df['Status'] == 'Found']
+    fig = location_map(map_df, "AIC Name and Location/ZIP", ["Address", "Geocoder"])
+    return {"table": results_df, "figure": fig, "notes": notes}
+
+
+def show_aic_results(saved):
+    for note in saved["notes"]:
+        st.info(note)
+    # Display results in tabular form
+    st.subheader("Search Results")
+    st.dataframe(saved["table"])
+
+    if saved["figure"] is not None:
+        # Display interactive map
+        st.subheader("Location Map")
+        with metrics.stage("map_render"):
+            st.plotly_chart(saved["figure"])
+    else:
+        st.warning("Could not generate map due to missing location data.")
+
+    # Download button
+    results_df = saved["table"]
+    show_download("📥 Download results", lambda: results_df[results_df['Status'] == 'Found'], "aic_addresses", "aic")
+
+
+def stop_search(name):
+    st.session_state[name]["stopped"] = True
+
+
+def stream_progress(progress, label, done, total, started):
+    rate = done / max(time.monotonic() - started, 1e-9)
+    if not total:
+        progress.progress(0.0, text=f"{label}: {done} done ({rate:.1f}/s)")
+        return
+    eta = max(total - done, 0) / rate
+    progress.progress(min(done / total, 1.0), text=f"{label}: {done} of {total} ({rate:.1f}/s, about {int(eta)}s left)")
+
+
+def stream_search(name, signature, items, total, preview_frame, label):
+    # Collects items as they arrive, refreshing a progress bar and a preview of the latest rows.
+    # The items live in the session, so when Stop reruns the script stopped_search() can pick up what was finished.
+    partial = {"signature": signature, "items": [], "total": total, "stopped": False}
+    st.session_state[name] = partial
+    stop = st.empty()
+    stop.button("⏹ Stop", key=f"{name}_stop", on_click=stop_search, args=(name,))
+    progress = st.progress(0.0, text=f"{label}...")
+    preview = st.empty()
+    started = time.monotonic()
+    last_refresh = 0
+    # Timed as a whole: the lookups themselves plus the progress and preview refreshes
+    items = iter(items)
+    with metrics.stage(name):
+        try:
+            for item in items:
+                partial["items"].append(item)
+                if time.monotonic() - last_refresh >= STREAM_REFRESH_SECONDS:
+                    stream_progress(progress, label, len(partial["items"]), total, started)
+                    preview.dataframe(preview_frame(partial["items"][-STREAM_PREVIEW_ROWS:]))
+                    last_refresh = time.monotonic()
+        finally:
+            # Stop reruns the script from inside this loop; closing the generator cancels the queued lookups
+            # right away instead of whenever it is garbage collected
+            if hasattr(items, "close"):
+                items.close()
+
+    stop.empty()
+    progress.empty()
+    preview.empty()
+    del st.session_state[name]
+    return partial["items"]
+
+
+def stopped_search(name, signature):
+    # What a stopped stream_search() had finished for this input, or None
+    partial = st.session_state.get(name)
+    if partial is None or not partial["stopped"] or partial["signature"] != signature:
+        return None
+    del st.session_state[name]
+    return partial
+
+
+def stopped_note(partial):
+    done = len(partial["items"])
+    if partial["total"]:
+        return f"Stopped after {done} of {partial['total']}; showing the results finished so far."
+    return f"Stopped after {done}; showing the results finished so far."
+
+
+def npi_lookup_frame(checked):
+    return ProviderTables.from_details(npi_details for npi_details, _ in checked).wide()
+
+
+def npi_search_frame(npi_details_list):
+    return ProviderTables.from_details(npi_details_list).wide()
+
+
+def show_npi_lookups(checked, refine, notes, signature):
+    # checked: (details, check) pairs in input order
+    tables = ProviderTables.from_details(npi_details for npi_details, _ in checked)
+    if tables.empty:
+        st.warning("No valid NPI details found for the given input(s).")
+        return
+
+    npi_checks = pd.Series([check for _, check in checked], dtype="category")
+    tables.providers.insert(1, "NPI Check", npi_checks)
+    skipped = int((~npi_checks.isin([CHECK_VALID, CHECK_DUPLICATE])).sum())
+    duplicates = int((npi_checks == CHECK_DUPLICATE).sum())
+    if skipped or duplicates:
+        notes.append(f"Skipped {skipped} invalid ID(s) and reused lookups for {duplicates} duplicate(s).")
+    show_npi_results(tables, refine, notes, signature)
+
+
+def show_npi_search(npi_details_list, refine, notes, signature):
+    if not npi_details_list:
+        for note in notes:
+            st.info(note)
+        st.warning("No valid NPI details found for the given input(s).")
+        return
+    show_npi_results(ProviderTables.from_details(npi_details_list), refine, notes, signature)
+
+
+def aic_preview_frame(aic_rows):
+    return pd.DataFrame([row for rows in aic_rows for row in rows])
+
+
+def show_aic_search(aic_rows, notes):
+    if not aic_rows:
+        st.error("No addresses found for the given input(s).")
+        return None
+    saved = aic_results(aic_preview_frame(aic_rows), notes)
+    show_aic_results(saved)
+    return saved
+
+
+def submit_background_job(kind, params, label, input_name=None, input_bytes=None):
+    job_id = submit_job(kind, params, label, input_name, input_bytes)
+    if JOBS_AUTOSTART_WORKERS:
+        ensure_workers()
+    st.success(f"Queued background job #{job_id}. Follow it and download the results on the Background Jobs page.")
+
+
+def job_progress(job):
+    if job["total"]:
+        return f"{job['done']} / {job['total']} ({job['done'] / job['total']:.0%})"
+    return str(job["done"])
+
+
+def job_time(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M") if timestamp else ""
+
+
+@st.fragment(run_every=JOBS_REFRESH_SECONDS)
+def show_jobs():
+    # Re-reads the queue every few seconds without rerunning the rest of the page
+    jobs = list_jobs()
+    if any(job["status"] in ("queued", "running") for job in jobs) and not workers_alive():
+        st.warning("No job workers are running. Start them with `python jobs.py worker`.")
+    if not jobs:
+        st.info("No background jobs yet.")
+        return
+
+    st.dataframe(pd.DataFrame([{
+        "Job": job["id"],
+        "Type": JOB_KINDS[job["kind"]],
+        "Input": job["label"],
+        "Status": job["status"],
+        "Progress": job_progress(job),
+        "Submitted": job_time(job["created_at"]),
+        "Finished": job_time(job["finished_at"]),
+        "Error": job["error"] or "",
+    } for job in jobs]), hide_index=True)
+
+    jobs_by_id = {job["id"]: job for job in jobs}
+    job_id = st.selectbox("Job", list(jobs_by_id), key="selected_job",
+                          format_func=lambda job_id: f"#{job_id} {jobs_by_id[job_id]['label']}")
+    job = jobs_by_id[job_id]
+    path = output_path(job_id)
+    if os.path.exists(path):
+        # Cancelled and failed jobs keep whatever they finished
+        label = "📥 Download results (CSV)" if job["status"] == "done" else "📥 Download partial results (CSV)"
+        st.download_button(label, data=lambda: read_output(job_id), file_name=f"job_{job_id}.csv", mime="text/csv",
+                           key=f"job_{job_id}_download", on_click="ignore")
+    if job["status"] in FINISHED_STATUSES:
+        st.button("🗑 Delete job", key=f"job_{job_id}_delete", on_click=delete_job, args=(job_id,))
+    else:
+        st.button("⏹ Cancel job", key=f"job_{job_id}_cancel", on_click=cancel_job, args=(job_id,))
+
+
+def show_metrics_panel():
+    # Process-wide counters and latencies since the app started (or since the last reset)
+    data = metrics.snapshot()
+    st.write("Latency")
+    st.dataframe(pd.DataFrame([{
+        "Metric": histogram["name"],
+        "Labels": ", ".join(f"{key}={value}" for key, value in histogram["labels"].items()),
+        "Calls": histogram["count"],
+        "Total s": round(histogram["sum"], 2),
+        "p50 ms": round(histogram["p50"] * 1000, 1),
+        "p95 ms": round(histogram["p95"] * 1000, 1),
+    } for histogram in data["histograms"]]), hide_index=True)
+    st.write("Counters and gauges")
+    st.dataframe(pd.DataFrame([{
+        "Metric": counter["name"],
+        "Labels": ", ".join(f"{key}={value}" for key, value in counter["labels"].items()),
+        "Value": counter["value"],
+    } for counter in data["counters"] + data["gauges"]]), hide_index=True)
+    st.download_button("Metrics (JSON)", metrics.to_json(), "metrics.json", "application/json", key="metrics_json")
+    st.download_button("Metrics (Prometheus)", metrics.to_prometheus(), "metrics.prom", "text/plain",
+                       key="metrics_prometheus")
+    st.button("Reset metrics", on_click=metrics.reset)
+
 
 # Streamlit UI
 st.title("🏥 AIC/NPI Locator")
@@ -18,8 +380,8 @@ st.title("🏥 AIC/NPI Locator")
 with st.sidebar:
     selected = option_menu(
         menu_title="Navigation",
-        options=["NPI Address Locator", "AIC Address Locator"],
-        icons=["hospital", "geo-alt"],
+        options=["NPI Address Locator", "AIC Address Locator", "Background Jobs"],
+        icons=["hospital", "geo-alt", "list-task"],
         menu_icon="cast",
         default_index=0,
         styles={
@@ -37,24 +399,26 @@ if selected == "NPI Address Locator":
     # Option to upload file or enter NPI ID
     upload_option = st.radio("Choose input method:", ("Upload Excel/CSV file", "Enter single NPI ID", "Advanced Search"))
 
-    npi_ids = []
+    npi_id_chunks = []
     advanced_details = {}
+    npi_input = None
+    npi_total = None
+    max_concurrency = NPI_MAX_CONCURRENCY
 
     if upload_option == "Upload Excel/CSV file":
         uploaded_file = st.file_uploader("Upload your Excel/CSV file", type=["xlsx", "csv"])
         if uploaded_file is not None:
-            try:
-                if uploaded_file.name.endswith('.xlsx'):
-                    df = pd.read_excel(uploaded_file)
-                else:
-                    df = pd.read_csv(uploaded_file)
-                npi_ids = df.iloc[:, 0].astype(str).tolist()
-            except Exception as e:
-                st.error(f"Error reading file: {str(e)}")
+            # IDs are read lazily from the first column while lookups are already running
+            npi_id_chunks = iter_first_column(uploaded_file, uploaded_file.name)
+            npi_input = uploaded_file.getvalue()
+            npi_total = count_rows(uploaded_file, uploaded_file.name)
+        max_concurrency = st.slider("Concurrent lookups", min_value=1, max_value=HTTP_POOL_MAXSIZE, value=NPI_MAX_CONCURRENCY)
     elif upload_option == "Enter single NPI ID":
         single_npi = st.text_input("Enter NPI ID")
         if single_npi:
-            npi_ids = [single_npi]
+            npi_id_chunks = [[single_npi]]
+            npi_input = single_npi
+            npi_total = 1
     elif upload_option == "Advanced Search":
         col1, col2, col3 = st.columns(3)
         with col1:
@@ -75,6 +439,8 @@ if selected == "NPI Address Locator":
             taxonomy_description = st.text_input("Taxonomy Description")
             authorized_official_last_name = st.text_input("Authorized Official Last Name")
             country = st.text_input("Country")
+            backend_options = ["Remote registry", "Local store"] if store_available() else ["Remote registry"]
+            search_backend = st.radio("Search backend", backend_options)
 
         if npi_number or npi_type or taxonomy_description or provider_first_name or provider_last_name or org_name or authorized_official_first_name or authorized_official_last_name or city or state or country or postal_code or address_type:
             advanced_details = {
@@ -90,182 +456,91 @@ if selected == "NPI Address Locator":
                 "state": state,
                 "country": country,
                 "postal_code": postal_code,
-                "address_type": address_type
+                "address_type": address_type,
+                "backend": "local" if search_backend == "Local store" else "remote"
             }
-
-    if st.button("🔍 Search"):
-        if npi_ids:
-            with st.spinner('Fetching NPI details...'):
-                result_data = pd.DataFrame()
-                for npi_id in npi_ids:
-                    npi_details = get_npi_details(npi_id)
-
-                    if 'created_epoch' in npi_details.keys():
-                        parsed_data = parse_npi_data(npi_details)
-                    else:
-                        parsed_data = blank_npi_data(npi_details)
-
-                    result_data = pd.concat([result_data, parsed_data], ignore_index=True)
-
-            if not result_data.empty:
-                result_data['Full Address'] = result_data.apply(
-                    lambda row: f"{row['Address_1_Address1']}, {row['Address_1_City']}, {row['Address_1_State']} {row['Address_1_Postal Code']}",
-                    axis=1
-                )
-                result_data['Coordinates'] = result_data['Full Address'].apply(get_coordinates)
-                result_data['Latitude'] = result_data['Coordinates'].apply(lambda x: x[0] if x else None)
-                result_data['Longitude'] = result_data['Coordinates'].apply(lambda x: x[1] if x else None)
-
-                st.success(f"Found {len(result_data)} NPI details.")
-                # Additional code for displaying results or further processing goes here
-
-                # Display results in an interactive table
-                st.write("NPI Details:")
-                st.dataframe(result_data)
-
-                # Create a map with all locations
-                st.subheader("NPI Locations")
-
-                # Filter out rows with status not found
-                result_data = result_data[result_data['Status'] != 'Not Found']
-
-                if not result_data.empty:
-                    # Get coordinates for each address
-                    with st.spinner('Generating map...'):
-                        result_data['Full Address'] = result_data['Address_1_Address1'] + ', ' + result_data['Address_1_City'] + ', ' + result_data['Address_1_State'] + ' ' + result_data['Address_1_Postal Code']
-                        result_data['Coordinates'] = result_data['Full Address'].apply(get_coordinates)
-                        result_data['Latitude'] = result_data['Coordinates'].apply(lambda x: x[0] if x else None)
-                        result_data['Longitude'] = result_data['Coordinates'].apply(lambda x: x[1] if x else None)
-
-                        # Filter out rows with no coordinates
-                        map_data = result_data.dropna(subset=['Latitude', 'Longitude'])
-
-                        if not map_data.empty:
-                            fig = px.scatter_mapbox(map_data,
-                                                    lat="Latitude",
-                                                    lon="Longitude",
-                                                    hover_name="NPI ID",
-                                                    hover_data=["Address_1_Address1", "Address_1_City", "Address_1_State", "Address_1_Postal Code"],
-                                                    zoom=3,
-                                                    mapbox_style="open-street-map",
-                                                    color_discrete_sequence=["green"], # Set marker color
-                                                    size_max=15)
-
-                            fig.update_traces(marker=dict(size=15, symbol='circle', opacity=0.8))
-
-                            fig.update_layout(
-                                paper_bgcolor="rgba(0,0,0,0)",
-                                plot_bgcolor="rgba(0,0,0,0)",
-                                mapbox=dict(
-                                    center=dict(lat=map_data['Latitude'].mean(), lon=map_data['Longitude'].mean()),
-                                    zoom=3
-                                )
-                            )
-                            st.plotly_chart(fig)
-                        else:
-                            st.warning("Could not generate map due to missing location data.")
-                else:
-                    st.warning("Could not generate map due to missing location data.")
-
-                # Download the results
-                csv = result_data.to_csv(index=False).encode('utf-8')
-                st.download_button(
-                    label="📥 Download data as CSV",
-                    data=csv,
-                    file_name='npi_details.csv',
-                    mime='text/csv'
-                )
-            else:
-                st.warning("No valid NPI details found for the given input(s).")
+            npi_input = sorted(advanced_details.items())
+
+    # Map positions come from the offline ZIP/city centroid table; Nominatim is only used to refine them
+    refine_geocodes = st.checkbox("Refine map positions with Nominatim (slow for large batches)",
+                                  value=GEOCODE_REFINE_DEFAULT)
+
+    npi_signature = input_signature(upload_option, npi_input, refine_geocodes)
+    saved_results = recall_results("npi_results", npi_signature)
+    stopped_lookup = stopped_search("npi_lookup", npi_signature)
+    stopped_search_results = stopped_search("npi_search", npi_signature)
+
+    search_clicked = st.button("🔍 Search")
+    # Uploads and registry searches can also run as background jobs, which survive reruns, closed tabs and restarts
+    background_clicked = False
+    if ((upload_option == "Upload Excel/CSV file" and npi_input is not None)
+            or advanced_details.get("backend") == "remote"):
+        background_clicked = st.button("🗂 Run as background job")
+
+    if search_clicked:
+        if npi_id_chunks:
+            try:
+                # Blank, malformed and bad-check-digit IDs never reach the registry; duplicates are looked up once
+                checked = stream_search("npi_lookup", npi_signature,
+                                        iter_checked_npi_details(npi_id_chunks, max_concurrency=max_concurrency),
+                                        npi_total, npi_lookup_frame, "Fetching NPI details")
+            except InputFileError as e:
+                st.error(f"Error reading file: {str(e)}")
+                checked = []
+            show_npi_lookups(checked, refine_geocodes, [], npi_signature)
         elif advanced_details:
-            with st.spinner('Fetching NPI details...'):
-                result_data = pd.DataFrame()
-                npi_details_list = get_npi_by_details(
-                    advanced_details.get('npi_number'),
-                    advanced_details.get('npi_type'),
-                    advanced_details.get('taxonomy_description'),
-                    advanced_details.get('provider_first_name'),
-                    advanced_details.get('provider_last_name'),
-                    advanced_details.get('org_name'),
-                    advanced_details.get('authorized_official_first_name'),
-                    advanced_details.get('authorized_official_last_name'),
-                    advanced_details.get('city'),
-                    advanced_details.get('state'),
-                    advanced_details.get('country'),
-                    advanced_details.get('postal_code'),
-                    advanced_details.get('address_type')
-                )
-
-                if npi_details_list:
-                    for npi_details in npi_details_list:
-                        parsed_data = parse_npi_data(npi_details)
-                        result_data = pd.concat([result_data, parsed_data], ignore_index=True)
-                else:
-                    st.warning("No valid NPI details found for the given input(s).")
-
-            if not result_data.empty:
-                st.success(f"Found {len(result_data)} NPI details.")
-
-                # Display results in an interactive table
-                st.write("NPI Details:")
-                st.dataframe(result_data)
-
-                # Create a map with all locations
-                st.subheader("NPI Locations")
-
-                # Filter out rows with status not found
-                result_data = result_data[result_data['Status'] != 'Not Found']
-
-                if not result_data.empty:
-                    # Get coordinates for each address
-                    with st.spinner('Generating map...'):
-                        result_data['Full Address'] = result_data['Address_1_Address1'] + ', ' + result_data['Address_1_City'] + ', ' + result_data['Address_1_State'] + ' ' + result_data['Address_1_Postal Code']
-                        result_data['Coordinates'] =                        result_data['Coordinates'].apply(get_coordinates)
-                        result_data['Latitude'] = result_data['Coordinates'].apply(lambda x: x[0] if x else None)
-                        result_data['Longitude'] = result_data['Coordinates'].apply(lambda x: x[1] if x else None)
-
-                        # Filter out rows with no coordinates
-                        map_data = result_data.dropna(subset=['Latitude', 'Longitude'])
-
-                        if not map_data.empty:
-                            fig = px.scatter_mapbox(map_data,
-                                                    lat="Latitude",
-                                                    lon="Longitude",
-                                                    hover_name="NPI ID",
-                                                    hover_data=["Address_1_Address1", "Address_1_City", "Address_1_State", "Address_1_Postal Code"],
-                                                    zoom=3,
-                                                    mapbox_style="open-street-map",
-                                                    color_discrete_sequence=["green"],  # Set marker color
-                                                    size_max=15)
-
-                            fig.update_traces(marker=dict(size=15, symbol='circle', opacity=0.8))
-
-                            fig.update_layout(
-                                paper_bgcolor="rgba(0,0,0,0)",
-                                plot_bgcolor="rgba(0,0,0,0)",
-                                mapbox=dict(
-                                    center=dict(lat=map_data['Latitude'].mean(), lon=map_data['Longitude'].mean()),
-                                    zoom=3
-                                )
-                            )
-                            st.plotly_chart(fig)
-                        else:
-                            st.warning("Could not generate map due to missing location data.")
-                else:
-                    st.warning("Could not generate map due to missing location data.")
-
-                # Download the results
-                csv = result_data.to_csv(index=False).encode('utf-8')
-                st.download_button(
-                    label="📥 Download data as CSV",
-                    data=csv,
-                    file_name='npi_details.csv',
-                    mime='text/csv'
-                )
+            search_args = [advanced_details.get(key) for key in (
+                'npi_number', 'npi_type', 'taxonomy_description', 'provider_first_name', 'provider_last_name',
+                'org_name', 'authorized_official_first_name', 'authorized_official_last_name', 'city', 'state',
+                'country', 'postal_code', 'address_type')]
+
+            notes = []
+            if advanced_details.get('backend') == 'local':
+                with st.spinner('Fetching NPI details...'):
+                    npi_details_list = get_npi_by_details(*search_args, backend='local')
             else:
-                st.warning("No valid NPI details found for the given input(s).")
+                # Render matches page by page while the remaining pages are still being fetched
+                failed_queries = []
+                truncated_queries = []
+                npi_details_list = stream_search("npi_search", npi_signature,
+                                            (npi_details
+                                             for page in iter_npi_by_details(*search_args,
+                                                                             failed_queries=failed_queries,
+                                                                             truncated_queries=truncated_queries)
+                                             for npi_details in page),
+                                            None, npi_search_frame, "Fetching NPI details")
+                if failed_queries:
+                    notes.append(f"{len(failed_queries)} registry request(s) kept failing, so some matches may be "
+                                 f"missing. Search again to fill the gaps.")
+                if truncated_queries:
+                    notes.append(f"{len(truncated_queries)} part(s) of this search matched more providers than the "
+                                 f"registry returns, even within a single ZIP code and provider type, so some matches "
+                                 f"are missing. Add a name, city or taxonomy to narrow the search.")
+
+            show_npi_search(npi_details_list, refine_geocodes, notes, npi_signature)
         else:
             st.warning("Please enter an NPI ID, upload a file, or enter individual or organization details before searching.")
+    elif background_clicked:
+        if upload_option == "Upload Excel/CSV file":
+            submit_background_job("npi_upload", {"concurrency": max_concurrency, "refine": refine_geocodes},
+                                  uploaded_file.name, uploaded_file.name, npi_input)
+        else:
+            search = {key: value for key, value in advanced_details.items() if key != "backend"}
+            label = ", ".join(f"{key}={value}" for key, value in search.items() if value and value != "Any")
+            if label:
+                submit_background_job("npi_search", search, label)
+            else:
+                st.warning("Please enter individual or organization details before starting a background search.")
+    elif stopped_lookup is not None or stopped_search_results is not None:
+        # The Stop button reran the script; show what was finished before it was pressed
+        if stopped_lookup is not None:
+            show_npi_lookups(stopped_lookup["items"], refine_geocodes, [stopped_note(stopped_lookup)], npi_signature)
+        else:
+            show_npi_search(stopped_search_results["items"], refine_geocodes, [stopped_note(stopped_search_results)],
+                            npi_signature)
+    elif saved_results is not None:
+        # Any other widget interaction reruns the script; redraw the last results instead of searching again
+        show_saved_npi_results(saved_results)
 elif selected == "AIC Address Locator":
     st.header("AIC Address Locator")
     st.write("Enter the AIC Name and Location/ZIP code or upload a file to get the address.")
@@ -275,94 +550,73 @@ elif selected == "AIC Address Locator":
 
     if upload_option == "Upload Excel/CSV file":
         uploaded_file = st.file_uploader("Upload your Excel/CSV file", type=["xlsx", "csv"])
+        search_texts = []
+        aic_input = None
+        aic_total = None
         if uploaded_file is not None:
-            try:
-                if uploaded_file.name.endswith('.xlsx'):
-                    df = pd.read_excel(uploaded_file)
-                else:
-                    df = pd.read_csv(uploaded_file)
-                search_texts = df.iloc[:, 0].astype(str).tolist()
-            except Exception as e:
-                st.error(f"Error reading file: {str(e)}")
-                search_texts = []
+            search_texts = iter_first_column_values(uploaded_file, uploaded_file.name)
+            aic_input = uploaded_file.getvalue()
+            aic_total = count_rows(uploaded_file, uploaded_file.name)
     else:
         search_text = st.text_input("AIC Name and Location/ZIP:")
         search_texts = [search_text] if search_text else []
+        aic_input = search_text
+        aic_total = 1
+
+    aic_signature = input_signature(upload_option, aic_input)
+    saved_aic = recall_results("aic_results", aic_signature)
+    stopped_aic = stopped_search("aic_search", aic_signature)
+
+    search_clicked = st.button("🔍 Search")
+    background_clicked = False
+    if upload_option == "Upload Excel/CSV file" and aic_input is not None:
+        background_clicked = st.button("🗂 Run as background job")
 
-    if st.button("🔍 Search"):
+    if search_clicked:
         if search_texts:
-            results = []
-            with st.spinner('Searching for addresses...'):
-                for search_text in search_texts:
-                    locations = get_coordinates_multiple(search_text)
-                    if locations:
-                        for location in locations:
-                            results.append({
-                                "AIC Name and Location/ZIP": search_text,
-                                "Address": location['address'],
-                                "Latitude": location['latitude'],
-                                "Longitude": location['longitude'],
-                                "Status": "Found"
-                            })
-                    else:
-                        results.append({
-                            "AIC Name and Location/ZIP": search_text,
-                            "Address": "",
-                            "Latitude": "",
-                            "Longitude": "",
-                            "Status": "Not Found"
-                        })
-
-            if results:
-                results_df = pd.DataFrame(results)
-
-                # Display results in tabular form
-                st.subheader("Search Results")
-                st.dataframe(results_df)
-
-                # Filter out rows with status not found
-                map_df = results_df[results_df['Status'] == 'Found']
-                results_df = results_df[results_df['Status'] == 'Found']
-
-                if not map_df.empty:
-                    # Display interactive map
-                    st.subheader("Location Map")
-                    fig = px.scatter_mapbox(map_df,
-                                            lat="Latitude",
-                                            lon="Longitude",
-                                            zoom=3,
-                                            hover_name="AIC Name and Location/ZIP",
-                                            hover_data=["Address"],
-                                            mapbox_style="open-street-map",
-                                            color_discrete_sequence=["green"], # Set marker color
-                                            size_max=15) # Set maximum marker size
-
-                    fig.update_traces(marker=dict(size=15, symbol='circle', opacity=0.8))
-
-                    fig.update_layout(
-                        paper_bgcolor="rgba(0,0,0,0)",
-                        plot_bgcolor="rgba(0,0,0,0)",
-                        mapbox=dict(
-                            center=dict(lat=map_df['Latitude'].mean(), lon=map_df['Longitude'].mean()),
-                            zoom=3
-                        )
-                    )
-                    st.plotly_chart(fig)
-                else:
-                    st.warning("Could not generate map due to missing location data.")
-
-                # Download button
-                csv = results_df.to_csv(index=False).encode('utf-8')
-                st.download_button(
-                    label="📥 Download results as CSV",
-                    data=csv,
-                    file_name='aic_addresses.csv',
-                    mime='text/csv',
-                )
-            else:
-                st.error("No addresses found for the given input(s).")
+            try:
+                aic_rows = stream_search("aic_search", aic_signature, iter_aic_results(search_texts), aic_total,
+                                         aic_preview_frame, "Searching for addresses")
+            except InputFileError as e:
+                st.error(f"Error reading file: {str(e)}")
+                aic_rows = []
+            saved_aic = show_aic_search(aic_rows, [])
+            if saved_aic is not None:
+                remember_results("aic_results", aic_signature, saved_aic)
         else:
             st.warning("Please enter an AIC Name and Location/ZIP or upload a file.")
+    elif background_clicked:
+        submit_background_job("aic_batch", {}, uploaded_file.name, uploaded_file.name, aic_input)
+    elif stopped_aic is not None:
+        saved_aic = show_aic_search(stopped_aic["items"], [stopped_note(stopped_aic)])
+        if saved_aic is not None:
+            remember_results("aic_results", aic_signature, saved_aic)
+    elif saved_aic is not None:
+        show_aic_results(saved_aic)
+elif selected == "Background Jobs":
+    st.header("Background Jobs")
+    st.write("Jobs keep running in worker processes after this page is closed; results can be downloaded here "
+             "once they finish.")
+    show_jobs()
+
+# Registry cache usage
+with st.sidebar:
+    cache_stats = npi_cache_stats()
+    st.caption(f"NPI cache: {cache_stats['entries']} entries, {cache_stats['hits']} hits, "
+               f"{cache_stats['misses']} misses ({cache_stats['hit_rate']:.0%} hit rate)")
+    # Hosts that are paused or slowed down, for every session in this server process
+    for status in endpoint_status():
+        if status["state"] != "closed":
+            retry = f"retrying in {status['retry_in']:.0f}s" if status["retry_in"] else "retrying now"
+            st.warning(f"{status['endpoint']} is paused after repeated failures ({retry}).")
+        elif status["rate"] is not None and status["rate"] < status["max_rate"]:
+            st.caption(f"{status['endpoint']}: slowed to {status['rate']:.1f} of {status['max_rate']:.0f} "
+                       f"requests/s after throttling")
+    if st.checkbox("Show metrics", key="show_metrics"):
+        show_metrics_panel()
+
+# Structured JSON log / Prometheus text file, when configured
+metrics.export()
 
 # Footer
 st.markdown("---")
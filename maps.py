@@ -0,0 +1,97 @@
+import numpy as np
+import pandas as pd
+import plotly.express as px
+
+import metrics
+from config import MAP_CLUSTER_THRESHOLD, MAP_DENSITY_THRESHOLD, MAP_GRID_CELLS, MAP_DENSITY_RADIUS
+
+
+def _snap(latitudes, longitudes, cell_size):
+    points = pd.DataFrame({
+        "Latitude": latitudes,
+        "Longitude": longitudes,
+        "row": np.floor(latitudes / cell_size).astype(np.int64),
+        "col": np.floor(longitudes / cell_size).astype(np.int64),
+    })
+    return points.groupby(["row", "col"], sort=False).agg(
+        Latitude=("Latitude", "mean"), Longitude=("Longitude", "mean"), Count=("Latitude", "size")
+    ).reset_index(drop=True)
+
+
+def grid_clusters(latitudes, longitudes, cells=MAP_GRID_CELLS, max_clusters=MAP_CLUSTER_THRESHOLD):
+    # Snap points to a square grid sized from the data extent and collapse each cell to its mean position and count.
+    # The grid starts at cells across and is coarsened until there are at most max_clusters clusters, so a map
+    # never carries more markers than the point-by-point one would.
+    span = max(np.ptp(latitudes), np.ptp(longitudes), 1e-6)
+    while True:
+        clusters = _snap(latitudes, longitudes, span / cells)
+        if len(clusters) <= max_clusters or cells <= 1:
+            return clusters
+        # Occupied cells grow roughly with the square of the cells across
+        cells = max(1, min(cells - 1, int(cells * (max_clusters / len(clusters)) ** 0.5)))
+
+
+def _style(fig, latitudes, longitudes):
+    fig.update_layout(
+        paper_bgcolor="rgba(0,0,0,0)",
+        plot_bgcolor="rgba(0,0,0,0)",
+        mapbox=dict(
+            center=dict(lat=latitudes.mean(), lon=longitudes.mean()),
+            zoom=3
+        )
+    )
+    return fig
+
+
+@metrics.timed("map_build")
+def location_map(data, hover_name, hover_data):
+    # The one map builder for every page. Small results are drawn point by point with their hover columns;
+    # larger ones are aggregated here into grid clusters with counts, and very large ones into a density layer,
+    # so the browser never receives one marker per row.
+    latitudes = pd.to_numeric(data["Latitude"], errors="coerce")
+    longitudes = pd.to_numeric(data["Longitude"], errors="coerce")
+    located = latitudes.notna() & longitudes.notna()
+    if not located.any():
+        return None
+    latitudes = latitudes[located].to_numpy(dtype=float)
+    longitudes = longitudes[located].to_numpy(dtype=float)
+
+    if len(latitudes) <= MAP_CLUSTER_THRESHOLD:
+        # Only the columns shown on hover are sent along with the positions
+        points = data.loc[located, [hover_name] + hover_data].copy()
+        points["Latitude"] = latitudes
+        points["Longitude"] = longitudes
+        fig = px.scatter_mapbox(points,
+                                lat="Latitude",
+                                lon="Longitude",
+                                hover_name=hover_name,
+                                hover_data=hover_data,
+                                zoom=3,
+                                mapbox_style="open-street-map",
+                                color_discrete_sequence=["green"],  # Set marker color
+                                size_max=15)
+        fig.update_traces(marker=dict(size=15, symbol='circle', opacity=0.8))
+        return _style(fig, latitudes, longitudes)
+
+    clusters = grid_clusters(latitudes, longitudes)
+    if len(latitudes) <= MAP_DENSITY_THRESHOLD:
+        fig = px.scatter_mapbox(clusters,
+                                lat="Latitude",
+                                lon="Longitude",
+                                size="Count",
+                                hover_data={"Count": True, "Latitude": False, "Longitude": False},
+                                zoom=3,
+                                mapbox_style="open-street-map",
+                                color_discrete_sequence=["green"],
+                                size_max=30)
+        fig.update_traces(marker=dict(opacity=0.8))
+    else:
+        fig = px.density_mapbox(clusters,
+                                lat="Latitude",
+                                lon="Longitude",
+                                z="Count",
+                                radius=MAP_DENSITY_RADIUS,
+                                hover_data={"Count": True, "Latitude": False, "Longitude": False},
+                                zoom=3,
+                                mapbox_style="open-street-map")
+    return _style(fig, latitudes, longitudes)
@@ -0,0 +1,188 @@
+import functools
+import os
+import threading
+import time
+
+from json_codec import dumps
+from config import METRICS_ENABLED, METRICS_LATENCY_BUCKETS, METRICS_JSON_LOG_PATH, METRICS_PROMETHEUS_PATH
+
+# Process-wide counters, gauges and latency histograms. Every metric carries labels (endpoint, stage, ...);
+# a snapshot can be shown in the sidebar debug panel, appended to a JSON log or written as a Prometheus text file.
+#
+#   http_requests_total{endpoint,status}   http_request_seconds{endpoint}   http_retries_total{endpoint}
+#   lookup_errors_total{source,error}      cache_lookups_total{cache,result}  stage_seconds{stage}
+#   rate_limit_per_second{endpoint}        rate_limit_wait_seconds{endpoint}  circuit_open{endpoint}
+
+PROMETHEUS_PREFIX = "npi_locator_"
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_histograms = {}
+_started = time.time()
+
+
+def _key(name, labels):
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def increment(name, amount=1, **labels):
+    if not METRICS_ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def set_gauge(name, value, **labels):
+    if not METRICS_ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _gauges[key] = value
+
+
+def observe(name, seconds, **labels):
+    if not METRICS_ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = {"buckets": [0] * (len(METRICS_LATENCY_BUCKETS) + 1), "sum": 0.0,
+                                            "count": 0}
+        # The last bucket is +Inf
+        position = len(METRICS_LATENCY_BUCKETS)
+        for i, bound in enumerate(METRICS_LATENCY_BUCKETS):
+            if seconds <= bound:
+                position = i
+                break
+        histogram["buckets"][position] += 1
+        histogram["sum"] += seconds
+        histogram["count"] += 1
+
+
+class timer:
+    # with timer("stage_seconds", stage="build_tables"): ... records the block's duration, even when it raises
+
+    def __init__(self, name, **labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        observe(self.name, time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+def stage(name):
+    return timer("stage_seconds", stage=name)
+
+
+def timed(stage_name):
+    # Decorator form of stage() for plain functions
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(stage_name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def quantile(histogram, q):
+    # Estimate from the bucket counts, interpolating inside the bucket like Prometheus' histogram_quantile
+    if not histogram["count"]:
+        return None
+    rank = q * histogram["count"]
+    seen = 0
+    lower = 0.0
+    for count, upper in zip(histogram["buckets"], list(METRICS_LATENCY_BUCKETS) + [None]):
+        if count and seen + count >= rank:
+            if upper is None:
+                # Beyond the last bound; the best estimate is the bound itself
+                return lower
+            return lower + (upper - lower) * (rank - seen) / count
+        seen += count
+        if upper is not None:
+            lower = upper
+    return lower
+
+
+def snapshot():
+    # Plain-data copy of every metric
+    with _lock:
+        counters = [{"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(_counters.items())]
+        gauges = [{"name": name, "labels": dict(labels), "value": value}
+                  for (name, labels), value in sorted(_gauges.items())]
+        histograms = [{"name": name, "labels": dict(labels), "buckets": list(histogram["buckets"]),
+                       "sum": histogram["sum"], "count": histogram["count"]}
+                      for (name, labels), histogram in sorted(_histograms.items())]
+    for histogram in histograms:
+        histogram["p50"] = quantile(histogram, 0.5)
+        histogram["p95"] = quantile(histogram, 0.95)
+    return {"time": time.time(), "uptime_seconds": time.time() - _started, "counters": counters,
+            "gauges": gauges, "histograms": histograms, "bounds": list(METRICS_LATENCY_BUCKETS)}
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _histograms.clear()
+
+
+def to_json():
+    return dumps(snapshot())
+
+
+def _prometheus_labels(labels, extra=None):
+    items = list(labels.items()) + list((extra or {}).items())
+    if not items:
+        return ""
+    escaped = [(key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for key, value in items]
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+def to_prometheus():
+    # Prometheus text exposition format, ready for node_exporter's textfile collector
+    data = snapshot()
+    lines = []
+    typed = set()
+    for kind, values in (("counter", data["counters"]), ("gauge", data["gauges"])):
+        for value in values:
+            name = PROMETHEUS_PREFIX + value["name"]
+            if name not in typed:
+                lines.append(f"# TYPE {name} {kind}")
+                typed.add(name)
+            lines.append(f"{name}{_prometheus_labels(value['labels'])} {value['value']}")
+    for histogram in data["histograms"]:
+        name = PROMETHEUS_PREFIX + histogram["name"]
+        if name not in typed:
+            lines.append(f"# TYPE {name} histogram")
+            typed.add(name)
+        cumulative = 0
+        for count, bound in zip(histogram["buckets"], data["bounds"] + ["+Inf"]):
+            cumulative += count
+            lines.append(f"{name}_bucket{_prometheus_labels(histogram['labels'], {'le': bound})} {cumulative}")
+        lines.append(f"{name}_sum{_prometheus_labels(histogram['labels'])} {histogram['sum']:.6f}")
+        lines.append(f"{name}_count{_prometheus_labels(histogram['labels'])} {histogram['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def export(json_log_path=METRICS_JSON_LOG_PATH, prometheus_path=METRICS_PROMETHEUS_PATH):
+    # Append a snapshot line to the JSON log and rewrite the Prometheus file; either path may be None
+    if not METRICS_ENABLED:
+        return
+    if json_log_path:
+        with open(json_log_path, "a", encoding="utf-8") as f:
+            f.write(to_json() + "\n")
+    if prometheus_path:
+        # Written next to the target and renamed, so a scraper never sees a half-written file
+        with open(prometheus_path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(to_prometheus())
+        os.replace(prometheus_path + ".tmp", prometheus_path)
@@ -1,207 +1,395 @@
 import requests
 import json
+import threading
 import pandas as pd
-from config import API_URL
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from cache import ResponseCache
+from nppes_store import store_available, lookup_npi, search_providers
+from validation import preflight_npi_ids, CHECK_VALID, CHECK_DUPLICATE
+import metrics
+from http_client import http_get
+from json_codec import response_json
+from provider_model import flatten_npi_record
+from config import (API_URL, API_VERSION, NPI_MAX_CONCURRENCY, NPI_CACHE_ENABLED, NPI_CACHE_PATH, NPI_CACHE_TTL_SECONDS,
+                    NPI_CACHE_MAX_ENTRIES, NPI_CACHE_TRUST_LAST_UPDATED_DAYS, NPI_CACHE_MAX_AGE_SECONDS,
+                    NPPES_STORE_API_FALLBACK, NPI_SEARCH_QUERY_RETRIES)
+
+# Registry paging limits: at most 200 results per page and a skip of at most 1000
+NPI_API_PAGE_SIZE = 200
+NPI_API_MAX_SKIP = 1000
+
+# How _iter_query_pages ended: every match fetched, cut off at the skip ceiling, or a page request failed
+QUERY_COMPLETE = "complete"
+QUERY_TRUNCATED = "truncated"
+QUERY_FAILED = "failed"
+
+US_STATE_CODES = [
+    "AL", "AK", "AZ", "AR", "CA", "CO", "CT", "DE", "DC", "FL", "GA", "HI", "ID", "IL", "IN", "IA", "KS", "KY",
+    "LA", "ME", "MD", "MA", "MI", "MN", "MS", "MO", "MT", "NE", "NV", "NH", "NJ", "NM", "NY", "NC", "ND", "OH",
+    "OK", "OR", "PA", "RI", "SC", "SD", "TN", "TX", "UT", "VT", "VA", "WA", "WV", "WI", "WY", "AS", "GU", "MP",
+    "PR", "VI", "AA", "AE", "AP",
+]
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    global _response_cache
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache(NPI_CACHE_PATH, ttl_seconds=NPI_CACHE_TTL_SECONDS,
+                                            max_entries=NPI_CACHE_MAX_ENTRIES,
+                                            max_age_seconds=NPI_CACHE_MAX_AGE_SECONDS)
+    return _response_cache
+
+
+def npi_cache_stats():
+    if not NPI_CACHE_ENABLED:
+        return {"entries": 0, "hits": 0, "misses": 0, "hit_rate": 0.0}
+    return get_response_cache().stats()
+
+
+def _is_still_current(npi_data):
+    # Records that have not been touched for a long time are treated as current past the TTL
+    if NPI_CACHE_TRUST_LAST_UPDATED_DAYS is None:
+        return False
+    last_updated = npi_data.get("basic", {}).get("last_updated", "")
+    try:
+        updated = datetime.strptime(last_updated, "%Y-%m-%d").date()
+    except (TypeError, ValueError):
+        return False
+    return (date.today() - updated).days >= NPI_CACHE_TRUST_LAST_UPDATED_DAYS
+
 
 def get_npi_details(npi_id):
+    # Answer from the local NPPES store when one has been ingested; deactivated NPIs it knows of come back as
+    # not found from the store and never reach the registry API
+    if store_available():
+        record = lookup_npi(npi_id)
+        if record is not None:
+            return record
+        if not NPPES_STORE_API_FALLBACK:
+            return {"NPI ID": npi_id, "Status": "Not Found"}
+
+    cache_key = f"npi:{str(npi_id).strip()}"
+    if NPI_CACHE_ENABLED:
+        cached = get_response_cache().get(cache_key, is_current=_is_still_current)
+        if cached is not None:
+            return cached
+
     try:
-        response = requests.get(API_URL.format(npi_id))
+        response = http_get(API_URL, params={"number": str(npi_id).strip(), "version": API_VERSION})
         response.raise_for_status()
-        data = response.json()
+        data = response_json(response)
         if "result_count" in data and data["result_count"] > 0:
-            return data["results"][0]
+            result = data["results"][0]
+            metrics.increment("lookups_total", source="registry", result="found")
         else:
-            return {"NPI ID": npi_id, "Status": "Not Found"}
+            result = {"NPI ID": npi_id, "Status": "Not Found"}
+            metrics.increment("lookups_total", source="registry", result="not_found")
+        if NPI_CACHE_ENABLED:
+            get_response_cache().set(cache_key, result)
+        return result
     except requests.exceptions.RequestException as e:
+        metrics.increment("lookup_errors_total", source="registry", error=type(e).__name__)
         return {"NPI ID": npi_id, "Status": f"Error: {str(e)}"}
     except json.JSONDecodeError as e:
+        metrics.increment("lookup_errors_total", source="registry", error="JSONDecodeError")
         return {"NPI ID": npi_id, "Status": "Error: Invalid response format"}
 
 
+def iter_npi_details_bulk(npi_ids, max_concurrency=NPI_MAX_CONCURRENCY):
+    # Look up many NPIs at once, yielding results in input order.
+    # npi_ids is consumed lazily, so lookups start before a large input has been fully read.
+    max_concurrency = max(1, int(max_concurrency))
+    executor = ThreadPoolExecutor(max_workers=max_concurrency)
+    try:
+        pending = deque()
+        for npi_id in npi_ids:
+            pending.append(executor.submit(get_npi_details, npi_id))
+            # Bound the number of queued lookups so memory stays flat on huge inputs
+            if len(pending) >= max_concurrency * 4:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        # A consumer that stops early (closing the generator) drops the lookups that have not started yet
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def get_npi_details_bulk(npi_ids, max_concurrency=NPI_MAX_CONCURRENCY):
+    # Look up many NPIs at once; results come back in the same order as npi_ids
+    return list(iter_npi_details_bulk(npi_ids, max_concurrency))
+
+
+def iter_checked_npi_details(npi_id_chunks, max_concurrency=NPI_MAX_CONCURRENCY, seen=None):
+    # Validate and de-duplicate IDs before any network call, then yield (npi_details, check) for every input
+    # row in input order, each as soon as its lookup resolves. A result is only held while a repeat of its ID
+    # lies further ahead in the same chunk; an ID repeated in a later chunk is still labelled a duplicate but
+    # is looked up again, which the response cache or local store answers without another registry call.
+    # seen holds the IDs met so far and may be shared between calls that process one input in parts.
+    seen = set() if seen is None else seen
+    # (original, npi_id, check, fetch, keep) per input row, queued ahead of the lookups
+    plans = deque()
+
+    def ids_to_fetch():
+        for npi_ids in npi_id_chunks:
+            normalized, checks = preflight_npi_ids(npi_ids)
+            ahead = Counter(normalized[checks.isin([CHECK_VALID, CHECK_DUPLICATE])])
+            for original, npi_id, check in zip(npi_ids, normalized, checks):
+                if check not in (CHECK_VALID, CHECK_DUPLICATE):
+                    plans.append((original, npi_id, check, False, False))
+                    continue
+                ahead[npi_id] -= 1
+                fetch = check == CHECK_VALID
+                if fetch and npi_id in seen:
+                    check = CHECK_DUPLICATE
+                seen.add(npi_id)
+                plans.append((original, npi_id, check, fetch, ahead[npi_id] > 0))
+                if fetch:
+                    yield npi_id
+
+    held = {}
+
+    def resolve(plan, npi_details=None):
+        original, npi_id, check, fetch, keep = plan
+        if check not in (CHECK_VALID, CHECK_DUPLICATE):
+            return {"NPI ID": original, "Status": "Not Found"}, check
+        if not fetch:
+            npi_details = held[npi_id]
+        if keep:
+            held[npi_id] = npi_details
+        else:
+            held.pop(npi_id, None)
+        return npi_details, check
+
+    for npi_details in iter_npi_details_bulk(ids_to_fetch(), max_concurrency):
+        # Rows that needed no lookup of their own come out as soon as the rows before them have
+        while not plans[0][3]:
+            yield resolve(plans.popleft())
+        yield resolve(plans.popleft(), npi_details)
+    while plans:
+        yield resolve(plans.popleft())
+
+
+def blank_npi_record(npi_data):
+    # Not-found and error placeholders carry the requested ID under "NPI ID"
+    return flatten_npi_record(npi_data, npi_data.get("NPI ID", ""))
+
+
 def blank_npi_data(npi_data):
-    parsed_data = {
-        "NPI ID": npi_data.get("NPI ID", ""),
-        "First Name": npi_data.get("basic", {}).get("first_name", ""),
-        "Last Name": npi_data.get("basic", {}).get("last_name", ""),
-        "Middle Name": npi_data.get("basic", {}).get("middle_name", ""),
-        "Credential": npi_data.get("basic", {}).get("credential", ""),
-        "Sole Proprietor": npi_data.get("basic", {}).get("sole_proprietor", ""),
-        "Gender": npi_data.get("basic", {}).get("gender", ""),
-        "Enumeration Date": npi_data.get("basic", {}).get("enumeration_date", ""),
-        "Last Updated": npi_data.get("basic", {}).get("last_updated", ""),
-        "Certification Date": npi_data.get("basic", {}).get("certification_date", ""),
-        "Status": npi_data.get("basic", {}).get("status", ""),
-        "Enumeration Type": npi_data.get("enumeration_type", ""),
-    }
-
-    # Process addresses
-    addresses = npi_data.get("addresses", [])
-    for i, address in enumerate(addresses):
-        prefix = f"Address_{i+1}_"
-        parsed_data.update({
-            f"{prefix}Purpose": address.get("address_purpose", ""),
-            f"{prefix}Type": address.get("address_type", ""),
-            f"{prefix}Address1": address.get("address_1", ""),
-            f"{prefix}Address2": address.get("address_2", ""),
-            f"{prefix}City": address.get("city", ""),
-            f"{prefix}State": address.get("state", ""),
-            f"{prefix}Postal Code": address.get("postal_code", ""),
-            f"{prefix}Telephone": address.get("telephone_number", ""),
-            f"{prefix}Fax": address.get("fax_number", ""),
-        })
-
-    # Process practice locations
-    practice_locations = npi_data.get("practiceLocations", [])
-    for i, location in enumerate(practice_locations):
-        prefix = f"PracticeLocation_{i+1}_"
-        parsed_data.update({
-            f"{prefix}Address1": location.get("address_1", ""),
-            f"{prefix}City": location.get("city", ""),
-            f"{prefix}State": location.get("state", ""),
-            f"{prefix}Postal Code": location.get("postal_code", ""),
-            f"{prefix}Telephone": location.get("telephone_number", ""),
-            f"{prefix}Fax": location.get("fax_number", ""),
-        })
-
-    # Process taxonomies
-    taxonomies = npi_data.get("taxonomies", [])
-    for i, taxonomy in enumerate(taxonomies):
-        prefix = f"Taxonomy_{i+1}_"
-        parsed_data.update({
-            f"{prefix}Code": taxonomy.get("code", ""),
-            f"{prefix}Description": taxonomy.get("desc", ""),
-            f"{prefix}State": taxonomy.get("state", ""),
-            f"{prefix}License": taxonomy.get("license", ""),
-            f"{prefix}Primary": str(taxonomy.get("primary", "")),
-        })
-
-    # Process identifiers
-    identifiers = npi_data.get("identifiers", [])
-    for i, identifier in enumerate(identifiers):
-        prefix = f"Identifier_{i+1}_"
-        parsed_data.update({
-            f"{prefix}Code": identifier.get("code", ""),
-            f"{prefix}Description": identifier.get("desc", ""),
-            f"{prefix}Identifier": identifier.get("identifier", ""),
-            f"{prefix}State": identifier.get("state", ""),
-        })
-
-    parsed_data["Status"] = "Found" if npi_data.get("number", "") else "Not Found"
-
-    return pd.DataFrame([parsed_data])
+    return pd.DataFrame([blank_npi_record(npi_data)])
+
+
+def parse_npi_record(npi_data):
+    return flatten_npi_record(npi_data, npi_data.get("number", ""))
+
 
 def parse_npi_data(npi_data):
-    parsed_data = {
-        "NPI ID": npi_data.get("number", ""),
-        "First Name": npi_data.get("basic", {}).get("first_name", ""),
-        "Last Name": npi_data.get("basic", {}).get("last_name", ""),
-        "Middle Name": npi_data.get("basic", {}).get("middle_name", ""),
-        "Credential": npi_data.get("basic", {}).get("credential", ""),
-        "Sole Proprietor": npi_data.get("basic", {}).get("sole_proprietor", ""),
-        "Gender": npi_data.get("basic", {}).get("gender", ""),
-        "Enumeration Date": npi_data.get("basic", {}).get("enumeration_date", ""),
-        "Last Updated": npi_data.get("basic", {}).get("last_updated", ""),
-        "Certification Date": npi_data.get("basic", {}).get("certification_date", ""),
-        "Status": npi_data.get("basic", {}).get("status", ""),
-        "Enumeration Type": npi_data.get("enumeration_type", ""),
-    }
-
-    # Process addresses
-    addresses = npi_data.get("addresses", [])
-    for i, address in enumerate(addresses):
-        prefix = f"Address_{i+1}_"
-        parsed_data.update({
-            f"{prefix}Purpose": address.get("address_purpose", ""),
-            f"{prefix}Type": address.get("address_type", ""),
-            f"{prefix}Address1": address.get("address_1", ""),
-            f"{prefix}Address2": address.get("address_2", ""),
-            f"{prefix}City": address.get("city", ""),
-            f"{prefix}State": address.get("state", ""),
-            f"{prefix}Postal Code": address.get("postal_code", ""),
-            f"{prefix}Telephone": address.get("telephone_number", ""),
-            f"{prefix}Fax": address.get("fax_number", ""),
-        })
-
-    # Process practice locations
-    practice_locations = npi_data.get("practiceLocations", [])
-    for i, location in enumerate(practice_locations):
-        prefix = f"PracticeLocation_{i+1}_"
-        parsed_data.update({
-            f"{prefix}Address1": location.get("address_1", ""),
-            f"{prefix}City": location.get("city", ""),
-            f"{prefix}State": location.get("state", ""),
-            f"{prefix}Postal Code": location.get("postal_code", ""),
-            f"{prefix}Telephone": location.get("telephone_number", ""),
-            f"{prefix}Fax": location.get("fax_number", ""),
-        })
-
-    # Process taxonomies
-    taxonomies = npi_data.get("taxonomies", [])
-    for i, taxonomy in enumerate(taxonomies):
-        prefix = f"Taxonomy_{i+1}_"
-        parsed_data.update({
-            f"{prefix}Code": taxonomy.get("code", ""),
-            f"{prefix}Description": taxonomy.get("desc", ""),
-            f"{prefix}State": taxonomy.get("state", ""),
-            f"{prefix}License": taxonomy.get("license", ""),
-            f"{prefix}Primary": str(taxonomy.get("primary", "")),
-        })
-
-    # Process identifiers
-    identifiers = npi_data.get("identifiers", [])
-    for i, identifier in enumerate(identifiers):
-        prefix = f"Identifier_{i+1}_"
-        parsed_data.update({
-            f"{prefix}Code": identifier.get("code", ""),
-            f"{prefix}Description": identifier.get("desc", ""),
-            f"{prefix}Identifier": identifier.get("identifier", ""),
-            f"{prefix}State": identifier.get("state", ""),
-        })
-
-    parsed_data["Status"] = "Found" if parsed_data["NPI ID"] else "Not Found"
-
-    return pd.DataFrame([parsed_data])
-
-
-def get_npi_by_details(npi_number=None, npi_type=None, taxonomy_description=None, provider_first_name=None, provider_last_name=None, org_name=None, authorized_official_first_name=None, authorized_official_last_name=None, city=None, state=None, country=None, postal_code=None, address_type=None):
-    url = "https://npiregistry.cms.hhs.gov/api/?version=2.1"
+    return pd.DataFrame([parse_npi_record(npi_data)])
+
+
+def npi_record(npi_details):
+    # Registry results carry created_epoch; anything else is a not-found or error placeholder
+    if 'created_epoch' in npi_details:
+        return parse_npi_record(npi_details)
+    return blank_npi_record(npi_details)
+
+
+def build_result_frame(records):
+    # Build the result table in one go instead of concatenating one-row frames
+    return pd.DataFrame.from_records(list(records))
+
 
+@metrics.timed("full_address")
+def add_full_address(result_data):
+    # Vectorized "Address1, City, State Postal Code" from the first listed address
+    def column(name):
+        if name in result_data:
+            return result_data[name].fillna("").astype(str)
+        return pd.Series("", index=result_data.index)
+
+    result_data['Full Address'] = (column('Address_1_Address1') + ', ' + column('Address_1_City') + ', '
+                                   + column('Address_1_State') + ' ' + column('Address_1_Postal Code'))
+    return result_data
+
+
+def _build_search_query(npi_number=None, npi_type=None, taxonomy_description=None, provider_first_name=None, provider_last_name=None, org_name=None, authorized_official_first_name=None, authorized_official_last_name=None, city=None, state=None, country=None, postal_code=None, address_type=None):
+    query = {}
     if npi_number:
-        url += f"&number={npi_number}"
+        query["number"] = npi_number
     if npi_type and npi_type != "Any":
-        url += f"&enumeration_type={npi_type}"
+        query["enumeration_type"] = npi_type
     if taxonomy_description:
-        url += f"&taxonomy_description={taxonomy_description}"
+        query["taxonomy_description"] = taxonomy_description
     if provider_first_name:
-        url += f"&first_name={provider_first_name}"
+        query["first_name"] = provider_first_name
     if provider_last_name:
-        url += f"&last_name={provider_last_name}"
+        query["last_name"] = provider_last_name
     if org_name:
-        url += f"&organization_name={org_name}"
+        query["organization_name"] = org_name
     if authorized_official_first_name:
-        url += f"&authorized_official_first_name={authorized_official_first_name}"
+        query["authorized_official_first_name"] = authorized_official_first_name
     if authorized_official_last_name:
-        url += f"&authorized_official_last_name={authorized_official_last_name}"
+        query["authorized_official_last_name"] = authorized_official_last_name
     if city:
-        url += f"&city={city}"
+        query["city"] = city
     if state:
-        url += f"&state={state}"
+        query["state"] = state
     if country and country != "Any":
-        url += f"&country_code={country}"
+        query["country_code"] = country
     if postal_code:
-        url += f"&postal_code={postal_code}"
+        query["postal_code"] = postal_code
     if address_type and address_type != "Any":
-        url += f"&address_purpose={address_type}"
+        query["address_purpose"] = address_type
+    return query
+
+
+def _search_registry(query):
+    # One registry search request; returns the result list, or None when the request failed
+    # Searches differing only in case or surrounding whitespace share a cache entry
+    cache_key = "search:" + "&".join(f"{key}={str(value).strip().lower()}" for key, value in sorted(query.items()))
+    if NPI_CACHE_ENABLED:
+        cached = get_response_cache().get(cache_key)
+        if cached is not None:
+            return cached
 
     try:
-        response = requests.get(url)
+        response = http_get(API_URL, params=dict(query, version=API_VERSION))
         response.raise_for_status()
-        data = response.json()
+        data = response_json(response)
         if "result_count" in data and data["result_count"] > 0:
-            return data["results"]
+            results = data["results"]
         else:
-            return []
+            results = []
+        if NPI_CACHE_ENABLED:
+            get_response_cache().set(cache_key, results)
+        return results
     except requests.exceptions.RequestException as e:
-        return []
+        metrics.increment("lookup_errors_total", source="registry_search", error=type(e).__name__)
+        return None
     except json.JSONDecodeError as e:
-        return []
+        metrics.increment("lookup_errors_total", source="registry_search", error="JSONDecodeError")
+        return None
+
+
+def get_npi_by_details(npi_number=None, npi_type=None, taxonomy_description=None, provider_first_name=None, provider_last_name=None, org_name=None, authorized_official_first_name=None, authorized_official_last_name=None, city=None, state=None, country=None, postal_code=None, address_type=None, backend="remote", paginate=False):
+    if backend == "local":
+        return search_providers(npi_number, npi_type, taxonomy_description, provider_first_name, provider_last_name,
+                                org_name, authorized_official_first_name, authorized_official_last_name, city, state,
+                                country, postal_code, address_type)
+    if paginate:
+        failed_queries = []
+        truncated_queries = []
+        results = [npi_details for page in iter_npi_by_details(
+            npi_number, npi_type, taxonomy_description, provider_first_name, provider_last_name, org_name,
+            authorized_official_first_name, authorized_official_last_name, city, state, country, postal_code,
+            address_type, failed_queries=failed_queries, truncated_queries=truncated_queries) for npi_details in page]
+        if failed_queries or truncated_queries:
+            raise IncompleteSearchError(failed_queries, truncated_queries)
+        return results
+
+    query = _build_search_query(npi_number, npi_type, taxonomy_description, provider_first_name, provider_last_name,
+                                org_name, authorized_official_first_name, authorized_official_last_name, city, state,
+                                country, postal_code, address_type)
+    return _search_registry(query) or []
+
+
+class IncompleteSearchError(Exception):
+    # Some registry requests of a paginated search kept failing, or some queries still hit the skip ceiling
+    # after every split, so matches may be missing
+    def __init__(self, failed_queries, truncated_queries=()):
+        problems = []
+        if failed_queries:
+            problems.append(f"{len(failed_queries)} registry search request(s) failed")
+        if truncated_queries:
+            problems.append(f"{len(truncated_queries)} search(es) had more matches than the registry returns")
+        super().__init__(f"{'; '.join(problems)}; results are incomplete")
+        self.failed_queries = failed_queries
+        self.truncated_queries = list(truncated_queries)
+
+
+def _split_query(query):
+    # Narrow a query that hit the registry's skip ceiling: by state first, then by postal-code prefix, then
+    # by provider type within a ZIP code; [] when it cannot be narrowed any further
+    if not query.get("state") and not query.get("postal_code"):
+        return [dict(query, state=code) for code in US_STATE_CODES]
+
+    prefix = str(query.get("postal_code", "")).strip().rstrip("*")
+    if len(prefix) >= 5:
+        if query.get("enumeration_type"):
+            return []
+        return [dict(query, enumeration_type=npi_type) for npi_type in ("NPI-1", "NPI-2")]
+    if len(prefix) < 2:
+        # The registry only accepts wildcards after at least two characters
+        return [dict(query, postal_code=f"{prefix}{digits}*") for digits in _postal_digits(2 - len(prefix))]
+    return [dict(query, postal_code=f"{prefix}{digit}*") for digit in "0123456789"]
+
+
+def _postal_digits(width):
+    return [str(number).zfill(width) for number in range(10 ** width)]
+
+
+def _iter_query_pages(query, executor):
+    # Yield result pages for one query; returns QUERY_COMPLETE, QUERY_TRUNCATED (cut off at the skip ceiling)
+    # or QUERY_FAILED (a page request failed, so later matches were not fetched)
+    first_page = _search_registry(dict(query, limit=NPI_API_PAGE_SIZE, skip=0))
+    if first_page is None:
+        return QUERY_FAILED
+    if first_page:
+        yield first_page
+    if len(first_page) < NPI_API_PAGE_SIZE:
+        return QUERY_COMPLETE
+
+    skips = range(NPI_API_PAGE_SIZE, NPI_API_MAX_SKIP + 1, NPI_API_PAGE_SIZE)
+    pages = executor.map(lambda skip: _search_registry(dict(query, limit=NPI_API_PAGE_SIZE, skip=skip)), skips)
+    for page in pages:
+        if page is None:
+            return QUERY_FAILED
+        if page:
+            yield page
+        if len(page) < NPI_API_PAGE_SIZE:
+            return QUERY_COMPLETE
+    return QUERY_TRUNCATED
+
+
+def iter_npi_by_details(npi_number=None, npi_type=None, taxonomy_description=None, provider_first_name=None, provider_last_name=None, org_name=None, authorized_official_first_name=None, authorized_official_last_name=None, city=None, state=None, country=None, postal_code=None, address_type=None, max_concurrency=NPI_MAX_CONCURRENCY, failed_queries=None, truncated_queries=None):
+    # Stream every registry match page by page, splitting queries that exceed the skip ceiling.
+    # Each yielded list only holds NPIs not seen in earlier pages. A query whose page request fails is run
+    # again at the end, up to NPI_SEARCH_QUERY_RETRIES times; if it still fails it is appended to
+    # failed_queries, so the caller can tell the user the results are incomplete. A query that hits the
+    # ceiling and cannot be split any further is appended to truncated_queries for the same reason.
+    pending = [(_build_search_query(npi_number, npi_type, taxonomy_description, provider_first_name,
+                                    provider_last_name, org_name, authorized_official_first_name,
+                                    authorized_official_last_name, city, state, country, postal_code, address_type), 0)]
+    seen = set()
+    with ThreadPoolExecutor(max_workers=max(1, int(max_concurrency))) as executor:
+        while pending:
+            query, attempts = pending.pop(0)
+            pages = _iter_query_pages(query, executor)
+            while True:
+                try:
+                    page = next(pages)
+                except StopIteration as stop:
+                    if stop.value == QUERY_TRUNCATED:
+                        narrower_queries = _split_query(query)
+                        pending.extend((narrower, 0) for narrower in narrower_queries)
+                        if not narrower_queries:
+                            metrics.increment("search_queries_truncated_total")
+                            if truncated_queries is not None:
+                                truncated_queries.append(query)
+                    elif stop.value == QUERY_FAILED:
+                        metrics.increment("search_query_failures_total", retried=attempts < NPI_SEARCH_QUERY_RETRIES)
+                        if attempts < NPI_SEARCH_QUERY_RETRIES:
+                            # Pages it already returned are skipped through seen
+                            pending.append((query, attempts + 1))
+                        elif failed_queries is not None:
+                            failed_queries.append(query)
+                    break
+                new_results = [npi_details for npi_details in page if npi_details.get("number") not in seen]
+                seen.update(npi_details.get("number") for npi_details in new_results)
+                if new_results:
+                    yield new_results
@@ -0,0 +1,700 @@
+import argparse
+import csv
+import os
+import sqlite3
+import threading
+import zlib
+from datetime import datetime, timezone
+from itertools import islice
+
+from openpyxl import load_workbook
+
+from cache import ResponseCache
+from geocoding import geocode_many
+from json_codec import loads, dumps
+from config import (NPPES_STORE_PATH, NPPES_INGEST_CHUNKSIZE, LOCAL_SEARCH_LIMIT, NPI_CACHE_ENABLED, NPI_CACHE_PATH,
+                    NPPES_LOOKUP_BATCH)
+
+# Column names used by the CMS NPPES full dissemination file
+NPI_COLUMN = "NPI"
+MAX_TAXONOMIES = 15
+MAX_IDENTIFIERS = 50
+
+# (first line, second line, shared prefix) for each address purpose
+ADDRESS_COLUMNS = {
+    "LOCATION": ("Provider First Line Business Practice Location Address",
+                 "Provider Second Line Business Practice Location Address",
+                 "Provider Business Practice Location Address"),
+    "MAILING": ("Provider First Line Business Mailing Address",
+                "Provider Second Line Business Mailing Address",
+                "Provider Business Mailing Address"),
+}
+
+TAXONOMY_COLUMNS = [
+    (f"Healthcare Provider Taxonomy Code_{i}", f"Healthcare Provider Taxonomy Group_{i}",
+     f"Provider License Number State Code_{i}", f"Provider License Number_{i}",
+     f"Healthcare Provider Primary Taxonomy Switch_{i}")
+    for i in range(1, MAX_TAXONOMIES + 1)
+]
+IDENTIFIER_COLUMNS = [
+    (f"Other Provider Identifier_{i}", f"Other Provider Identifier Type Code_{i}",
+     f"Other Provider Identifier Issuer_{i}", f"Other Provider Identifier State_{i}")
+    for i in range(1, MAX_IDENTIFIERS + 1)
+]
+
+IDENTIFIER_TYPES = {
+    "01": "Other",
+    "02": "Medicare UPIN",
+    "04": "Medicare ID-Type Unspecified",
+    "05": "MEDICAID",
+    "06": "Medicare OSCAR/Certification",
+    "07": "Medicare NSC",
+    "08": "Medicare PIN",
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS providers (
+    npi TEXT PRIMARY KEY,
+    entity_type INTEGER,
+    first_name TEXT,
+    last_name TEXT,
+    organization_name TEXT,
+    authorized_official_first_name TEXT,
+    authorized_official_last_name TEXT,
+    last_updated TEXT,
+    deactivation_date TEXT,
+    record BLOB
+);
+CREATE TABLE IF NOT EXISTS provider_addresses (
+    npi TEXT NOT NULL,
+    purpose TEXT,
+    city TEXT,
+    state TEXT,
+    postal_code TEXT,
+    country_code TEXT
+);
+CREATE TABLE IF NOT EXISTS provider_taxonomies (
+    npi TEXT NOT NULL,
+    code TEXT,
+    description TEXT
+);
+CREATE TABLE IF NOT EXISTS taxonomy_descriptions (
+    code TEXT PRIMARY KEY,
+    description TEXT
+);
+CREATE TABLE IF NOT EXISTS store_updates (
+    id INTEGER PRIMARY KEY,
+    kind TEXT,
+    source TEXT,
+    applied_at TEXT,
+    rows INTEGER,
+    changed INTEGER
+);
+CREATE TABLE IF NOT EXISTS provider_changes (
+    update_id INTEGER NOT NULL,
+    npi TEXT NOT NULL,
+    change TEXT,
+    PRIMARY KEY (update_id, npi)
+);
+CREATE INDEX IF NOT EXISTS provider_addresses_npi ON provider_addresses (npi);
+CREATE INDEX IF NOT EXISTS provider_taxonomies_npi ON provider_taxonomies (npi);
+CREATE INDEX IF NOT EXISTS provider_changes_npi ON provider_changes (npi);
+"""
+
+# Secondary indexes backing search_providers; built after bulk loads, which is much faster than during them
+SEARCH_INDEXES = """
+CREATE INDEX IF NOT EXISTS providers_last_name ON providers (last_name, first_name);
+CREATE INDEX IF NOT EXISTS providers_organization_name ON providers (organization_name);
+CREATE INDEX IF NOT EXISTS providers_authorized_official ON providers (authorized_official_last_name);
+CREATE INDEX IF NOT EXISTS provider_addresses_state ON provider_addresses (state, city);
+CREATE INDEX IF NOT EXISTS provider_addresses_city ON provider_addresses (city);
+CREATE INDEX IF NOT EXISTS provider_addresses_postal_code ON provider_addresses (postal_code);
+CREATE INDEX IF NOT EXISTS provider_taxonomies_description ON provider_taxonomies (description);
+CREATE INDEX IF NOT EXISTS provider_taxonomies_code ON provider_taxonomies (code);
+"""
+
+ENUMERATION_TYPES = {"NPI-1": 1, "INDIVIDUAL": 1, "NPI-2": 2, "ORGANIZATION": 2}
+
+# Update kinds recorded in store_updates
+WEEKLY_UPDATE = "weekly"
+DEACTIVATION_UPDATE = "deactivation"
+
+_local = threading.local()
+
+
+def _api_date(value):
+    # NPPES files use MM/DD/YYYY, the registry API uses YYYY-MM-DD
+    if len(value) == 10 and value[2] == "/" and value[5] == "/":
+        return f"{value[6:]}-{value[:2]}-{value[3:5]}"
+    return value
+
+
+def _epoch_ms(api_date):
+    if not api_date:
+        return None
+    try:
+        moment = datetime.fromisoformat(api_date).replace(tzinfo=timezone.utc)
+    except ValueError:
+        return None
+    return int(moment.timestamp() * 1000)
+
+
+def _address(row, purpose):
+    first_line, second_line, prefix = ADDRESS_COLUMNS[purpose]
+    country = row.get(f"{prefix} Country Code (If outside U.S.)", "") or "US"
+    return {
+        "country_code": country,
+        "country_name": "United States" if country == "US" else "",
+        "address_purpose": purpose,
+        "address_type": "DOM" if country == "US" else "FGN",
+        "address_1": row.get(first_line, ""),
+        "address_2": row.get(second_line, ""),
+        "city": row.get(f"{prefix} City Name", ""),
+        "state": row.get(f"{prefix} State Name", ""),
+        "postal_code": row.get(f"{prefix} Postal Code", ""),
+        "telephone_number": row.get(f"{prefix} Telephone Number", ""),
+        "fax_number": row.get(f"{prefix} Fax Number", ""),
+    }
+
+
+def nppes_row_to_record(row, taxonomy_descriptions=None):
+    # Convert one NPPES file row into the result shape returned by the registry API
+    taxonomy_descriptions = taxonomy_descriptions or {}
+    entity_type = row.get("Entity Type Code", "")
+    enumeration_date = _api_date(row.get("Provider Enumeration Date", ""))
+    last_updated = _api_date(row.get("Last Update Date", ""))
+
+    basic = {
+        "enumeration_date": enumeration_date,
+        "last_updated": last_updated,
+        "certification_date": _api_date(row.get("Certification Date", "")),
+        "status": "A",
+    }
+    if entity_type == "2":
+        basic.update({
+            "organization_name": row.get("Provider Organization Name (Legal Business Name)", ""),
+            "organizational_subpart": row.get("Is Organization Subpart", ""),
+            "authorized_official_first_name": row.get("Authorized Official First Name", ""),
+            "authorized_official_last_name": row.get("Authorized Official Last Name", ""),
+            "authorized_official_middle_name": row.get("Authorized Official Middle Name", ""),
+            "authorized_official_title_or_position": row.get("Authorized Official Title or Position", ""),
+            "authorized_official_telephone_number": row.get("Authorized Official Telephone Number", ""),
+        })
+    else:
+        basic.update({
+            "first_name": row.get("Provider First Name", ""),
+            "last_name": row.get("Provider Last Name (Legal Name)", ""),
+            "middle_name": row.get("Provider Middle Name", ""),
+            "name_prefix": row.get("Provider Name Prefix Text", ""),
+            "name_suffix": row.get("Provider Name Suffix Text", ""),
+            "credential": row.get("Provider Credential Text", ""),
+            "sole_proprietor": {"Y": "YES", "N": "NO"}.get(row.get("Is Sole Proprietor", ""), ""),
+            "gender": row.get("Provider Gender Code", "") or row.get("Provider Sex Code", ""),
+        })
+    # The API omits empty name fields
+    basic = {key: value for key, value in basic.items() if value != ""}
+
+    taxonomies = []
+    for code_column, group_column, state_column, license_column, primary_column in TAXONOMY_COLUMNS:
+        code = row.get(code_column, "")
+        if not code:
+            continue
+        taxonomies.append({
+            "code": code,
+            "taxonomy_group": row.get(group_column, ""),
+            "desc": taxonomy_descriptions.get(code, ""),
+            "state": row.get(state_column, ""),
+            "license": row.get(license_column, ""),
+            "primary": row.get(primary_column, "") == "Y",
+        })
+
+    identifiers = []
+    for identifier_column, code_column, issuer_column, state_column in IDENTIFIER_COLUMNS:
+        identifier = row.get(identifier_column, "")
+        if not identifier:
+            continue
+        code = row.get(code_column, "")
+        identifiers.append({
+            "code": code,
+            "desc": IDENTIFIER_TYPES.get(code, ""),
+            "issuer": row.get(issuer_column, ""),
+            "identifier": identifier,
+            "state": row.get(state_column, ""),
+        })
+
+    return {
+        "created_epoch": _epoch_ms(enumeration_date),
+        "enumeration_type": "NPI-2" if entity_type == "2" else "NPI-1",
+        "last_updated_epoch": _epoch_ms(last_updated),
+        "number": row.get(NPI_COLUMN, ""),
+        "addresses": [_address(row, "LOCATION"), _address(row, "MAILING")],
+        "practiceLocations": [],
+        "basic": basic,
+        "taxonomies": taxonomies,
+        "identifiers": identifiers,
+        "endpoints": [],
+        "other_names": [],
+    }
+
+
+def _pack(record):
+    # Fast compression level: records are small and ingest speed matters more than the last few bytes
+    return zlib.compress(dumps(record).encode("utf-8"), 1)
+
+
+def _unpack(blob):
+    return loads(zlib.decompress(blob))
+
+
+def _provider_rows(row, taxonomy_descriptions):
+    # Split one NPPES row into the provider row and its address and taxonomy search rows
+    deactivation_date = _api_date(row.get("NPI Deactivation Date", ""))
+    reactivation_date = _api_date(row.get("NPI Reactivation Date", ""))
+    if reactivation_date and reactivation_date >= deactivation_date:
+        deactivation_date = ""
+
+    record = nppes_row_to_record(row, taxonomy_descriptions)
+    npi = record["number"]
+    basic = record["basic"]
+    provider = (
+        npi,
+        int(row["Entity Type Code"]) if row.get("Entity Type Code", "").isdigit() else None,
+        basic.get("first_name", "").upper(),
+        basic.get("last_name", "").upper(),
+        basic.get("organization_name", "").upper(),
+        basic.get("authorized_official_first_name", "").upper(),
+        basic.get("authorized_official_last_name", "").upper(),
+        basic.get("last_updated", ""),
+        deactivation_date,
+        _pack(record),
+    )
+    addresses = [
+        (npi, address["address_purpose"], address["city"].upper(), address["state"].upper(),
+         address["postal_code"], address["country_code"].upper())
+        for address in record["addresses"] if address["address_1"] or address["city"]
+    ]
+    taxonomies = [(npi, taxonomy["code"], taxonomy["desc"].upper()) for taxonomy in record["taxonomies"]]
+    return provider, addresses, taxonomies
+
+
+def _write_rows(conn, rows):
+    # Replace providers along with their address and taxonomy rows
+    npis = [(provider[0],) for provider, _, _ in rows]
+    conn.executemany("DELETE FROM provider_addresses WHERE npi = ?", npis)
+    conn.executemany("DELETE FROM provider_taxonomies WHERE npi = ?", npis)
+    conn.executemany("INSERT OR REPLACE INTO providers VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                     [provider for provider, _, _ in rows])
+    conn.executemany("INSERT INTO provider_addresses VALUES (?, ?, ?, ?, ?, ?)",
+                     [address for _, addresses, _ in rows for address in addresses])
+    conn.executemany("INSERT INTO provider_taxonomies VALUES (?, ?, ?)",
+                     [taxonomy for _, _, taxonomies in rows for taxonomy in taxonomies])
+
+
+def connect(path=NPPES_STORE_PATH):
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def build_search_indexes(store_path=NPPES_STORE_PATH):
+    conn = connect(store_path)
+    conn.executescript(SEARCH_INDEXES)
+    conn.execute("ANALYZE")
+    conn.close()
+
+
+def load_taxonomy_descriptions(path):
+    # NUCC taxonomy code set CSV: "Classification, Specialization" matches the registry's desc field
+    if not path:
+        return {}
+    descriptions = {}
+    with open(path, newline="", encoding="latin-1") as f:
+        for row in csv.DictReader(f):
+            desc = row.get("Classification", "")
+            if row.get("Specialization", ""):
+                desc = f"{desc}, {row['Specialization']}"
+            descriptions[row.get("Code", "")] = desc
+    return descriptions
+
+
+def _taxonomy_descriptions(conn, taxonomy_csv):
+    # Descriptions from the NUCC file are kept in the store, so weekly updates label taxonomies the same way
+    # as the full ingest without the file being passed again
+    if taxonomy_csv:
+        descriptions = load_taxonomy_descriptions(taxonomy_csv)
+        conn.executemany("INSERT OR REPLACE INTO taxonomy_descriptions VALUES (?, ?)", descriptions.items())
+        conn.commit()
+        return descriptions
+    return dict(conn.execute("SELECT code, description FROM taxonomy_descriptions"))
+
+
+def ingest_nppes(csv_path, store_path=NPPES_STORE_PATH, chunksize=NPPES_INGEST_CHUNKSIZE, taxonomy_csv=None,
+                 progress=None):
+    # Stream the NPPES dissemination CSV into the local store in bounded-memory chunks
+    conn = connect(store_path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+    taxonomy_descriptions = _taxonomy_descriptions(conn, taxonomy_csv)
+
+    total = 0
+    with open(csv_path, newline="", encoding="utf-8", errors="replace") as f:
+        reader = csv.DictReader(f)
+        while True:
+            chunk = list(islice(reader, chunksize))
+            if not chunk:
+                break
+            _write_rows(conn, [_provider_rows(row, taxonomy_descriptions) for row in chunk])
+            conn.commit()
+            total += len(chunk)
+            if progress:
+                progress(total)
+
+    conn.close()
+    build_search_indexes(store_path)
+    return total
+
+
+def _existing(conn, npis):
+    # npi -> (record blob, deactivation date) for the NPIs already in the store
+    found = {}
+    for start in range(0, len(npis), NPPES_LOOKUP_BATCH):
+        batch = npis[start:start + NPPES_LOOKUP_BATCH]
+        found.update((npi, (record, deactivation_date)) for npi, record, deactivation_date in conn.execute(
+            f"SELECT npi, record, deactivation_date FROM providers WHERE npi IN ({','.join('?' * len(batch))})",
+            batch))
+    return found
+
+
+def _change(old, provider):
+    # What an incoming provider row does to the stored one, or None when nothing differs
+    if old is None:
+        return "added"
+    record, deactivation_date = old
+    # Decoded records are compared, not the compressed bytes, which depend on the zlib level and build
+    if deactivation_date == provider[8] and _unpack(record) == _unpack(provider[9]):
+        return None
+    if deactivation_date and not provider[8]:
+        return "reactivated"
+    if provider[8] and not deactivation_date:
+        return "deactivated"
+    return "updated"
+
+
+def _start_update(conn, kind, source):
+    cursor = conn.execute("INSERT INTO store_updates (kind, source, applied_at, rows, changed) VALUES (?, ?, ?, 0, 0)",
+                          (kind, os.path.basename(source), datetime.now(timezone.utc).isoformat(timespec="seconds")))
+    return cursor.lastrowid
+
+
+def _finish_update(conn, update_id, rows, changes):
+    conn.executemany("INSERT OR REPLACE INTO provider_changes VALUES (?, ?, ?)",
+                     [(update_id, npi, change) for npi, change in changes])
+    conn.execute("UPDATE store_updates SET rows = ?, changed = ? WHERE id = ?", (rows, len(changes), update_id))
+    conn.commit()
+
+
+def already_applied(source, store_path=NPPES_STORE_PATH):
+    conn = connect(store_path)
+    row = conn.execute("SELECT 1 FROM store_updates WHERE source = ?", (os.path.basename(source),)).fetchone()
+    conn.close()
+    return row is not None
+
+
+def apply_weekly_update(csv_path, store_path=NPPES_STORE_PATH, chunksize=NPPES_INGEST_CHUNKSIZE, taxonomy_csv=None,
+                        progress=None):
+    # Apply a CMS weekly incremental file (same layout as the full file) to an existing store.
+    # Only NPIs whose record or deactivation differs are rewritten; returns [(npi, change)].
+    conn = connect(store_path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    taxonomy_descriptions = _taxonomy_descriptions(conn, taxonomy_csv)
+    update_id = _start_update(conn, WEEKLY_UPDATE, csv_path)
+
+    total = 0
+    changes = []
+    with open(csv_path, newline="", encoding="utf-8", errors="replace") as f:
+        reader = csv.DictReader(f)
+        while True:
+            chunk = list(islice(reader, chunksize))
+            if not chunk:
+                break
+            rows = [_provider_rows(row, taxonomy_descriptions) for row in chunk]
+            existing = _existing(conn, [provider[0] for provider, _, _ in rows])
+            changed = []
+            for row in rows:
+                change = _change(existing.get(row[0][0]), row[0])
+                if change:
+                    changed.append(row)
+                    changes.append((row[0][0], change))
+            # The search indexes are maintained by SQLite as the rows are replaced
+            _write_rows(conn, changed)
+            conn.commit()
+            total += len(chunk)
+            if progress:
+                progress(total)
+
+    _finish_update(conn, update_id, total, changes)
+    conn.execute("PRAGMA optimize")
+    conn.close()
+    return changes
+
+
+def _cell_text(value):
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d")
+    return str(value).strip()
+
+
+def iter_deactivations(path):
+    # (npi, deactivation date) pairs from the CMS deactivated NPI report (XLSX, or CSV if converted).
+    # The report starts with a few title lines; only rows whose first cell is an NPI are used.
+    if path.lower().endswith(".xlsx"):
+        workbook = load_workbook(path, read_only=True, data_only=True)
+        rows = workbook.active.iter_rows(max_col=2, values_only=True)
+    else:
+        workbook = None
+        f = open(path, newline="", encoding="utf-8", errors="replace")
+        rows = csv.reader(f)
+    try:
+        for row in rows:
+            npi = _cell_text(row[0]) if row else ""
+            if len(npi) == 10 and npi.isdigit():
+                yield npi, _api_date(_cell_text(row[1]) if len(row) > 1 else "")
+    finally:
+        if workbook is not None:
+            workbook.close()
+        else:
+            f.close()
+
+
+def apply_deactivations(path, store_path=NPPES_STORE_PATH, chunksize=NPPES_INGEST_CHUNKSIZE, progress=None):
+    # Mark the NPIs in a deactivation report as deactivated; NPIs not in the store are skipped.
+    # Returns [(npi, "deactivated")] for the NPIs that were active before.
+    conn = connect(store_path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    update_id = _start_update(conn, DEACTIVATION_UPDATE, path)
+    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+
+    total = 0
+    changes = []
+    deactivations = iter_deactivations(path)
+    while True:
+        chunk = dict(islice(deactivations, chunksize))
+        if not chunk:
+            break
+        existing = _existing(conn, list(chunk))
+        updates = [(chunk[npi] or today, npi) for npi, (_, deactivation_date) in existing.items()
+                   if not deactivation_date]
+        conn.executemany("UPDATE providers SET deactivation_date = ? WHERE npi = ?", updates)
+        conn.commit()
+        changes.extend((npi, "deactivated") for _, npi in updates)
+        total += len(chunk)
+        if progress:
+            progress(total)
+
+    _finish_update(conn, update_id, total, changes)
+    conn.close()
+    return changes
+
+
+def forget_cached_npis(npis):
+    # Registry responses cached before the update would otherwise be served for NPIs the store no longer answers
+    if NPI_CACHE_ENABLED and os.path.exists(NPI_CACHE_PATH):
+        cache = ResponseCache(NPI_CACHE_PATH)
+        cache.delete([f"npi:{npi}" for npi in npis])
+
+
+def refresh_geocodes(npis, store_path=NPPES_STORE_PATH):
+    # Geocode the practice addresses of changed providers ahead of time, in the same "Address1, City, State
+    # Postal Code" form the result tables use, so the next lookup finds them in the geocode cache.
+    # Unchanged addresses are already cached and cost nothing; returns the number of addresses located.
+    addresses = []
+    for npi in npis:
+        record = lookup_npi(npi, store_path)
+        if record and record.get("addresses"):
+            address = record["addresses"][0]
+            addresses.append(f"{address['address_1']}, {address['city']}, {address['state']} "
+                             f"{address['postal_code']}")
+    return sum(1 for latitude, _, _ in geocode_many(addresses) if latitude is not None)
+
+
+def changed_npis(since=None, store_path=NPPES_STORE_PATH):
+    # npi -> latest change recorded by updates applied on or after since (YYYY-MM-DD), for re-enrichment runs
+    conn = connect(store_path)
+    rows = conn.execute(
+        "SELECT c.npi, c.change FROM provider_changes c JOIN store_updates u ON u.id = c.update_id "
+        "WHERE u.applied_at >= ? ORDER BY u.id", (since or "",)).fetchall()
+    conn.close()
+    return dict(rows)
+
+
+def store_available(store_path=NPPES_STORE_PATH):
+    return bool(store_path) and os.path.exists(store_path)
+
+
+def _reader(store_path):
+    # One read connection per thread so bulk lookups can query the store concurrently
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    if store_path not in connections:
+        connections[store_path] = sqlite3.connect(f"file:{store_path}?mode=ro", uri=True)
+    return connections[store_path]
+
+
+def lookup_npi(npi_id, store_path=NPPES_STORE_PATH):
+    # Return the registry-shaped record for an active NPI, a not-found placeholder for a deactivated one
+    # (the registry API does not return those either, so there is no point asking it), or None when the
+    # store does not know the NPI
+    row = _reader(store_path).execute(
+        "SELECT record, deactivation_date FROM providers WHERE npi = ?", (str(npi_id).strip(),)
+    ).fetchone()
+    if row is None:
+        return None
+    if row[1]:
+        return {"NPI ID": npi_id, "Status": "Deactivated"}
+    return _unpack(row[0])
+
+
+def _match(column, value):
+    # Registry-style matching: case-insensitive exact match, or prefix match for a trailing "*"
+    value = str(value).strip().upper()
+    if value.endswith("*"):
+        prefix = value.rstrip("*")
+        if not prefix:
+            return "1 = 1", []
+        return f"{column} >= ? AND {column} < ?", [prefix, prefix + "\uffff"]
+    return f"{column} = ?", [value]
+
+
+def search_providers(npi_number=None, npi_type=None, taxonomy_description=None, provider_first_name=None,
+                     provider_last_name=None, org_name=None, authorized_official_first_name=None,
+                     authorized_official_last_name=None, city=None, state=None, country=None, postal_code=None,
+                     address_type=None, limit=LOCAL_SEARCH_LIMIT, store_path=NPPES_STORE_PATH):
+    # Local counterpart of npi_functions.get_npi_by_details over the ingested provider table
+    conditions = ["p.deactivation_date = ''"]
+    params = []
+
+    def add(condition, values):
+        conditions.append(condition)
+        params.extend(values)
+
+    if npi_number:
+        add("p.npi = ?", [str(npi_number).strip()])
+    if npi_type and npi_type != "Any":
+        add("p.entity_type = ?", [ENUMERATION_TYPES.get(str(npi_type).upper(), 0)])
+    for column, value in (("p.first_name", provider_first_name), ("p.last_name", provider_last_name),
+                          ("p.organization_name", org_name),
+                          ("p.authorized_official_first_name", authorized_official_first_name),
+                          ("p.authorized_official_last_name", authorized_official_last_name)):
+        if value:
+            add(*_match(column, value))
+
+    address_conditions = []
+    address_params = []
+    if address_type and address_type != "Any":
+        purpose = str(address_type).upper()
+        address_conditions.append("purpose = ?")
+        address_params.append("MAILING" if purpose == "MAILING" else "LOCATION")
+    if city:
+        condition, values = _match("city", city)
+        address_conditions.append(condition)
+        address_params.extend(values)
+    if state:
+        address_conditions.append("state = ?")
+        address_params.append(str(state).strip().upper())
+    if country and country != "Any":
+        address_conditions.append("country_code = ?")
+        address_params.append(str(country).strip().upper())
+    if postal_code:
+        # A 5-digit postal code also matches the 9-digit codes it starts
+        condition, values = _match("postal_code", str(postal_code).rstrip("*") + "*")
+        address_conditions.append(condition)
+        address_params.extend(values)
+    if address_conditions:
+        add(f"p.npi IN (SELECT npi FROM provider_addresses WHERE {' AND '.join(address_conditions)})",
+            address_params)
+
+    if taxonomy_description:
+        condition, values = _match("description", taxonomy_description)
+        add(f"p.npi IN (SELECT npi FROM provider_taxonomies WHERE {condition} OR code = ?)",
+            values + [str(taxonomy_description).strip().upper()])
+
+    sql = f"SELECT p.record FROM providers p WHERE {' AND '.join(conditions)} ORDER BY p.npi"
+    if limit:
+        sql += " LIMIT ?"
+        params.append(int(limit))
+    return [_unpack(row[0]) for row in _reader(store_path).execute(sql, params)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local NPPES provider store")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    ingest = subparsers.add_parser("ingest", help="load a full NPPES dissemination CSV")
+    ingest.add_argument("csv_path")
+    ingest.add_argument("--store", default=NPPES_STORE_PATH)
+    ingest.add_argument("--chunksize", type=int, default=NPPES_INGEST_CHUNKSIZE)
+    ingest.add_argument("--taxonomy-csv", help="NUCC taxonomy code set CSV used for taxonomy descriptions")
+
+    reindex = subparsers.add_parser("reindex", help="(re)build the search indexes")
+    reindex.add_argument("--store", default=NPPES_STORE_PATH)
+
+    update = subparsers.add_parser("update", help="apply NPPES weekly incremental files and deactivation reports")
+    update.add_argument("weekly_csv", nargs="*", help="weekly incremental CSVs, applied in the order given")
+    update.add_argument("--deactivations", nargs="*", default=[], help="deactivated NPI reports (XLSX or CSV)")
+    update.add_argument("--store", default=NPPES_STORE_PATH)
+    update.add_argument("--chunksize", type=int, default=NPPES_INGEST_CHUNKSIZE)
+    update.add_argument("--taxonomy-csv", help="NUCC taxonomy code set CSV (defaults to the one used at ingest)")
+    update.add_argument("--geocode", action="store_true", help="geocode the changed practice addresses with Nominatim")
+    update.add_argument("--force", action="store_true", help="apply files that were applied before")
+
+    changes = subparsers.add_parser("changes", help="list NPIs changed by updates, e.g. to re-enrich only those")
+    changes.add_argument("--since", help="only updates applied on or after this date (YYYY-MM-DD)")
+    changes.add_argument("--output", help="write an NPI CSV (batch.py input) instead of printing")
+    changes.add_argument("--store", default=NPPES_STORE_PATH)
+
+    args = parser.parse_args()
+    if args.command == "ingest":
+        total = ingest_nppes(args.csv_path, args.store, args.chunksize, args.taxonomy_csv,
+                             progress=lambda count: print(f"{count} rows ingested", flush=True))
+        print(f"Done: {total} rows in {args.store}")
+    elif args.command == "reindex":
+        build_search_indexes(args.store)
+        print(f"Search indexes rebuilt in {args.store}")
+    elif args.command == "update":
+        if not store_available(args.store):
+            parser.error(f"{args.store} does not exist; run ingest with a full file first")
+        changed = {}
+        for path in args.weekly_csv + args.deactivations:
+            if not args.force and already_applied(path, args.store):
+                print(f"Skipping {path}: already applied")
+                continue
+            if path in args.weekly_csv:
+                applied = apply_weekly_update(path, args.store, args.chunksize, args.taxonomy_csv,
+                                              progress=lambda count: print(f"{count} rows read", flush=True))
+            else:
+                applied = apply_deactivations(path, args.store, args.chunksize)
+            changed.update(applied)
+            print(f"{path}: {len(applied)} NPIs changed")
+        forget_cached_npis(changed)
+        if args.geocode:
+            active = [npi for npi, change in changed.items() if change != "deactivated"]
+            print(f"{refresh_geocodes(active, args.store)} of {len(active)} changed addresses geocoded")
+        print(f"Done: {len(changed)} NPIs changed in {args.store}")
+    elif args.command == "changes":
+        changed = changed_npis(args.since, args.store)
+        if args.output:
+            with open(args.output, "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(["NPI", "Change"])
+                writer.writerows(changed.items())
+            print(f"{len(changed)} NPIs written to {args.output}")
+        else:
+            for npi, change in changed.items():
+                print(npi, change)
+
+
+if __name__ == "__main__":
+    main()
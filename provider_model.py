@@ -0,0 +1,196 @@
+import pandas as pd
+
+import metrics
+
+# Provider-level fields from the registry "basic" block, in display order
+BASIC_FIELDS = [
+    ("First Name", "first_name"),
+    ("Last Name", "last_name"),
+    ("Middle Name", "middle_name"),
+    ("Credential", "credential"),
+    ("Sole Proprietor", "sole_proprietor"),
+    ("Gender", "gender"),
+    ("Enumeration Date", "enumeration_date"),
+    ("Last Updated", "last_updated"),
+    ("Certification Date", "certification_date"),
+]
+PROVIDER_COLUMNS = ["NPI ID"] + [column for column, _ in BASIC_FIELDS] + ["Status", "Enumeration Type"]
+
+# Child table name -> (wide column prefix, registry list key, [(column, registry field)])
+CHILD_TABLES = {
+    "addresses": ("Address", "addresses", [
+        ("Purpose", "address_purpose"), ("Type", "address_type"), ("Address1", "address_1"),
+        ("Address2", "address_2"), ("City", "city"), ("State", "state"), ("Postal Code", "postal_code"),
+        ("Telephone", "telephone_number"), ("Fax", "fax_number"),
+    ]),
+    "practice_locations": ("PracticeLocation", "practiceLocations", [
+        ("Address1", "address_1"), ("City", "city"), ("State", "state"), ("Postal Code", "postal_code"),
+        ("Telephone", "telephone_number"), ("Fax", "fax_number"),
+    ]),
+    "taxonomies": ("Taxonomy", "taxonomies", [
+        ("Code", "code"), ("Description", "desc"), ("State", "state"), ("License", "license"), ("Primary", "primary"),
+    ]),
+    "identifiers": ("Identifier", "identifiers", [
+        ("Code", "code"), ("Description", "desc"), ("Identifier", "identifier"), ("State", "state"),
+    ]),
+}
+
+# Low-cardinality columns stored as categoricals
+CATEGORICAL_COLUMNS = {"Credential", "Sole Proprietor", "Gender", "Status", "Enumeration Type", "Purpose", "Type",
+                       "City", "State", "Code", "Description", "Primary", "NPI Check", "Geocode Source"}
+
+
+# The flatteners below work from (column, field) tables resolved once at import, so each record is a run of
+# dict lookups with no key formatting. Wide column names are prebuilt for the first _PREBUILT_POSITIONS entries.
+_PREBUILT_POSITIONS = 64
+
+
+def _wide_columns(prefix, columns, position):
+    return tuple(f"{prefix}_{position + 1}_{column}" for column in columns)
+
+
+# The registry's Primary flag is a boolean; it is kept as text like every other child field
+TEXT_COLUMNS = {"Primary"}
+
+
+def _child_layout():
+    # Per child table: (table name, registry list key, wide prefix, [(index, column, field)] for fields kept as
+    # they are, the same for fields converted to text, prebuilt wide names per position)
+    layout = []
+    for name, (prefix, key, fields) in CHILD_TABLES.items():
+        columns = [column for column, _ in fields]
+        indexed = [(i, column, field) for i, (column, field) in enumerate(fields)]
+        layout.append((name, key, prefix,
+                       [entry for entry in indexed if entry[1] not in TEXT_COLUMNS],
+                       [entry for entry in indexed if entry[1] in TEXT_COLUMNS],
+                       [_wide_columns(prefix, columns, position) for position in range(_PREBUILT_POSITIONS)]))
+    return layout
+
+
+_CHILD_LAYOUT = _child_layout()
+
+
+def flatten_npi_record(npi_details, npi_id):
+    # One registry record (or not-found placeholder) as a flat Address_N_* / Taxonomy_N_* dict
+    basic = npi_details.get("basic", {})
+    record = {"NPI ID": npi_id}
+    for column, field in BASIC_FIELDS:
+        record[column] = basic.get(field, "")
+    record["Status"] = "Found" if npi_details.get("number", "") else "Not Found"
+    record["Enumeration Type"] = npi_details.get("enumeration_type", "")
+    for name, key, prefix, plain, text, prebuilt in _CHILD_LAYOUT:
+        for position, entry in enumerate(npi_details.get(key, ())):
+            if position < _PREBUILT_POSITIONS:
+                names = prebuilt[position]
+            else:
+                names = _wide_columns(prefix, [column for column, _ in CHILD_TABLES[name][2]], position)
+            for i, _, field in plain:
+                record[names[i]] = entry.get(field, "")
+            for i, _, field in text:
+                record[names[i]] = str(entry.get(field, ""))
+    return record
+
+
+def _make_appender(providers, children):
+    # Binds the column lists' append methods once and returns append(row, npi_details, npi_id),
+    # which adds one record to every table
+    add_npi = providers["NPI ID"].append
+    add_status = providers["Status"].append
+    add_type = providers["Enumeration Type"].append
+    basic_adds = [(providers[column].append, field) for column, field in BASIC_FIELDS]
+    child_adds = [(key, children[name]["row"].append, children[name]["position"].append,
+                   [(children[name][column].append, field) for _, column, field in plain],
+                   [(children[name][column].append, field) for _, column, field in text])
+                  for name, key, _, plain, text, _ in _CHILD_LAYOUT]
+
+    def append(row, npi_details, npi_id):
+        basic = npi_details.get("basic", {})
+        add_npi(npi_id)
+        for add, field in basic_adds:
+            add(basic.get(field, ""))
+        add_status("Found" if npi_details.get("number", "") else "Not Found")
+        add_type(npi_details.get("enumeration_type", ""))
+        for key, add_row, add_position, plain_adds, text_adds in child_adds:
+            for position, entry in enumerate(npi_details.get(key, ())):
+                add_row(row)
+                add_position(position)
+                for add, field in plain_adds:
+                    add(entry.get(field, ""))
+                for add, field in text_adds:
+                    add(str(entry.get(field, "")))
+    return append
+
+
+def _compact(name, values):
+    if name in CATEGORICAL_COLUMNS:
+        return pd.Categorical(values)
+    return values
+
+
+class ProviderTables:
+    # One row per provider plus one row per address, practice location, taxonomy and identifier.
+    # Child rows point at their provider through "row" (the provider's position) and keep their list "position".
+    # wide() rebuilds the flat Address_N_* / Taxonomy_N_* layout for display and export. Only the copy kept between
+    # reruns is smaller; a page that renders or exports holds the wide view as well while it does.
+
+    def __init__(self, providers, children):
+        self.providers = providers
+        self.children = children
+
+    @classmethod
+    @metrics.timed("build_tables")
+    def from_details(cls, npi_details_list):
+        providers = {column: [] for column in PROVIDER_COLUMNS}
+        children = {name: {"row": [], "position": [], **{column: [] for column, _ in fields}}
+                    for name, (_, _, fields) in CHILD_TABLES.items()}
+
+        append = _make_appender(providers, children)
+        for row, npi_details in enumerate(npi_details_list):
+            # Registry results carry created_epoch; anything else is a not-found or error placeholder
+            if "created_epoch" in npi_details:
+                append(row, npi_details, npi_details.get("number", ""))
+            else:
+                append(row, npi_details, npi_details.get("NPI ID", ""))
+
+        provider_frame = pd.DataFrame({column: _compact(column, values) for column, values in providers.items()})
+        child_frames = {}
+        for name, table in children.items():
+            frame = pd.DataFrame({column: _compact(column, values) for column, values in table.items()})
+            child_frames[name] = frame.astype({"row": "int32", "position": "int16"})
+        return cls(provider_frame, child_frames)
+
+    @property
+    def empty(self):
+        return self.providers.empty
+
+    def __len__(self):
+        return len(self.providers)
+
+    def set_columns(self, frame, columns):
+        # Copy derived per-provider columns (e.g. coordinates) from a wide view back into the provider table
+        for column in columns:
+            self.providers[column] = _compact(column, frame[column].to_numpy())
+
+    @metrics.timed("wide_view")
+    def wide(self):
+        # Provider columns up to "Enumeration Type" come first, then the numbered child columns,
+        # then any per-provider columns added later (Full Address, coordinates, ...)
+        split = self.providers.columns.get_loc("Enumeration Type") + 1
+        parts = [self.providers.iloc[:, :split]]
+        for name, (prefix, _, fields) in CHILD_TABLES.items():
+            columns = [column for column, _ in fields]
+            for position, group in self.children[name].groupby("position", sort=True):
+                block = group.set_index("row")[columns].reindex(self.providers.index)
+                block.columns = [f"{prefix}_{position + 1}_{column}" for column in columns]
+                parts.append(block)
+        parts.append(self.providers.iloc[:, split:])
+
+        wide = pd.concat(parts, axis=1)
+        # Plain values in the view, so callers can fill gaps with "" without touching categories
+        return wide.astype({column: dtype.categories.dtype for column, dtype in wide.dtypes.items()
+                            if isinstance(dtype, pd.CategoricalDtype)})
+
+    def memory_usage(self):
+        # Bytes held by the provider and child tables
+        frames = [self.providers] + list(self.children.values())
+        return int(sum(frame.memory_usage(deep=True).sum() for frame in frames))
@@ -0,0 +1,225 @@
+import threading
+import time
+
+import requests
+
+import metrics
+from config import (HTTP_RATE_LIMITS, HTTP_DEFAULT_RATE_LIMIT, HTTP_RATE_DECREASE, HTTP_RATE_INCREASE, HTTP_RATE_MIN,
+                    HTTP_CIRCUIT_FAILURE_THRESHOLD, HTTP_CIRCUIT_OPEN_SECONDS, HTTP_CIRCUIT_WAIT_MAX)
+
+# One limiter and one breaker per host, shared by every Streamlit session and worker thread in the process
+
+_limiters = {}
+_breakers = {}
+_lock = threading.Lock()
+# Fraction of each host's limit this process may use; the processes sending requests split the limits between them
+_rate_share = 1.0
+# Set whenever a request is about to go out, so idle processes can give up their share (see jobs.share_rate_limits)
+_requests_sent = threading.Event()
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    # Raised instead of sending a request while a host is paused; callers already handle ConnectionError
+    pass
+
+
+class AdaptiveRateLimiter:
+    # Token bucket whose rate halves on every 429 and climbs back towards the configured rate with each success.
+    # A Retry-After pauses the whole bucket, so every thread holds off, not just the one that was told.
+
+    def __init__(self, endpoint, rate, min_rate=HTTP_RATE_MIN, share=1.0):
+        self.endpoint = endpoint
+        # The host's full limit; this process may use share of it
+        self.host_rate = rate
+        rate *= share
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min(min_rate, rate)
+        # Up to one second's worth of requests may go out back to back
+        self.burst = max(1.0, rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+        metrics.set_gauge("rate_limit_per_second", rate, endpoint=endpoint)
+
+    def _refill(self, now):
+        # No tokens accrue while paused
+        since = max(self._updated, self._paused_until)
+        if now > since:
+            self._tokens = min(self.burst, self._tokens + (now - since) * self.rate)
+        self._updated = max(now, self._updated)
+
+    def acquire(self):
+        # Reserve the next slot and sleep until it comes up; returns the seconds waited.
+        # Tokens go negative while callers queue up, so threads are served in arrival order.
+        _requests_sent.set()
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= 1
+            wait = max(0.0, self._paused_until - now) + max(0.0, -self._tokens) / self.rate
+        if wait > 0:
+            metrics.observe("rate_limit_wait_seconds", wait, endpoint=self.endpoint)
+            time.sleep(wait)
+        return wait
+
+    def ready(self):
+        # True when a request could go out now without waiting for a slot
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            return self._tokens >= 1 and now >= self._paused_until
+
+    def throttled(self, retry_after=None):
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.rate = max(self.min_rate, self.rate * HTTP_RATE_DECREASE)
+            self._tokens = min(self._tokens, 0.0)
+            if retry_after:
+                self._paused_until = max(self._paused_until, now + retry_after)
+            rate = self.rate
+        metrics.increment("rate_limit_backoffs_total", endpoint=self.endpoint)
+        metrics.set_gauge("rate_limit_per_second", rate, endpoint=self.endpoint)
+
+    def set_share(self, share):
+        # Rescale to a new share of the host's limit, keeping any backoff that is still below the new ceiling
+        with self._lock:
+            self._refill(time.monotonic())
+            at_full_rate = self.rate >= self.max_rate
+            self.max_rate = self.host_rate * share
+            self.rate = self.max_rate if at_full_rate else min(self.rate, self.max_rate)
+            self.min_rate = min(self.min_rate, self.max_rate)
+            self.burst = max(1.0, self.max_rate)
+            self._tokens = min(self._tokens, self.burst)
+            rate = self.rate
+        metrics.set_gauge("rate_limit_per_second", rate, endpoint=self.endpoint)
+
+    def succeeded(self):
+        if self.rate >= self.max_rate:
+            return
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = min(self.max_rate, self.rate + self.max_rate * HTTP_RATE_INCREASE)
+            rate = self.rate
+        metrics.set_gauge("rate_limit_per_second", rate, endpoint=self.endpoint)
+
+
+class CircuitBreaker:
+    # Closed: requests flow. Open: after failure_threshold failures in a row, requests wait (up to
+    # HTTP_CIRCUIT_WAIT_MAX) instead of hitting a failing host. Half-open: once open_seconds have passed,
+    # one trial request goes out; its success closes the circuit, its failure opens it again.
+
+    def __init__(self, endpoint, failure_threshold=HTTP_CIRCUIT_FAILURE_THRESHOLD,
+                 open_seconds=HTTP_CIRCUIT_OPEN_SECONDS):
+        self.endpoint = endpoint
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self._condition = threading.Condition()
+
+    def before_request(self, max_wait=HTTP_CIRCUIT_WAIT_MAX):
+        deadline = time.monotonic() + max_wait
+        with self._condition:
+            while True:
+                if self.state == "closed":
+                    return
+                now = time.monotonic()
+                if self.state == "open" and now >= self.opened_at + self.open_seconds:
+                    self.state = "half_open"
+                    self._trial_in_flight = False
+                if self.state == "half_open" and not self._trial_in_flight:
+                    self._trial_in_flight = True
+                    return
+                if now >= deadline:
+                    metrics.increment("circuit_rejected_total", endpoint=self.endpoint)
+                    raise CircuitOpenError(f"{self.endpoint} is paused after repeated failures")
+                # Woken early when the trial request finishes
+                reopen = self.opened_at + self.open_seconds - now if self.state == "open" else deadline - now
+                self._condition.wait(max(0.01, min(reopen, deadline - now)))
+
+    def record_success(self):
+        with self._condition:
+            self.failures = 0
+            if self.state != "closed":
+                self.state = "closed"
+                self._trial_in_flight = False
+                metrics.set_gauge("circuit_open", 0, endpoint=self.endpoint)
+                self._condition.notify_all()
+
+    def record_failure(self):
+        with self._condition:
+            self.failures += 1
+            if self.state == "half_open" or (self.state == "closed" and self.failures >= self.failure_threshold):
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                self._trial_in_flight = False
+                metrics.increment("circuit_opened_total", endpoint=self.endpoint)
+                metrics.set_gauge("circuit_open", 1, endpoint=self.endpoint)
+                self._condition.notify_all()
+
+    def seconds_until_retry(self):
+        # While open: seconds until the next trial request; otherwise None
+        with self._condition:
+            if self.state != "open":
+                return None
+            return max(0.0, self.opened_at + self.open_seconds - time.monotonic())
+
+
+def set_rate_share(share):
+    # Limiters that already exist are rescaled, so the share can follow processes joining and leaving
+    global _rate_share
+    with _lock:
+        if share == _rate_share:
+            return
+        _rate_share = share
+        limiters = list(_limiters.values())
+    for limiter in limiters:
+        limiter.set_share(share)
+
+
+def wait_for_requests(timeout=None):
+    # True when a request went out since the last call, waiting up to timeout seconds (None: until one does)
+    sent = _requests_sent.wait(timeout)
+    _requests_sent.clear()
+    return sent
+
+
+def get_limiter(endpoint, rate=None):
+    # rate only applies when the endpoint's limiter is first created
+    with _lock:
+        limiter = _limiters.get(endpoint)
+        if limiter is None:
+            rate = rate or HTTP_RATE_LIMITS.get(endpoint, HTTP_DEFAULT_RATE_LIMIT)
+            limiter = _limiters[endpoint] = AdaptiveRateLimiter(endpoint, rate, share=_rate_share)
+    return limiter
+
+
+def get_breaker(endpoint):
+    with _lock:
+        breaker = _breakers.get(endpoint)
+        if breaker is None:
+            breaker = _breakers[endpoint] = CircuitBreaker(endpoint)
+    return breaker
+
+
+def endpoint_status():
+    # Current rate and circuit state per host, for the UI
+    with _lock:
+        endpoints = sorted(set(_limiters) | set(_breakers))
+    status = []
+    for endpoint in endpoints:
+        limiter = _limiters.get(endpoint)
+        breaker = _breakers.get(endpoint)
+        status.append({
+            "endpoint": endpoint,
+            "rate": limiter.rate if limiter else None,
+            "max_rate": limiter.max_rate if limiter else None,
+            "state": breaker.state if breaker else "closed",
+            "retry_in": breaker.seconds_until_retry() if breaker else None,
+        })
+    return status
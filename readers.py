@@ -0,0 +1,101 @@
+import pandas as pd
+from openpyxl import load_workbook
+
+from config import READER_CHUNK_SIZE
+
+
+class InputFileError(Exception):
+    pass
+
+
+def _rewind(source):
+    if hasattr(source, "seek"):
+        source.seek(0)
+
+
+def _iter_xlsx(source, chunk_size):
+    # Read-only mode streams rows from the sheet XML instead of building the whole workbook
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(min_row=2, max_col=1, values_only=True)
+        chunk = []
+        for row in rows:
+            value = row[0] if row else None
+            chunk.append("" if value is None else str(value))
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+    finally:
+        workbook.close()
+
+
+def _iter_csv(source, chunk_size):
+    # Only the first column is parsed, as plain strings
+    reader = pd.read_csv(source, usecols=[0], dtype=str, keep_default_na=False, chunksize=chunk_size)
+    for frame in reader:
+        yield frame.iloc[:, 0].tolist()
+
+
+def _skip(chunks, skip_rows):
+    # Drop the first skip_rows parsed rows. Counting parsed rows rather than file lines keeps resumes
+    # in step with the rows actually processed, since the CSV parser leaves out blank lines.
+    for chunk in chunks:
+        if skip_rows >= len(chunk):
+            skip_rows -= len(chunk)
+            continue
+        yield chunk[skip_rows:]
+        skip_rows = 0
+
+
+def iter_first_column(source, filename=None, chunk_size=READER_CHUNK_SIZE, skip_rows=0):
+    # Yield the first column of a CSV/XLSX file (path or file-like) as lists of strings, skipping the header row
+    # and then the first skip_rows data rows
+    filename = filename or str(source)
+    _rewind(source)
+    chunks = _iter_xlsx if filename.lower().endswith(".xlsx") else _iter_csv
+    try:
+        yield from _skip(chunks(source, chunk_size), skip_rows)
+    except Exception as e:
+        raise InputFileError(str(e)) from e
+
+
+def count_rows(source, filename=None):
+    # Number of data rows (header excluded) for progress reporting, or None when it cannot be told cheaply
+    filename = filename or str(source)
+    try:
+        if filename.lower().endswith(".xlsx"):
+            _rewind(source)
+            workbook = load_workbook(source, read_only=True)
+            try:
+                # Taken from the sheet's dimension record, which some writers leave out
+                rows = workbook.active.max_row
+            finally:
+                workbook.close()
+            return max(rows - 1, 0) if rows else None
+
+        _rewind(source)
+        f = source if hasattr(source, "read") else open(source, "rb")
+        try:
+            lines = 0
+            last = b"\n"
+            for block in iter(lambda: f.read(1 << 20), b""):
+                lines += block.count(b"\n")
+                last = block[-1:]
+            if last != b"\n":
+                lines += 1
+        finally:
+            if f is not source:
+                f.close()
+        return max(lines - 1, 0)
+    except Exception:
+        return None
+    finally:
+        _rewind(source)
+
+
+def iter_first_column_values(source, filename=None, chunk_size=READER_CHUNK_SIZE):
+    # Same as iter_first_column, one value at a time
+    for chunk in iter_first_column(source, filename, chunk_size):
+        yield from chunk
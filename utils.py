@@ -1,52 +1,33 @@
+import hashlib
 import streamlit as st
-from geopy.geocoders import Nominatim
-from geopy.exc import GeocoderTimedOut, GeocoderServiceError
+from geocoding import geocode, geocode_candidates
+from config import SESSION_RESULTS_MAX_ENTRIES
 
 def get_coordinates(address):
-    geolocator = Nominatim(user_agent="aic_npi_locator")
-    try:
-        # Add country bias to the search
-        location = geolocator.geocode(address, country_codes="us")
-        
-        if location:
-            # Extract full address
-            full_address = location.raw['display_name']
-            
-            # Verify if the result is in the USA
-            if "United States" in full_address:
-                return location.latitude, location.longitude, full_address
-            else:
-                return None, None, None
-        else:
-            return None, None, None
-    except (GeocoderTimedOut, GeocoderServiceError):
-        return None, None, None
+    return geocode(address)
 
 def get_coordinates_multiple(address, max_results=5):
-    geolocator = Nominatim(user_agent="aic_npi_locator")
-    try:
-        # Get multiple results
-        locations = geolocator.geocode(address, country_codes="us", exactly_one=False, limit=max_results)
-        
-        if locations:
-            results = []
-            for location in locations:
-                full_address = location.raw['display_name']
-                
-                # Verify if the result is in the USA
-                if "United States" in full_address:
-                    results.append({
-                        'latitude': location.latitude,
-                        'longitude': location.longitude,
-                        'address': full_address
-                    })
-            
-            return results
-        else:
-            return []
-    except (GeocoderTimedOut, GeocoderServiceError):
-        return []
-        
+    return geocode_candidates(address, max_results=max_results)
+
+def input_signature(*parts):
+    # Stable key for a search input; uploaded files are passed as their bytes
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else repr(part).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+def remember_results(name, signature, results):
+    # Finished searches live in the session so reruns (map, table, download clicks) redraw them without refetching
+    history = st.session_state.setdefault(name, {})
+    history.pop(signature, None)
+    history[signature] = results
+    while len(history) > SESSION_RESULTS_MAX_ENTRIES:
+        history.pop(next(iter(history)))
+
+def recall_results(name, signature):
+    return st.session_state.get(name, {}).get(signature)
+
 def set_page_config():
     st.set_page_config(page_title="AIC/NPI Locator", page_icon="🏥", layout="wide")
 
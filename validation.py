@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+
+# NPIs use the ISO 7812 Luhn scheme with the "80840" card-issuer prefix, which always adds 24 to the sum
+NPI_PREFIX_SUM = 24
+
+CHECK_VALID = "Valid"
+CHECK_DUPLICATE = "Duplicate"
+CHECK_BLANK = "Blank"
+CHECK_MALFORMED = "Malformed"
+CHECK_BAD_DIGIT = "Invalid check digit"
+
+
+def normalize_npi_ids(npi_ids):
+    # Strip whitespace and the ".0" Excel adds to numeric cells
+    npi_ids = pd.Series(npi_ids, dtype=object).fillna("").astype(str).str.strip()
+    return npi_ids.str.replace(r"^(\d+)\.0*$", r"\1", regex=True)
+
+
+def npi_check_digits_valid(npi_ids):
+    # Luhn check over a Series of 10-digit strings, computed on a digit matrix rather than row by row
+    if len(npi_ids) == 0:
+        return pd.Series([], dtype=bool, index=npi_ids.index)
+    digits = np.frombuffer("".join(npi_ids).encode("ascii"), dtype=np.uint8).reshape(-1, 10).astype(np.int64) - 48
+    payload = digits[:, :9]
+    doubled = payload[:, ::2] * 2
+    doubled -= 9 * (doubled > 9)
+    total = NPI_PREFIX_SUM + doubled.sum(axis=1) + payload[:, 1::2].sum(axis=1)
+    return pd.Series((10 - total % 10) % 10 == digits[:, 9], index=npi_ids.index)
+
+
+def preflight_npi_ids(npi_ids):
+    # Returns the normalized IDs and a check label per row; only "Valid" rows need a lookup
+    normalized = normalize_npi_ids(npi_ids)
+    checks = pd.Series(CHECK_MALFORMED, index=normalized.index, dtype=object)
+    checks[normalized == ""] = CHECK_BLANK
+
+    well_formed = normalized.str.fullmatch(r"\d{10}")
+    valid = pd.Series(False, index=normalized.index)
+    valid[well_formed] = npi_check_digits_valid(normalized[well_formed])
+    checks[well_formed & ~valid] = CHECK_BAD_DIGIT
+    checks[valid] = CHECK_VALID
+    checks[valid & normalized.duplicated()] = CHECK_DUPLICATE
+    return normalized, checks
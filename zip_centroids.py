@@ -0,0 +1,80 @@
+import threading
+
+import pandas as pd
+
+try:
+    import zipcodes
+except ImportError:
+    zipcodes = None
+
+_index = None
+_lock = threading.Lock()
+
+
+def _build_index():
+    # ZIP -> centroid, plus city/state and state centroids averaged from their ZIPs
+    by_zip = {}
+    city_points = {}
+    state_points = {}
+    for entry in zipcodes.list_all():
+        try:
+            point = (float(entry["lat"]), float(entry["long"]))
+        except (KeyError, TypeError, ValueError):
+            continue
+        state = entry["state"].upper()
+        by_zip[entry["zip_code"]] = point
+        for city in [entry["city"]] + entry.get("acceptable_cities", []):
+            city_points.setdefault(f"{city.upper()}|{state}", []).append(point)
+        state_points.setdefault(state, []).append(point)
+
+    def mean(points):
+        return (sum(p[0] for p in points) / len(points), sum(p[1] for p in points) / len(points))
+
+    return {
+        "zip": by_zip,
+        "city": {key: mean(points) for key, points in city_points.items()},
+        "state": {key: mean(points) for key, points in state_points.items()},
+    }
+
+
+def centroid_index():
+    global _index
+    if zipcodes is None:
+        return None
+    with _lock:
+        if _index is None:
+            _index = _build_index()
+    return _index
+
+
+def centroid_available():
+    return zipcodes is not None
+
+
+def locate_centroids(postal_codes, cities, states):
+    # Vectorized lookup: ZIP centroid first, then city/state, then state.
+    # Returns Latitude, Longitude and Geocode Source columns aligned with the inputs.
+    postal_codes = pd.Series(postal_codes).fillna("").astype(str)
+    index = postal_codes.index
+    cities = pd.Series(cities, index=index).fillna("").astype(str).str.strip().str.upper()
+    states = pd.Series(states, index=index).fillna("").astype(str).str.strip().str.upper()
+
+    result = pd.DataFrame({"Latitude": float("nan"), "Longitude": float("nan"), "Geocode Source": ""}, index=index)
+    centroids = centroid_index()
+    if centroids is None:
+        return result
+
+    tiers = (
+        ("ZIP centroid", postal_codes.str.strip().str[:5], centroids["zip"]),
+        ("City centroid", cities + "|" + states, centroids["city"]),
+        ("State centroid", states, centroids["state"]),
+    )
+    for source, keys, table in tiers:
+        missing = result["Geocode Source"] == ""
+        if not missing.any():
+            break
+        points = keys[missing].map(table).dropna()
+        result.loc[points.index, "Latitude"] = points.str[0]
+        result.loc[points.index, "Longitude"] = points.str[1]
+        result.loc[points.index, "Geocode Source"] = source
+    return result